@@ -0,0 +1,273 @@
+"""
+Benchmark suite for the loaders and queries in AI3_Functions.
+
+Synthetic school location, census and population files (in the same
+formats as the ACT data files) are generated at several sizes, with the
+number of schools, suburbs, census dates and population years scaled
+independently. Every loader and query is timed (best of a few repeats)
+and its peak traced memory recorded; results are saved as JSON and can
+be compared against a saved baseline to flag regressions.
+
+Usage: python3 AI3_Benchmark.py [--sizes small medium] [--output FILE]
+                                [--baseline FILE] [--tolerance 0.25]
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import os
+import sys
+import csv
+import json
+import time
+import random
+import platform
+import subprocess
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+from AI3_Functions import *
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+SIZES = {
+    'small':  {'schools': 50,   'suburbs': 25,  'dates': 6,  'years': 3},
+    'medium': {'schools': 250,  'suburbs': 110, 'dates': 20, 'years': 6},
+    'large':  {'schools': 1000, 'suburbs': 400, 'dates': 40, 'years': 10},
+}
+SCHOOL_HEADER = ['School Name', 'Street Address', 'Suburb', 'Sector', 'Type', 'Location 1']
+CENSUS_HEADER = ['Census', 'School Name', 'Category', 'Year Level', 'Students']
+SCHOOL_TYPES = [('Primary School', YEAR_NAMES[0:7]),
+                ('High School', YEAR_NAMES[7:11]),
+                ('College', YEAR_NAMES[11:14]),
+                ('School', YEAR_NAMES[0:11])]
+FIRST_CENSUS_YEAR = 2009
+FIRST_POPULATION_YEAR = 2015
+AGES_RANGE = 86
+
+
+###   ###   ----------------------------------------------------------------
+###  SYNTHETIC DATA GENERATOR
+def generate_dataset(directory, schools=250, suburbs=110, dates=20, years=6, seed=0):
+    """
+    Writes synthetic school location, census and population data files
+    to directory and returns their paths as a 3-tuple (school, census,
+    population). schools and suburbs set the number of each, dates the
+    number of census dates (February and August of successive years, from
+    2009) and years the number of population projection years (from 2015)
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    school_file = os.path.join(directory, 'schools.csv')
+    census_file = os.path.join(directory, 'census.csv')
+    pop_file = os.path.join(directory, 'population.csv')
+    suburb_names = [f'Suburb {i:04d}' for i in range(suburbs)]
+
+    # School locations: every school in a random suburb, some named "..., The" in the census.
+    listing = []
+    with open(school_file, 'w', newline='') as fopen:
+        writer = csv.writer(fopen)
+        writer.writerow(SCHOOL_HEADER)
+        for i in range(schools):
+            kind, levels = SCHOOL_TYPES[i % len(SCHOOL_TYPES)]
+            suburb = rng.choice(suburb_names)
+            name = f'{suburb} {kind} {i:04d}'
+            sector = rng.choice(['Gov', 'Non-Gov'])
+            census_name = f'{name}, The' if rng.random() < 0.05 else name
+            listing.append((census_name, sector, levels))
+            lat, lon = -35.3 + rng.uniform(-0.2, 0.2), 149.1 + rng.uniform(-0.2, 0.2)
+            writer.writerow([name, f'{i} Example Street', suburb,
+                             'Government' if sector == 'Gov' else 'Non-Government',
+                             kind, f'({lat:.6f}, {lon:.6f})'])
+
+    # Census: every school and year level on every census date.
+    with open(census_file, 'w', newline='') as fopen:
+        writer = csv.writer(fopen)
+        writer.writerow(CENSUS_HEADER)
+        for d in range(dates):
+            month = 'February' if d % 2 == 0 else 'August'
+            census = f'{rng.randint(1, 28):02d} {month} {FIRST_CENSUS_YEAR + d // 2}'
+            for census_name, sector, levels in listing:
+                for level in levels:
+                    writer.writerow([census, census_name, sector, level, rng.randint(5, 200)])
+
+    # Population projections: one row per suburb and year, 86 female then 86 male ages.
+    with open(pop_file, 'w', newline='') as fopen:
+        writer = csv.writer(fopen)
+        ages = [str(a) for a in range(AGES_RANGE - 1)] + [f'{AGES_RANGE - 1}+']
+        writer.writerow(['Year', 'Suburb'] + [f'{sex} AGE {a}' for sex in ('FEMALE', 'MALE') for a in ages])
+        for suburb in suburb_names:
+            for y in range(years):
+                counts = [rng.randint(0, 60) for _ in range(2 * AGES_RANGE)]
+                writer.writerow([f'06/30/{FIRST_POPULATION_YEAR + y} 12:00:00 AM', f'{suburb:<11}'] + counts)
+    return school_file, census_file, pop_file
+
+
+###   ###   ----------------------------------------------------------------
+###  MEASUREMENT
+def measure(function, repeat=3, setup=None):
+    """
+    Runs function() repeat times and returns a dictionary with the best
+    wall time in seconds, and the peak traced memory in bytes of one more
+    (traced) run; setup(), if given, runs untimed before every call
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+def cold_start(files, repeat=3):
+    """
+    Times fresh interpreters running the AI3_Query command line over the
+    data files (school, census, population) and, for reference, doing
+    nothing; returns a dictionary keyed by benchmark name of the best
+    wall times (the memory of the child processes is not traced)
+    """
+    school_file, census_file, pop_file = files
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AI3_Query.py')
+    commands = {
+        'interpreter[cold start]': [sys.executable, '-c', 'pass'],
+        'AI3_Query[cold start]': [sys.executable, script, str(FIRST_POPULATION_YEAR),
+                                  '--school-file', school_file, '--enrol-file', census_file,
+                                  '--pop-file', pop_file],
+    }
+    results = {}
+    for name, command in commands.items():
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            best = min(best, time.perf_counter() - start)
+        results[name] = {'seconds': best, 'peak_bytes': 0}
+    return results
+
+def benchmark_size(files, repeat=3):
+    """
+    Times every loader and query over the data files (school, census,
+    population) and returns a dictionary keyed by benchmark name
+    """
+    school_file, census_file, pop_file = files
+    schools = get_school_data(school_file)
+    schools_array = get_school_data(school_file, columnar=True)
+    enrolment = read_enrolment_data(census_file)
+    enrolment_array = read_enrolment_data(census_file, columnar=True)
+    store = read_enrolment_store(census_file)
+    index = build_enrolment_index(enrolment)
+    population = read_population_data(pop_file)
+    cube = read_population_data(pop_file, columnar=True)
+    year = int(enrolment[len(enrolment) // 2][0][:4]) if enrolment else FIRST_CENSUS_YEAR
+    pop_year = next(iter(population))[1] if population else FIRST_POPULATION_YEAR
+    levels = list(range(0, 7))
+
+    benchmarks = {
+        'get_school_data': (lambda: get_school_data(school_file), None),
+        'get_school_data[columnar]': (lambda: get_school_data(school_file, columnar=True), None),
+        'read_enrolment_data': (lambda: read_enrolment_data(census_file), clear_conversion_caches),
+        'read_enrolment_data[columnar]': (lambda: read_enrolment_data(census_file, columnar=True), clear_conversion_caches),
+        'read_enrolment_store': (lambda: read_enrolment_store(census_file), clear_conversion_caches),
+        'read_enrolment_data[one year]': (lambda: read_enrolment_data(census_file, years=year, levels=levels),
+                                          clear_conversion_caches),
+        'read_population_data': (lambda: read_population_data(pop_file), clear_conversion_caches),
+        'read_population_data[columnar]': (lambda: read_population_data(pop_file, columnar=True), clear_conversion_caches),
+        'build_enrolment_index': (lambda: build_enrolment_index(enrolment), None),
+        'get_yearly_enrolment': (lambda: get_yearly_enrolment(enrolment, year, levels), None),
+        'get_yearly_enrolment[index]': (lambda: get_yearly_enrolment(index, year, levels), None),
+        'get_yearly_enrolment[store]': (lambda: get_yearly_enrolment(store, year, levels), None),
+        'get_yearly_enrolment[columnar]': (lambda: get_yearly_enrolment(enrolment_array, year, levels), None),
+        'enrolment_vs_population': (lambda: enrolment_vs_population(
+            enrolment, schools, population, JUNIOR_SCHOOL_AGES, pop_year), None),
+        'enrolment_vs_population[columnar]': (lambda: enrolment_vs_population(
+            enrolment_array, schools_array, cube, JUNIOR_SCHOOL_AGES, pop_year), None),
+        'enrolment_vs_population_sweep': (lambda: enrolment_vs_population_sweep(
+            enrolment, schools, cube, [level_band(JUNIOR_SCHOOL_AGES), level_band(SECONDARY_SCHOOL_AGES)],
+            [4, 5, 6, 7], sorted({key[1] for key in population})), None),
+        'enrolment_vs_population_batch': (lambda: enrolment_vs_population_batch(
+            enrolment, schools, cube, [JUNIOR_SCHOOL_AGES, SECONDARY_SCHOOL_AGES],
+            sorted({key[1] for key in population})), None),
+    }
+    results = {}
+    for name, (function, setup) in benchmarks.items():
+        results[name] = measure(function, repeat, setup)
+    results.update(cold_start(files, repeat))
+    return results
+
+def run_benchmarks(sizes=('small', 'medium'), repeat=3, directory=None, seed=0):
+    """
+    Generates a dataset for every size (a key of SIZES) and benchmarks it;
+    returns a JSON-serialisable dictionary of the results
+    """
+    report = {'python': platform.python_version(), 'numpy': np.__version__,
+              'platform': platform.platform(), 'repeat': repeat, 'sizes': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            params = SIZES[size]
+            files = generate_dataset(os.path.join(directory or tmp, size), seed=seed, **params)
+            report['sizes'][size] = {
+                'params': params,
+                'bytes': {os.path.basename(f): os.path.getsize(f) for f in files},
+                'results': benchmark_size(files, repeat),
+            }
+    return report
+
+def compare(report, baseline, tolerance=0.25):
+    """
+    Compares a report with a baseline report (both from run_benchmarks) and
+    returns a list of (size, benchmark, baseline seconds, seconds) for every
+    benchmark more than tolerance (a fraction) slower than the baseline
+    """
+    regressions = []
+    for size, entry in report['sizes'].items():
+        base = baseline.get('sizes', {}).get(size, {}).get('results', {})
+        for name, result in entry['results'].items():
+            if name in base and result['seconds'] > base[name]['seconds'] * (1 + tolerance):
+                regressions.append((size, name, base[name]['seconds'], result['seconds']))
+    return regressions
+
+def print_report(report, file=sys.stdout):
+    """Prints the results of a report as a table"""
+    for size, entry in report['sizes'].items():
+        print(f'{size}: {entry["params"]}', file=file)
+        for name, result in entry['results'].items():
+            print(f'    {name:<36} {result["seconds"] * 1000:10.2f} ms '
+                  f'{result["peak_bytes"] / 2**20:10.2f} MiB', file=file)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks the AI3_Functions loaders and queries')
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=sorted(SIZES))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark (best is kept)')
+    parser.add_argument('--output', help='file to save the results to, as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown (fraction) over the baseline reported as a regression')
+    parser.add_argument('--data-dir', help='keep the generated data files in this directory')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.repeat, args.data_dir)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as fopen:
+            json.dump(report, fopen, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fopen:
+            regressions = compare(report, json.load(fopen), args.tolerance)
+        for size, name, before, after in regressions:
+            print(f'REGRESSION {size} {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,172 @@
+"""
+On-disk cache of the parsed school, enrolment and population data.
+
+The parsed datasets (in their columnar forms, see AI3_Functions) are
+stored as .npy files in a cache directory next to the source files, with
+a small JSON manifest per source file recording its path, size, mtime and
+content hash. Later runs memory-map the .npy files instead of parsing the
+CSVs; a stale or unreadable cache entry is rebuilt automatically.
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+
+from AI3_Functions import (dt_school, dt_census, get_school_data,
+                           read_enrolment_data, read_population_data,
+                           PopulationCube)
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+CACHE_DIR_NAME = '.ai3_cache'
+CACHE_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20
+
+
+###   ###   ----------------------------------------------------------------
+###  CACHE KEYS
+def file_key(fname):
+    """
+    Returns the dictionary identifying the current contents of fname:
+    absolute path, size, mtime (ns) and SHA-256 of the contents
+    """
+    stat = os.stat(fname)
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as fopen:
+        for chunk in iter(lambda: fopen.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return {'path': os.path.abspath(fname),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest.hexdigest()}
+
+def cache_paths(fname, kind, cache_dir=None):
+    """
+    Returns the cache file prefix for the dataset kind parsed from fname
+    (the cache directory defaults to .ai3_cache next to fname)
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(fname)), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, f'{os.path.basename(fname)}.{kind}')
+
+
+###   ###   ----------------------------------------------------------------
+###  READ / WRITE CACHE ENTRIES
+def _save_array(path, array):
+    """Writes an array to path atomically (via a temporary file)"""
+    tmp = path + '.tmp.npy'
+    np.save(tmp, np.ascontiguousarray(array), allow_pickle=False)
+    os.replace(tmp, path)
+
+def _write_entry(prefix, key, arrays, meta):
+    """
+    Writes the arrays of a cache entry, then its manifest; the manifest is
+    written last so an interrupted write is never mistaken for a valid entry
+    """
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    for name, array in arrays.items():
+        _save_array(f'{prefix}.{name}.npy', array)
+    manifest = {'version': CACHE_VERSION, 'key': key,
+                'arrays': sorted(arrays), 'meta': meta}
+    tmp = prefix + '.json.tmp'
+    with open(tmp, 'w') as fopen:
+        json.dump(manifest, fopen)
+    os.replace(tmp, prefix + '.json')
+
+def _read_entry(prefix, key):
+    """
+    Returns (arrays, meta) of a cache entry whose manifest matches key,
+    with the arrays memory-mapped read-only, or None if the entry is
+    missing, stale or corrupt
+    """
+    try:
+        with open(prefix + '.json') as fopen:
+            manifest = json.load(fopen)
+        if manifest.get('version') != CACHE_VERSION or manifest.get('key') != key:
+            return None
+        arrays = {name: np.load(f'{prefix}.{name}.npy', mmap_mode='r', allow_pickle=False)
+                  for name in manifest['arrays']}
+        return arrays, manifest['meta']
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        print(f'{error}: cache entry {prefix} is unreadable, rebuilding', file=sys.stderr)
+        return None
+
+def _cached(fname, kind, build, rebuild, cache_dir):
+    """
+    Loads the dataset kind of fname from the cache, or builds it with
+    build(), which returns (value, arrays, meta), and caches it.
+    Returns (value, arrays, meta); value is None when read from the cache
+    """
+    key = file_key(fname)
+    prefix = cache_paths(fname, kind, cache_dir)
+    if not rebuild:
+        entry = _read_entry(prefix, key)
+        if entry is not None:
+            return (None,) + entry
+    value, arrays, meta = build()
+    try:
+        _write_entry(prefix, key, arrays, meta)
+    except OSError as error:
+        print(f'{error}: could not write cache entry {prefix}', file=sys.stderr)
+    return value, arrays, meta
+
+
+###   ###   ----------------------------------------------------------------
+###  CACHED LOADERS
+def load_school_data(fname, dt=dt_school, rebuild=False, cache_dir=None):
+    """
+    Cached get_school_data(fname, dt, columnar=True); returns the
+    structured array (memory-mapped when read from the cache)
+    """
+    def build():
+        data = get_school_data(fname, dt=dt, columnar=True)
+        if data is None:
+            raise ValueError(f'{fname}: school data could not be read')
+        return data, {'data': data}, {}
+    value, arrays, _ = _cached(fname, 'school', build, rebuild, cache_dir)
+    data = arrays['data'] if value is None else value
+    return data if data.dtype == dt else data.astype(dt)
+
+def load_enrolment_data(fname, dt=dt_census, rebuild=False, cache_dir=None):
+    """
+    Cached read_enrolment_data(fname, dt, columnar=True); returns the
+    structured array (memory-mapped when read from the cache)
+    """
+    def build():
+        data = read_enrolment_data(fname, dt=dt, columnar=True)
+        return data, {'data': data}, {}
+    value, arrays, _ = _cached(fname, 'census', build, rebuild, cache_dir)
+    data = arrays['data'] if value is None else value
+    return data if data.dtype == dt else data.astype(dt)
+
+def load_population_data(fname, ages_range=86, rebuild=False, cache_dir=None):
+    """
+    Cached read_population_data(fname, ages_range, columnar=True); returns
+    a PopulationCube (whose counts are memory-mapped when read from the cache)
+    """
+    def build():
+        cube = read_population_data(fname, ages_range=ages_range, columnar=True)
+        return (cube, {'counts': cube.counts, 'present': cube.present},
+                {'suburbs': cube.suburbs, 'years': cube.years})
+    value, arrays, meta = _cached(fname, f'population{ages_range}', build, rebuild, cache_dir)
+    if value is not None:
+        return value
+    return PopulationCube(meta['suburbs'], meta['years'], arrays['counts'], arrays['present'])
+
+def load_datasets(school_file, enrol_file, pop_file, ages_range=86,
+                  rebuild=False, cache_dir=None):
+    """
+    Returns the 3-tuple (school data, enrolment, population) of cached,
+    columnar datasets; rebuild = True forces every entry to be re-parsed
+    """
+    return (load_school_data(school_file, rebuild=rebuild, cache_dir=cache_dir),
+            load_enrolment_data(enrol_file, rebuild=rebuild, cache_dir=cache_dir),
+            load_population_data(pop_file, ages_range=ages_range,
+                                 rebuild=rebuild, cache_dir=cache_dir))
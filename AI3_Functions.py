@@ -10,9 +10,45 @@ Completed by Morgan Potter.
 
 ###   ###   ----------------------------------------------------------------
 # Import statements
+import os
+import re
 import sys
 import csv
-import numpy as np
+import importlib
+from functools import lru_cache
+from array import array
+from collections.abc import Mapping, Sequence
+
+
+###   ###   ----------------------------------------------------------------
+# NumPy
+#      NumPy is only needed by the columnar paths, so np stands in for it
+#      and imports it on first use; the list-based paths (and a quick
+#      start) never load it
+class LazyModule:
+    """
+    Stand-in for the module name, imported with importlib.import_module
+    on the first attribute access and delegated to from then on
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+np = LazyModule('numpy')
+
+def is_array(obj):
+    """
+    Returns True if obj is a NumPy array (or a subclass, such as memmap),
+    without importing NumPy -- nothing can be an array before it is loaded
+    """
+    return any(cls.__name__ == 'ndarray' and cls.__module__ == 'numpy'
+               for cls in type(obj).__mro__)
 
 
 ###   ###   ----------------------------------------------------------------
@@ -29,37 +65,78 @@ KINDERGARTEN_AGES = [5]
 PRIMARY_SCHOOL_AGES = list(range(6,12))
 JUNIOR_SCHOOL_AGES = PRESCHOOL_AGES + KINDERGARTEN_AGES + PRIMARY_SCHOOL_AGES
 SECONDARY_SCHOOL_AGES = list(range(12,18))
+AGE_GROUPS = {                 # the age groups by name, as chosen on the command line
+    'preschool': PRESCHOOL_AGES,
+    'kindergarten': KINDERGARTEN_AGES,
+    'primary': PRIMARY_SCHOOL_AGES,
+    'junior': JUNIOR_SCHOOL_AGES,
+    'secondary': SECONDARY_SCHOOL_AGES,
+}
+CONVERSION_CACHE_SIZE = 4096   # distinct raw values remembered by each memoised conversion
+SCHOOL_NAME_ALIASES = {('primary', 'school'): ('primary',),   # token pairs written either way in the two files
+                       ('high', 'school'): ('high',)}
+CAMPUS_WORDS = {'campus', 'site'}   # a ' - ... campus' tail names a campus of the school before it
+SECTORS = ['Gov', 'Non-Gov']        # school sectors, as the census Category column spells them (see convert_sector)
 
 ###   ###   ----------------------------------------------------------------
 # Numpy Data Types
-dt_school = np.dtype([
-                ('name','<U50'),
-                ('address','<U30'),
+#      dt_school, dt_census and dt_census_sector are created on first use (see numpy_dtype)
+DTYPE_FIELDS = {
+    'dt_school': [
+                ('name','<U100'),
+                ('address','<U50'),
                 ('suburb','<U30'),
-                ])
-dt_census = np.dtype([
+                ],
+    'dt_census': [
                 ('date', '<M8[D]'), 
-                ('name','<U50'),
+                ('name','<U100'),
                 ('year_level','<i8'),
                 ('enrolment','<i8'),
-                ])
+                ],
+    'dt_census_sector': [
+                ('date', '<M8[D]'),
+                ('name','<U100'),
+                ('year_level','<i8'),
+                ('enrolment','<i8'),
+                ('sector','<U7'),
+                ],
+    }
+
+@lru_cache(maxsize=None)
+def numpy_dtype(name):
+    """
+    Returns the NumPy data type name ('dt_school', 'dt_census' or
+    'dt_census_sector'), created on the first call
+    """
+    return np.dtype(DTYPE_FIELDS[name])
+
+def __getattr__(name):
+    """
+    The data types dt_school, dt_census and dt_census_sector, looked up
+    as module attributes (see numpy_dtype)
+    """
+    if name in DTYPE_FIELDS:
+        return numpy_dtype(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 ###   ###   ----------------------------------------------------------------
-def get_school_data(fname, dt=dt_school):
+def get_school_data(fname, dt=None, columnar=False):
     """
     Reads the school location data file fname, extracts values for
     school names, addresses and suburbs, packs them into 3-tuple of str
-    and returns a list of those. Alternatively, returns an NumPy
-    array with dtype=dt_school
+    and returns a list of those. Alternatively (if columnar = True),
+    returns an NumPy array with dtype=dt (default dt_school)
     """
     try:
         output = []
-        with open('ACT_School_Locations_2017_-_archived.csv') as fopen:  
+        with open(fname) as fopen:  
             csv_reader = csv.reader(fopen) 
             next(csv_reader)                        # skip the header
             for row in csv_reader: 
                 name, address, suburb = row[:3]     # slice first 3 records
                 output.append((name, address, suburb)) # append the constructed 3-tuple (I believe adding clean_school_name to name would make the output more accurate)
+        if columnar:
+            return np.array(output, dtype=numpy_dtype('dt_school') if dt is None else dt)
         return output
     except IOError as ioe:
         print(f'{ioe}: File not found or unreadable', file=sys.stderr)
@@ -132,6 +209,34 @@ def convert_level(year_level):
     """
     return SCHOOL_YEARS[year_level] # Returns year level as int.
 
+###   ###   ----------------------------------------------------------------
+###  MEMOISED CONVERSIONS
+#      The census repeats a few dates, school names and year levels
+#      on every row, so each distinct raw string is converted once
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def cached_format_date(s, short_format=True):
+    """
+    Memoised format_date; the returned string is interned
+    """
+    return sys.intern(format_date(s, short_format))
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def cached_clean_school_name(sname):
+    """
+    Memoised clean_school_name; the returned string is interned
+    """
+    return sys.intern(clean_school_name(sname))
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def cached_convert_level(year_level):
+    """
+    Memoised convert_level, which also maps 'Older & Mature' and
+    'Mature' to the level of 'Older'
+    """
+    if year_level == "Older & Mature" or year_level == "Mature": # Includes older & mature, and mature ages as older.
+        year_level = "Older"
+    return convert_level(year_level)
+
 ###   ###   ----------------------------------------------------------------
 ###  APPLY DEFINED FUNCTIONS
 #      Uses previously defined functions to clean input file
@@ -139,7 +244,7 @@ def convert_level(year_level):
 #              - clean_school_name
 #              - convert_level functions
 def convert_census_record(fields, 
-        functions=[format_date, clean_school_name, convert_level, int]):
+        functions=[cached_format_date, cached_clean_school_name, cached_convert_level, int]):
     '''
     If the three functions are implemented correctly, this function
     must return the (required part of) school census record. 
@@ -165,6 +270,33 @@ def parse_year(dt):
     """
     return int(dt.split('/')[2].split()[0]) # Splits by / into 3 sections, then splits the 3rd section, and returns the first value of the 3rd section as an int. 
 
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def cached_parse_year(dt):
+    """
+    Memoised parse_year
+    """
+    return parse_year(dt)
+
+def conversion_cache_info():
+    """
+    Returns a dictionary keyed by the name of every memoised conversion,
+    with values being dictionaries of its cache hits, misses, maxsize and
+    currsize
+    """
+    return {function.__name__: function.cache_info()._asdict()
+            for function in CONVERSION_CACHES}
+
+def clear_conversion_caches():
+    """
+    Empties the caches of the memoised conversions (and resets their
+    hit and miss counts), e.g. between data sets in a long-running process
+    """
+    for function in CONVERSION_CACHES:
+        function.cache_clear()
+
+CONVERSION_CACHES = [cached_format_date, cached_clean_school_name,
+                     cached_convert_level, cached_parse_year]
+
 ###   ###   ----------------------------------------------------------------
 ###  TASK 2
 ###  ENROLMENT DATASET CONSTRUCTION
@@ -173,29 +305,121 @@ def parse_year(dt):
 #      Applys: - format_date
 #              - clean_school_name
 #              - convert_level
-def read_enrolment_data(fname, dt=dt_census):
+def convert_sector(category):
+    """
+    Maps the census Category to one of SECTORS ('Non Gov' is also
+    written 'Non-Gov')
+    For testing:
+    convert_sector('Non Gov') should be 'Non-Gov'
+    """
+    return sys.intern(category.strip().replace(' ', '-'))
+
+def convert_enrolment_row(row):
+    """
+    Converts one row of the census data file (a list of str, as read by
+    csv.reader) into the 4-tuple read_enrolment_data returns
+    """
+    return (cached_format_date(row[0], False), cached_clean_school_name(row[1]), cached_convert_level(row[3]), float(row[4]))
+
+def convert_sector_row(row):
+    """
+    convert_enrolment_row, with the sector (see convert_sector) as a
+    fifth element
+    """
+    return convert_enrolment_row(row) + (convert_sector(row[2]),)
+
+def _filter_set(values, convert):
+    """
+    The set of the converted values: a single int or str is one value (a
+    str is not iterated character by character), anything else an
+    iterable of them
+    """
+    if isinstance(values, (int, str)):
+        values = [values]
+    return {convert(value) for value in values}
+
+def census_row_filter(years=None, sectors=None, levels=None):
+    """
+    Returns a predicate on the raw rows of the census data file (lists of
+    str, as read by csv.reader) that keeps the rows of a census year in
+    years, a sector in sectors and a year level in levels (each an int
+    or str, or an iterable of them; None keeps all), or None if nothing
+    is filtered. Only the sector, the year at the end of the date and the
+    (memoised) level are looked at, so a rejected row is never formatted,
+    cleaned or converted to float
+    """
+    if years is None and sectors is None and levels is None:
+        return None
+    if years is not None:
+        years = _filter_set(years, lambda year: str(int(year)))
+    if sectors is not None:
+        sectors = _filter_set(sectors, convert_sector)
+    if levels is not None:
+        levels = _filter_set(levels, int)
+
+    def keep(row):
+        return ((sectors is None or convert_sector(row[2]) in sectors)
+                and (years is None or row[0].rsplit(None, 1)[-1] in years)
+                and (levels is None or cached_convert_level(row[3]) in levels))
+    return keep
+
+def iter_enrolment_data(fname, batch_size=None, years=None, sectors=None, levels=None, keep_sector=False):
+    """
+    Generator version of read_enrolment_data: yields the cleaned 4-tuples
+    one at a time or, if batch_size is given, as lists of at most
+    batch_size tuples, so only one record (or batch) is held at a time.
+    The file is closed when the generator is exhausted or closed.
+    years, sectors and levels filter the rows before they are converted
+    (see census_row_filter); with keep_sector = True the records are
+    5-tuples ending with the sector
+    """
+    keep = census_row_filter(years, sectors, levels)
+    convert = convert_sector_row if keep_sector else convert_enrolment_row
+    with open(fname) as fopen:
+        data = csv.reader(fopen, delimiter=',')
+        next(data, None) # Skips the column headers
+        if keep is not None:
+            data = filter(keep, data) # Rejected rows are skipped before any conversion.
+
+        if batch_size is None:
+            for row in data:
+                yield convert(row)
+            return
+
+        batch = []
+        for row in data:
+            batch.append(convert(row))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def read_enrolment_data(fname, dt=None, columnar=False, years=None, sectors=None, levels=None,
+                        keep_sector=False):
     """
     Reads a school enrolment census data file, extracts values for
     census date, (school) name, year-level and enrolment number, packs
     them into 4-tuple -- str (data formatted as YYYY-MM-DD, which is
     different from the format in the data file!), str, int, int -- and
-    returns a list of those.
+    returns a list of those. Alternatively (if columnar = True), returns
+    a 1-dim structured NumPy array with dtype=dt (default dt_census), the
+    dates being numpy.datetime64 values.
+    Only the rows of the census years in years, the sectors in sectors
+    ('Gov', 'Non-Gov') and the year levels in levels are read (None
+    reads all; see census_row_filter). With keep_sector = True the
+    sector is kept as a fifth element (the dtype defaults to
+    dt_census_sector)
     """
-    # Creates required variables
-    enrolment = []                                                                     
-    data = csv.reader(open(fname), delimiter=',')
-    next(data) # Skips the column headers
+    records = iter_enrolment_data(fname, None, years, sectors, levels, keep_sector)
 
-    for row in data:
-
-        # Skips the column headers.
-        if row[3] == "Older & Mature" or row[3] == "Mature": # Includes older & mature, and mature ages as older.
-            row[3] = "Older"
+    # Streams the records straight into the array, without a list of tuples in between.
+    if columnar:
+        if dt is None:
+            dt = numpy_dtype('dt_census_sector' if keep_sector else 'dt_census')
+        return np.fromiter(records, dtype=dt) # Dates, levels and enrolments are converted to the dt field types.
 
-        # Appends required tuple to a list
-        enrolment.append((format_date(row[0], False), clean_school_name(row[1]), convert_level(row[3]), float(row[4])))  
-
-    return enrolment 
+    return list(records)
 
     # MY ATTEMPT AT AVERAGING ALL RE-OCCURING ENROLMENT DATA (I read output in task 7 wrong)
 
@@ -235,6 +459,129 @@ def read_enrolment_data(fname, dt=dt_census):
     #              counter = 0          
 
 
+###   ###   ----------------------------------------------------------------
+###  COMPACT ENROLMENT STORE
+#      Dictionary-encodes the census dates and school names, which
+#      repeat on every row, and keeps the records in parallel columns
+def smallest_dtype(values, candidates):
+    """
+    Returns the first dtype of candidates that holds every element of
+    values exactly
+    """
+    values = np.asarray(values)
+    for dtype in candidates:
+        if len(values) == 0 or np.array_equal(values.astype(dtype), values):
+            return np.dtype(dtype)
+    return values.dtype
+
+class EnrolmentStore(Sequence):
+    """
+    Enrolment data held in parallel NumPy columns -- date_codes and
+    school_codes (positions in the dates and schools tables), levels and
+    students -- each in the smallest dtype that holds it exactly. Census
+    dates and school names are stored once, in the tables dates and
+    schools (schools in the order they first appear).
+    It reads like the list returned by read_enrolment_data: indexing and
+    iterating give the same 4-tuples, so it can be used wherever that
+    list is. Suburbs can be attached with attach_suburbs, in which case
+    suburbs is the table of suburb names and school_suburb_codes holds,
+    for every school, the tuple of its suburb codes.
+    """
+
+    def __init__(self, dates, schools, date_codes, school_codes, levels, students):
+        self.dates = list(dates)
+        self.schools = list(schools)
+        self.date_codes = date_codes
+        self.school_codes = school_codes
+        self.levels = levels
+        self.students = students
+        self.suburbs = []
+        self.school_suburb_codes = [() for _ in self.schools]
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Builds the store from enrolment records (any iterable of 4-tuples,
+        e.g. the generator iter_enrolment_data)
+        """
+        dates, schools = {}, {}
+        date_codes, school_codes = array('q'), array('q')
+        levels, students = array('q'), array('d')
+        for date, school, level, number in records:
+            date_codes.append(dates.setdefault(date, len(dates)))
+            school_codes.append(schools.setdefault(school, len(schools)))
+            levels.append(level)
+            students.append(number)
+
+        # Narrows every column to the smallest dtype that holds it exactly.
+        columns = []
+        for column in (date_codes, school_codes, levels):
+            column = np.frombuffer(column, dtype=np.int64)
+            columns.append(column.astype(smallest_dtype(column, [np.int8, np.int16, np.int32])))
+        students = np.frombuffer(students, dtype=np.float64)
+        columns.append(students.astype(smallest_dtype(students, [np.float32])))
+        return cls(dates, schools, *columns)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return (self.dates[self.date_codes[i]], self.schools[self.school_codes[i]],
+                int(self.levels[i]), float(self.students[i]))
+
+    def __iter__(self):
+        dates, schools = self.dates, self.schools
+        for date, school, level, number in zip(self.date_codes.tolist(), self.school_codes.tolist(),
+                                               self.levels.tolist(), self.students.tolist()):
+            yield (dates[date], schools[school], level, number)
+
+    def __len__(self):
+        return len(self.levels)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the record columns (the tables are not counted)"""
+        return (self.date_codes.nbytes + self.school_codes.nbytes
+                + self.levels.nbytes + self.students.nbytes)
+
+    def years(self):
+        """Returns an int64 array of the census year of every record"""
+        table = np.array([int(date.split('-')[0]) for date in self.dates], dtype=np.int64)
+        return table[self.date_codes]
+
+    def attach_suburbs(self, school_data):
+        """
+        Dictionary-encodes the suburbs of the schools, as listed in the
+        school data (returned by get_school_data), and returns the store
+        """
+        suburbs = {}
+        school_suburbs = get_school_suburbs(school_data)
+        self.school_suburb_codes = [tuple(suburbs.setdefault(suburb, len(suburbs))
+                                          for suburb in school_suburbs.get(school, ()))
+                                    for school in self.schools]
+        self.suburbs = list(suburbs)
+        return self
+
+    def school_suburbs(self):
+        """
+        Returns the dictionary of school suburbs (as get_school_suburbs
+        does) of the schools in the store with attached suburbs
+        """
+        return {school: [self.suburbs[code] for code in codes]
+                for school, codes in zip(self.schools, self.school_suburb_codes) if codes}
+
+def read_enrolment_store(fname, school_data=None, years=None, sectors=None, levels=None):
+    """
+    Reads the census data file fname (as read_enrolment_data does) into an
+    EnrolmentStore, streaming the records so the list of tuples is never
+    built; the suburbs of school_data are attached if it is given.
+    years, sectors and levels filter the rows as read_enrolment_data does
+    """
+    store = EnrolmentStore.from_records(iter_enrolment_data(fname, None, years, sectors, levels))
+    if school_data is not None:
+        store.attach_suburbs(school_data)
+    return store
+
+
 ###   ###   ----------------------------------------------------------------
 ###  TASK 3
 #    ATTACH SCHOOLS TO SUBURBS
@@ -249,6 +596,10 @@ def get_suburb_schools(school_data, suburb):
     several test cases that will be checked. For future questions, inspect
     those test cases. Ask your teacher if you're unsure what this means.
     """
+    # Structured arrays are filtered with a mask instead of a loop.
+    if is_array(school_data):
+        return school_data[school_data[school_data.dtype.names[2]] == suburb]
+
     # Creates required variables
     schools = []
     
@@ -258,19 +609,255 @@ def get_suburb_schools(school_data, suburb):
             schools.append(tuples) # Append the tuple to a list
     return schools
 
+def get_school_suburbs(school_data):
+    """
+    Takes a sequence of all school data (returned by get_school_data)
+    and returns a dictionary keyed by school name, with values being the
+    list of suburbs the school is listed in (once per matching record).
+    Built once, it replaces calling get_suburb_schools for every suburb.
+    """
+    # Creates required variables
+    suburbs = {}
+
+    # Structured arrays are read column by column.
+    if is_array(school_data):
+        school_data = zip(*(school_data[field].tolist() for field in school_data.dtype.names[:3]))
+
+    # Loops over what is returned from get_school_data
+    for tuples in school_data:
+        suburbs.setdefault(tuples[0], []).append(tuples[2])
+    return suburbs
+
+###   ###   ----------------------------------------------------------------
+###  SCHOOL NAME MATCHING
+#      The census and location files spell school names differently
+#      ('Aranda Primary School' / 'Aranda Primary', 'Woden School (The)'),
+#      so names are joined on a canonical key
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def school_name_key(name):
+    """
+    Returns the canonical key of a school name: lower case tokens without
+    punctuation or 'the', with '&' read as 'and', the aliases in
+    SCHOOL_NAME_ALIASES applied and a ' - ... campus' tail removed
+    For testing:
+    school_name_key('Aranda Primary School') should be 'aranda primary'
+    school_name_key('Woden School (The)') should be 'woden school'
+    school_name_key("St Mary MacKillop College - Wanniassa Campus") should be 'st mary mackillop college'
+    """
+    name = name.lower().replace('&', ' and ').replace("'", '')
+    head, dash, tail = name.partition(' - ')
+    if dash and CAMPUS_WORDS.intersection(tail.split()):
+        name = head
+    tokens = [token for token in re.split(r'[^0-9a-z@]+', name) if token and token != 'the']
+
+    # Replaces every aliased token pair, left to right.
+    key = []
+    i = 0
+    while i < len(tokens):
+        pair = tuple(tokens[i:i + 2])
+        if pair in SCHOOL_NAME_ALIASES:
+            key.extend(SCHOOL_NAME_ALIASES[pair])
+            i += 2
+        else:
+            key.append(tokens[i])
+            i += 1
+    return ' '.join(key)
+
+class SchoolNameIndex(Mapping):
+    """
+    Suburbs of the schools in school data (returned by get_school_data),
+    looked up by school name as the census spells it: a name listed in
+    the school data is matched exactly, any other by its canonical key
+    (school_name_key). Keyed and iterated by the listed names, with
+    values being lists of suburbs, it can be used wherever the dictionary
+    returned by get_school_suburbs is. The index is built in one pass, and
+    a lookup costs one key computation (memoised) and one dictionary lookup.
+    A school listed more than once (e.g. once per level) is in its suburb
+    once, and a name or key whose schools are in more than one suburb
+    (the campuses of a college, under one census name) is ambiguous: it
+    is not matched, so the census total is never copied to every campus,
+    and unmatched reports it
+    """
+
+    def __init__(self, school_data):
+        self.exact = {}          # listed name -> its suburb, as a one-element list
+        self.by_key = {}         # canonical key -> the suburb of every school with that key
+        self.key_names = {}      # canonical key -> the listed names with that key
+        self.ambiguous = {}      # name or canonical key -> the suburbs it spans
+        merged = {}
+        for name, suburbs in get_school_suburbs(school_data).items():
+            suburbs = list(dict.fromkeys(suburbs))
+            if len(suburbs) == 1:
+                self.exact[name] = suburbs
+            else:
+                self.ambiguous[name] = suburbs
+            key = school_name_key(name)
+            self.key_names.setdefault(key, []).append(name)
+            key_suburbs = merged.setdefault(key, [])
+            key_suburbs.extend(suburb for suburb in suburbs if suburb not in key_suburbs)
+        for key, suburbs in merged.items():
+            if len(suburbs) == 1:
+                self.by_key[key] = suburbs
+            else:
+                self.ambiguous[key] = suburbs
+
+    def __getitem__(self, name):
+        if name in self.exact:
+            return self.exact[name]
+        if name in self.ambiguous:
+            raise KeyError(name)
+        return self.by_key[school_name_key(name)]
+
+    def __contains__(self, name):
+        return name in self.exact or (name not in self.ambiguous and school_name_key(name) in self.by_key)
+
+    def __iter__(self):
+        return iter(self.exact)
+
+    def __len__(self):
+        return len(self.exact)
+
+    def unmatched(self, names):
+        """
+        Returns the 2-tuple of sorted lists (names without a matching school,
+        ambiguous names included, listed schools not matched by any of names)
+        """
+        missing = []
+        matched = set()
+        for name in set(names):
+            if name in self:
+                matched.update([name] if name in self.exact else self.key_names[school_name_key(name)])
+            else:
+                missing.append(name)
+        listed = set(self.exact) | {name for names in self.key_names.values() for name in names}
+        return sorted(missing), sorted(listed - matched)
+
 ###   ###   ----------------------------------------------------------------
 ###  TASK 4
 ###  INPUT SUBURB LEVEL POPULATION
 #      Population projections, by single year of age and
 #      sex, need to be aggregated into suburb totals
-def read_population_data(fname, ages_range=86):
+class PopulationCube(Mapping):
+    """
+    Population data held in a single int32 array, counts, shaped
+    (suburb, year, age, sex) -- sex 0 being female and 1 male -- with
+    the lookup tables suburb_index and year_index mapping names and years
+    to positions along the first two axes.
+    It reads like the dictionary returned by read_population_data: keyed
+    by (suburb, year), with values being lists of 2-tuples (female, male)
+    of int, so it can be used wherever that dictionary is.
+    """
+
+    def __init__(self, suburbs, years, counts, present):
+        self.suburbs = list(suburbs)
+        self.years = list(years)
+        self.suburb_index = {suburb: i for i, suburb in enumerate(self.suburbs)}
+        self.year_index = {year: j for j, year in enumerate(self.years)}
+        self.counts = counts       # int32 array (suburb, year, age, sex)
+        self.present = present     # bool array (suburb, year), True where the file has a row
+        self._age_prefix = None    # cumulative sums over age, built on first use (see age_prefix)
+
+    def __getitem__(self, key):
+        i, j = self._position(key)
+        return [tuple(ages) for ages in self.counts[i, j].tolist()]
+
+    def __iter__(self):
+        for i, j in zip(*np.nonzero(self.present)):
+            yield (self.suburbs[i], self.years[j])
+
+    def __len__(self):
+        return int(self.present.sum())
+
+    def _position(self, key):
+        suburb, year = key
+        i = self.suburb_index.get(suburb)
+        j = self.year_index.get(year)
+        if i is None or j is None or not self.present[i, j]:
+            raise KeyError(key)
+        return i, j
+
+    def band_ages(self, year_level, delta=5):
+        """
+        Returns the sorted array of ages a (within the age range) for which
+        a - delta is in year_level, as enrolment_vs_population counts them
+        """
+        ages = np.unique(np.asarray(year_level, dtype=np.int64) + delta)
+        return ages[(ages >= 0) & (ages < self.counts.shape[2])]
+
+    @property
+    def age_prefix(self):
+        """
+        int64 array (suburb, year, age + 1, sex) of the population younger
+        than every age (the sums of counts over ages 0..age-1), built once;
+        the population aged first..last is then
+        age_prefix[:, :, last + 1] - age_prefix[:, :, first]
+        """
+        if self._age_prefix is None:
+            suburbs, years, ages, sexes = self.counts.shape
+            prefix = np.zeros((suburbs, years, ages + 1, sexes), dtype=np.int64)
+            np.cumsum(self.counts, axis=2, dtype=np.int64, out=prefix[:, :, 1:])
+            self._age_prefix = prefix
+        return self._age_prefix
+
+    def age_range_totals(self, first_age, last_age, sex=None):
+        """
+        Returns an int64 array (suburb, year) of the population aged
+        first_age to last_age (inclusive, clipped to the age range), of
+        both sexes or of sex (0 female, 1 male), 0 where a suburb has no
+        data; two lookups per suburb and year, whatever the band width
+        """
+        return self.sweep_totals([(first_age, last_age)], [0], sex)[0, 0]
+
+    def sweep_totals(self, bands, deltas, sex=None):
+        """
+        Returns an int64 array (delta, band, suburb, year) of the population
+        aged first + delta to last + delta, for every year-level band
+        (first, last) of bands and every delta of deltas, as
+        enrolment_vs_population counts the year levels first..last: all
+        combinations from one gather over age_prefix
+        """
+        bands = np.asarray(bands, dtype=np.int64).reshape(-1, 2)
+        deltas = np.asarray(deltas, dtype=np.int64).reshape(-1)
+        ages = self.counts.shape[2]
+        first = np.clip(bands[None, :, 0] + deltas[:, None], 0, ages)       # (delta, band)
+        stop = np.clip(bands[None, :, 1] + deltas[:, None] + 1, first, ages)
+        prefix = self.age_prefix if sex is None else self.age_prefix[..., sex:sex + 1]
+        totals = (prefix[:, :, stop] - prefix[:, :, first]).sum(axis=-1)    # (suburb, year, delta, band)
+        totals = np.where(self.present[:, :, None, None], totals, 0)
+        return totals.transpose(2, 3, 0, 1)
+
+    def band_total(self, suburb, year, ages):
+        """
+        Returns the population (female and male) of the given ages for one
+        suburb and year, as an int
+        """
+        i, j = self._position((suburb, year))
+        return int(self.counts[i, j, ages].sum())
+
+    def band_totals(self, year, ages):
+        """
+        Returns an int64 array, aligned with suburbs, of the population of
+        the given ages in the given year (0 where a suburb has no data)
+        """
+        j = self.year_index.get(year)
+        if j is None:
+            return np.zeros(len(self.suburbs), dtype=np.int64)
+        totals = self.counts[:, j, ages].sum(axis=(1, 2), dtype=np.int64)
+        return np.where(self.present[:, j], totals, 0)
+
+def read_population_data(fname, ages_range=86, columnar=False):
     """
     Read population data file formatted as follows:
          datatime, suburb, female 0..85+ range, male 0..85+ range
     The data structure used is a dictionary:
          key: 2-tuple (suburb, year)
          value: list of 2-tuples (female, male) for age ranges 0..86
+    Alternatively (if columnar = True), returns a PopulationCube holding
+    the same numbers as int
     """
+    if columnar:
+        return read_population_cube(fname, ages_range)
+
     # Creates required variables
     pop_data = {}
     data = csv.reader(open(fname), delimiter=',')
@@ -280,14 +867,73 @@ def read_population_data(fname, ages_range=86):
     for row in data:
 
         # Adds keys to the dictionary, and sets the values to an empty list.
-        pop_data[(row[1].strip(), parse_year(row[0]))] = []
+        ages = pop_data[(row[1].strip(), cached_parse_year(row[0]))] = []
 
         # Iterates over all ages in the age range (data starts at position 2)
         for age in range(2, ages_range + 2):
-            pop_data[(row[1].strip(), parse_year(row[0]))].append((row[age], row[age + ages_range])) # Appends the female and male ages to the previously created empty list values.
+            ages.append((row[age], row[age + ages_range])) # Appends the female and male ages to the previously created empty list values.
 
     return pop_data
 
+def population_cube(pop_data):
+    """
+    Converts population data returned by read_population_data (the
+    dictionary) into a PopulationCube; a cube is returned as it is
+    """
+    if isinstance(pop_data, PopulationCube):
+        return pop_data
+
+    # Builds the lookup tables, suburbs and years in the order they first appear.
+    suburbs = list(dict.fromkeys(key[0] for key in pop_data))
+    years = list(dict.fromkeys(key[1] for key in pop_data))
+    suburb_index = {suburb: i for i, suburb in enumerate(suburbs)}
+    year_index = {year: j for j, year in enumerate(years)}
+    ages_range = max((len(ages) for ages in pop_data.values()), default=0)
+
+    # Converts every (female, male) pair once.
+    counts = np.zeros((len(suburbs), len(years), ages_range, 2), dtype=np.int32)
+    present = np.zeros((len(suburbs), len(years)), dtype=bool)
+    for (suburb, year), ages in pop_data.items():
+        i, j = suburb_index[suburb], year_index[year]
+        counts[i, j, :len(ages)] = [(int(female), int(male)) for female, male in ages]
+        present[i, j] = True
+    return PopulationCube(suburbs, years, counts, present)
+
+def read_population_cube(fname, ages_range=86):
+    """
+    Reads the population data file (see read_population_data) into a
+    PopulationCube; the numeric block of the whole file is converted to
+    int32 by a single NumPy call
+    """
+    # Creates required variables
+    keys = []
+    blocks = []
+
+    with open(fname) as fopen:
+        data = csv.reader(fopen, delimiter=',')
+        next(data) # Skips the colunm headers
+        for row in data:
+            keys.append((row[1].strip(), cached_parse_year(row[0])))   # Each key is parsed once per row.
+            blocks.append(row[2:2 + 2 * ages_range])           # The female block followed by the male block.
+
+    # Converts every number at once, then reorders (row, sex, age) to (row, age, sex).
+    numbers = np.array(blocks, dtype=np.int32).reshape(len(keys), 2, ages_range).transpose(0, 2, 1)
+
+    # Builds the lookup tables, suburbs and years in the order they first appear.
+    suburbs = list(dict.fromkeys(key[0] for key in keys))
+    years = list(dict.fromkeys(key[1] for key in keys))
+    suburb_index = {suburb: i for i, suburb in enumerate(suburbs)}
+    year_index = {year: j for j, year in enumerate(years)}
+    rows = np.array([suburb_index[key[0]] for key in keys], dtype=np.intp)
+    cols = np.array([year_index[key[1]] for key in keys], dtype=np.intp)
+
+    # Scatters the rows into the cube (a repeated key keeps the last row, as the dictionary does).
+    counts = np.zeros((len(suburbs), len(years), ages_range, 2), dtype=np.int32)
+    present = np.zeros((len(suburbs), len(years)), dtype=bool)
+    counts[rows, cols] = numbers
+    present[rows, cols] = True
+    return PopulationCube(suburbs, years, counts, present)
+
 ###   ###   ----------------------------------------------------------------
 ###  TASK 5    (1 Mark)
 ###  CREATE SUBURB POPULATION SET
@@ -305,6 +951,149 @@ def all_suburbs(pop_data):
     for key in pop_data:
         suburbs.add(key[0])
     return suburbs
+
+###   ###   ----------------------------------------------------------------
+###  ENROLMENT INDEX
+#      Enrolment grouped by school, year and level in one pass,
+#      so that get_yearly_enrolment never rescans the records
+def school_codes(names):
+    """
+    Codes an array of school names by order of first appearance; returns
+    the 2-tuple (unique names in that order, int code of every element)
+    """
+    unique, first, codes = np.unique(names, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return unique[order], rank[codes.ravel()]
+
+def census_years(dates):
+    """
+    Returns the int64 census years of an array of numpy.datetime64 dates
+    (an array of int years is returned as it is)
+    """
+    if dates.dtype.kind == 'M':
+        return dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    return dates
+
+def build_enrolment_index(enrolment):
+    """
+    Groups enrolment data (returned by read_enrolment_data) in a single
+    pass. The data structure used is a nested dictionary:
+         key: school name, in the order schools first appear
+         value: dictionary keyed by 2-tuple (year, year_level), with
+                values being [enrolment total, number of census dates]
+    The index can be passed to get_yearly_enrolment in place of the
+    enrolment list, so repeated queries never rescan the records.
+    A structured array (read_enrolment_data with columnar = True) or an
+    EnrolmentStore is grouped with vectorised operations.
+    """
+    if is_array(enrolment):
+        return index_enrolment_columns(enrolment)
+    if isinstance(enrolment, EnrolmentStore):
+        return index_enrolment_store(enrolment)
+    return update_enrolment_index({}, enrolment)
+
+def index_enrolment_columns(enrolment):
+    """
+    Vectorised build_enrolment_index for a 1-dim structured array, the
+    fields being taken by position (see yearly_enrolment_columns)
+    """
+    date, name, level, students = enrolment.dtype.names[:4]
+    names, codes = school_codes(enrolment[name])
+    return group_enrolment(names.tolist(), codes, census_years(enrolment[date]),
+                           enrolment[level], enrolment[students])
+
+def index_enrolment_store(store):
+    """
+    Vectorised build_enrolment_index for an EnrolmentStore, whose school
+    codes are already in order of first appearance
+    """
+    return group_enrolment(store.schools, store.school_codes, store.years(),
+                           store.levels, store.students)
+
+def group_enrolment(names, codes, years, levels, students):
+    """
+    Builds the enrolment index from parallel columns: school codes
+    (positions in names), census years, year levels and enrolments
+    """
+    # Group-by (school, year, level) over the whole array at once.
+    keys = np.empty(len(codes), dtype=[('school', np.int64), ('year', np.int64), ('level', np.int64)])
+    keys['school'] = codes
+    keys['year'] = years
+    keys['level'] = levels
+    groups, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse.ravel(), weights=students, minlength=len(groups))
+    counts = np.bincount(inverse.ravel(), minlength=len(groups))
+
+    # Only the (much smaller) table of groups is converted into dictionaries.
+    index = {school: {} for school in names}
+    for (school, year, year_level), total, count in zip(groups.tolist(), sums.tolist(), counts.tolist()):
+        index[names[school]][(year, year_level)] = [total, count]
+    return index
+
+def update_enrolment_index(index, enrolment):
+    """
+    Adds enrolment records (any iterable of 4-tuples, e.g. the generator
+    iter_enrolment_data) to an index built by build_enrolment_index, in
+    place, and returns the index
+    """
+    for record in enrolment:
+        groups = index.setdefault(record[1], {})                # Groups for this school (created on first sight).
+        key = (int(record[0].split('-')[0]), record[2])         # The date string is only split once per record.
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [record[3], 1]
+        else:
+            group[0] += record[3]
+            group[1] += 1
+    return index
+
+def index_enrolment_file(fname, batch_size=None, years=None, sectors=None, levels=None):
+    """
+    Streams the census data file fname into an enrolment index (see
+    build_enrolment_index) without holding the full record list; memory
+    grows with the number of (school, year, level) groups, not rows.
+    years, sectors and levels filter the rows as read_enrolment_data does
+    """
+    if batch_size is None:
+        return build_enrolment_index(iter_enrolment_data(fname, None, years, sectors, levels))
+    index = {}
+    for batch in iter_enrolment_data(fname, batch_size, years, sectors, levels):
+        update_enrolment_index(index, batch)
+    return index
+
+def yearly_enrolment_columns(enrolment, year, levels=[]):
+    """
+    Vectorised version of get_yearly_enrolment for a 1-dim structured
+    array (returned by read_enrolment_data with columnar = True). Fields
+    are taken by position -- date (numpy.datetime64 or int year), name,
+    year_level, enrolment -- and the result is returned as a 2-tuple of
+    arrays (school names, enrolment totals), with the schools in the
+    order they first appear
+    """
+    date, name, level, students = enrolment.dtype.names[:4]
+
+    # Codes every school by its first appearance, so the output order matches the list version.
+    names, codes = school_codes(enrolment[name])
+
+    # Repeated levels are counted as many times as they are listed.
+    levels, repeats = np.unique(np.asarray(levels, dtype=np.int64), return_counts=True)
+    if len(levels) == 0:
+        return names, np.zeros(len(names))
+
+    # Keeps the records of the year and levels asked for.
+    years = census_years(enrolment[date])
+    mask = (years == year) & np.isin(enrolment[level], levels)
+
+    # Group-by (school, level): mean enrolment over the census dates of the year.
+    groups = codes[mask] * len(levels) + np.searchsorted(levels, enrolment[level][mask])
+    size = len(names) * len(levels)
+    sums = np.bincount(groups, weights=enrolment[students][mask], minlength=size)
+    counts = np.bincount(groups, minlength=size)
+    means = np.divide(sums, counts, out=np.zeros(size), where=counts > 0)
+    return names, (means.reshape(len(names), len(levels)) * repeats).sum(axis=1)
+
 ###   ###   ----------------------------------------------------------------
 ###  TASK 6    (2 Marks)
 ###  TOTAL SCHOOL ENROLMENT
@@ -319,29 +1108,28 @@ def get_yearly_enrolment(enrolment, year, levels=[]):
     given by levels; if the census year has multiple data (eg, for
     February and August), a mean value of enrolment numbers for that year is
     used.
+    The enrolment data may also be an index built by build_enrolment_index,
+    in which case the query costs one lookup per school and level.
     """
+    # Structured arrays are grouped with vectorised operations.
+    if is_array(enrolment):
+        names, totals = yearly_enrolment_columns(enrolment, year, levels)
+        return dict(zip(names.tolist(), totals.tolist()))
+
+    # Groups the records once, unless an index was supplied.
+    if not isinstance(enrolment, Mapping):
+        enrolment = build_enrolment_index(enrolment)
+
     # Creates required variables
-    months = 0
-    year_total = 0 
     output = {}
 
-    # Adds all schools to the output dictionary
-    for tuples in enrolment:
-        output[tuples[1]] = 0
-    
-    # Loops over enrolment with every possible combination of school and year level.
-    for school in output:
+    # Looks up the (year, year level) groups of every school.
+    for school, groups in enrolment.items():
+        output[school] = 0
         for year_level in levels:
-            for tuples in enrolment:
-                if int(tuples[0].split('-')[0]) == year and tuples[2] == year_level and tuples[1] == school: # If it is the correct year, year level, and school.
-                    # Adds to the variables needed for averaging
-                    months += 1
-                    year_total += tuples[3]
-            if months != 0: # If there was data obtained from the year level
-                output[school] += (year_total / months) # Append the average of that year levels data to the school
-            # Resets the required variables
-            months = 0
-            year_total = 0
+            group = groups.get((year, year_level))
+            if group is not None: # If there was data obtained from the year level
+                output[school] += (group[0] / group[1]) # Adds the average of that year levels data to the school
     return output
 
 ########################################################################################################################
@@ -349,6 +1137,98 @@ def get_yearly_enrolment(enrolment, year, levels=[]):
 #                                           Task 7.
 ########################################################################################################################
 
+###   ###   ----------------------------------------------------------------
+###  SUBURB ENROLMENT
+#      Total the yearly enrolment of the schools in every suburb
+def get_suburb_enrolment(enrolment, school_suburbs):
+    """
+    Takes a dictionary of yearly enrolment (returned by get_yearly_enrolment)
+    and a dictionary of school suburbs (returned by get_school_suburbs), and
+    returns a dictionary keyed by suburb with values being the total
+    enrolment of its schools, built in one pass over the enrolment
+    """
+    suburb_enrolment = {}
+    for school, school_enrolment in enrolment.items():
+        for suburb in school_suburbs.get(school, ()):
+            suburb_enrolment[suburb] = suburb_enrolment.get(suburb, 0) + school_enrolment
+    return suburb_enrolment
+
+###   ###   ----------------------------------------------------------------
+###  SUBURB ENROLMENT FOR STRUCTURED ARRAYS
+#      Group-by suburb over a structured school array
+def suburb_enrolment_columns(schools, enrolment):
+    """
+    Takes a 1-dim structured school array (returned by get_school_data
+    with columnar = True) and a dictionary of yearly enrolment (returned
+    by get_yearly_enrolment), and returns a dictionary keyed by suburb
+    with values being the total enrolment of its schools
+    """
+    name, _, suburb = schools.dtype.names[:3]
+    if len(schools) == 0 or len(enrolment) == 0:
+        return {}
+
+    # Matches school names against the enrolment keys with a sorted search.
+    keys = np.array(list(enrolment))
+    values = np.array(list(enrolment.values()), dtype=float)
+    sorter = np.argsort(keys)
+    pos = np.searchsorted(keys, schools[name], sorter=sorter).clip(0, len(keys) - 1)
+    found = keys[sorter[pos]] == schools[name]
+
+    # Group-by suburb over the schools that have enrolment data.
+    suburbs, codes = np.unique(schools[suburb][found], return_inverse=True)
+    totals = np.bincount(codes.ravel(), weights=values[sorter[pos[found]]], minlength=len(suburbs))
+    return dict(zip(suburbs.tolist(), totals.tolist()))
+
+###   ###   ----------------------------------------------------------------
+###  SECTORS
+#      Keep the records of one school sector
+def select_sector(enrolment, sector):
+    """
+    Returns the records of enrolment data read with keep_sector = True
+    (the list of 5-tuples, or a structured array with a 'sector' field)
+    whose sector is sector ('Gov' or 'Non-Gov')
+    """
+    sector = convert_sector(sector)
+    if is_array(enrolment):
+        if 'sector' not in (enrolment.dtype.names or ()):
+            raise ValueError('the enrolment array has no sector field (read it with keep_sector=True)')
+        return enrolment[enrolment['sector'] == sector]
+    if isinstance(enrolment, (Mapping, EnrolmentStore)):
+        raise ValueError('sectors need enrolment records read with keep_sector=True')
+    records = [record for record in enrolment if len(record) > 4 and record[4] == sector]
+    if not records and enrolment and len(enrolment[0]) <= 4:
+        raise ValueError('the enrolment records have no sector (read them with keep_sector=True)')
+    return records
+
+###   ###   ----------------------------------------------------------------
+###  SUBURB POPULATIONS
+def suburb_populations(population, suburbs, year_level, year, delta=5):
+    """
+    Returns the list of the populations of suburbs in year, in order, each
+    summed over the ages a for which a - delta is in year_level (female
+    and male together); population is the population data dictionary or
+    a PopulationCube
+    """
+    # A population cube totals every suburb with one slice-sum.
+    if isinstance(population, PopulationCube):
+        totals = population.band_totals(year, population.band_ages(year_level, delta)).tolist()
+        return [totals[population.suburb_index[suburb]] for suburb in suburbs]
+
+    output = []
+    levels = set(year_level)                                                      # Membership is tested once per age, so a set.
+    for suburb in suburbs:
+
+        # Adds all needed population data for the suburb together.
+        pop_value = 0
+        ages = population.get((suburb, year), ())                                 # Looks up the suburb and year directly.
+        for pop_year in range(len(ages)):                                         # Loops over the population data years.
+            if pop_year - delta in levels:                                        # If the current school year level (should be age level) is a provided age level -
+                pop_value += int(ages[pop_year][0]) + int(ages[pop_year][1])      # Add the female and male population data to the suburb total.
+        output.append(pop_value)
+
+    return output
+
+
 ###   ###   ----------------------------------------------------------------
 ###  TASK 7
 #    COMBINE ENROLMENT AND POPULATION DATASETS
@@ -356,7 +1236,7 @@ def enrolment_vs_population(enrolment,
                             schools,
                             population, 
                             year_level, 
-                            year, delta=5):
+                            year, delta=5, match_names=False, sector=None):
     """Returns a list of 3-tuples -- (suburb, population, enrolment) --
     for year of census and year_level of schools (assuming that the 
     student age is year_level + delta)
@@ -382,6 +1262,13 @@ def enrolment_vs_population(enrolment,
            the year of census data
     delta : int, optional (default=5) 
             relates the school year level and the standard student age
+    match_names : bool, optional (default=False)
+            if True, census school names are matched to the school data
+            by canonical key (see SchoolNameIndex) rather than exactly
+    sector : str, optional (default=None)
+            if given ('Gov' or 'Non-Gov'), only the enrolment of that
+            sector is counted; the enrolment must have been read with
+            keep_sector = True
     
     Returns
     -------
@@ -393,32 +1280,23 @@ def enrolment_vs_population(enrolment,
     # THIS ASSUMES YEAR LEVEL IS GRADE AND ONLY USES SUBURBS FROM POPULATION (accurate to the example)
 
     # Creates required variables
-    pop_value = 0
     output = []
-    suburb_enrolment = 0
+    if sector is not None:
+        enrolment = select_sector(enrolment, sector)
     enrolment = get_yearly_enrolment(enrolment, year, year_level) # Provides function student age instead of student year level.
     suburbs = all_suburbs(population)
 
-    # The main loop - loops over every suburb
-    for suburb in suburbs:
+    # Adds the enrolment of every school to the suburb(s) it is located in, in one pass.
+    if match_names:
+        suburb_enrolment = get_suburb_enrolment(enrolment, SchoolNameIndex(schools))
+    elif is_array(schools):
+        suburb_enrolment = suburb_enrolment_columns(schools, enrolment)
+    else:
+        suburb_enrolment = get_suburb_enrolment(enrolment, get_school_suburbs(schools))
 
-        # Adds all needed enrolment data for each suburb together.
-        for school in enrolment:
-            for tuple in get_suburb_schools(schools, suburb):
-                if school == tuple[0]:                           # Checks if the school is in the current suburb.
-                    suburb_enrolment += enrolment[school]        # Adds enrolment numbers for each school in one suburb together.
-
-        # Adds all needed population data for each suburb together.
-        for key in population:                                                                             # Loops over all keys in the population dictionary
-            if year == key[1] and suburb == key[0]:                                                        # If the year is the same as the supplied and if it is the current suburb -
-                for pop_year in range(len(population[key])):                                               # Loops over the population data years.
-                    if pop_year - delta in year_level:                                                     # If the current school year level (should be age level) is a provided age level -
-                        pop_value += int(population[key][pop_year][0]) + int(population[key][pop_year][1]) # Add the female and male population data to the suburb total.
-
-        output.append((suburb, pop_value, suburb_enrolment)) # Appends the created values to output
-        # Resets required variables
-        pop_value = 0
-        suburb_enrolment = 0
+    # The main loop - loops over every suburb
+    for suburb, pop_value in zip(suburbs, suburb_populations(population, suburbs, year_level, year, delta)):
+        output.append((suburb, pop_value, suburb_enrolment.get(suburb, 0))) # Appends the created values to output
 
     return output
 
@@ -459,3 +1337,140 @@ def enrolment_vs_population(enrolment,
     #     enrolment_num = 0
 
     # return output
+
+
+###   ###   ----------------------------------------------------------------
+###  BATCH QUERIES
+#    Enrolment vs population for many years and age groups at once
+def enrolment_vs_population_batch(enrolment,
+                                  schools,
+                                  population,
+                                  year_levels,
+                                  years, delta=5, match_names=False):
+    """
+    Batch version of enrolment_vs_population: returns a dictionary keyed
+    by 2-tuple (year, tuple(year_level)), for every year in years and
+    every year_level in year_levels, with values being the list of
+    3-tuples (suburb, population, enrolment) enrolment_vs_population
+    returns for that year and year_level.
+    The enrolment, school and population data are each indexed once, so
+    every further (year, year_level) only costs lookups per school and
+    a slice of the population cube. match_names is as in
+    enrolment_vs_population.
+    """
+    # Indexes every dataset once.
+    index = build_enrolment_index(enrolment) if not isinstance(enrolment, Mapping) else enrolment
+    school_suburbs = SchoolNameIndex(schools) if match_names else get_school_suburbs(schools)
+    population = population_cube(population)
+    suburbs = list(all_suburbs(population))
+    rows = [population.suburb_index[suburb] for suburb in suburbs]
+
+    output = {}
+    for year_level in year_levels:
+
+        # Population of the age group for every suburb and year in one slice-sum.
+        ages = population.band_ages(year_level, delta)
+        totals = population.counts[rows][:, :, ages].sum(axis=(2, 3), dtype=np.int64)
+        totals = np.where(population.present[rows], totals, 0)
+
+        for year in years:
+            j = population.year_index.get(year)
+            pop_values = totals[:, j].tolist() if j is not None else [0] * len(suburbs)
+            suburb_enrolment = get_suburb_enrolment(get_yearly_enrolment(index, year, year_level), school_suburbs)
+            output[(year, tuple(year_level))] = [(suburb, pop_value, suburb_enrolment.get(suburb, 0))
+                                                  for suburb, pop_value in zip(suburbs, pop_values)]
+    return output
+
+def level_band(year_level):
+    """
+    Returns the band (first, last) of a list of consecutive year levels,
+    e.g. level_band(SECONDARY_SCHOOL_AGES) is (12, 17); raises ValueError
+    if the levels leave a gap
+    """
+    levels = sorted(set(year_level))
+    if not levels or levels[-1] - levels[0] + 1 != len(levels):
+        raise ValueError(f'year levels {list(year_level)} are not a contiguous band')
+    return levels[0], levels[-1]
+
+def enrolment_vs_population_sweep(enrolment,
+                                  schools,
+                                  population,
+                                  bands,
+                                  deltas,
+                                  years, match_names=False):
+    """
+    Sweep version of enrolment_vs_population over a grid of assumptions:
+    returns a dictionary keyed by 3-tuple (year, delta, band), for every
+    year in years, delta in deltas and band (first, last) of consecutive
+    year levels in bands (see level_band), with values being the list of
+    3-tuples (suburb, population, enrolment) that enrolment_vs_population
+    returns for year_level = first..last and that delta.
+    The population of every (delta, band) comes from one vectorised call
+    over the cumulative age sums of the cube (PopulationCube.sweep_totals),
+    and the enrolment of a band and year is shared by all deltas
+    """
+    # Indexes every dataset once.
+    index = build_enrolment_index(enrolment) if not isinstance(enrolment, Mapping) else enrolment
+    school_suburbs = SchoolNameIndex(schools) if match_names else get_school_suburbs(schools)
+    population = population_cube(population)
+    suburbs = list(all_suburbs(population))
+    rows = [population.suburb_index[suburb] for suburb in suburbs]
+    bands = [tuple(band) for band in bands]
+    totals = population.sweep_totals(bands, deltas)[:, :, rows]             # (delta, band, suburb, year)
+
+    output = {}
+    for b, (first, last) in enumerate(bands):
+        for year in years:
+            yearly = get_yearly_enrolment(index, year, list(range(first, last + 1)))
+            suburb_enrolment = get_suburb_enrolment(yearly, school_suburbs)
+            enrolments = [suburb_enrolment.get(suburb, 0) for suburb in suburbs]
+            j = population.year_index.get(year)
+            for d, delta in enumerate(deltas):
+                pop_values = totals[d, b, :, j].tolist() if j is not None else [0] * len(suburbs)
+                output[(year, delta, (first, last))] = list(zip(suburbs, pop_values, enrolments))
+    return output
+
+def enrolment_vs_population_by_sector(enrolment,
+                                      schools,
+                                      population,
+                                      year_level,
+                                      year, delta=5, match_names=False, sectors=SECTORS):
+    """
+    enrolment_vs_population with the enrolment reported per sector:
+    returns a list of tuples (suburb, population, enrolment of sectors[0],
+    enrolment of sectors[1], ...), by default government then
+    non-government. The enrolment must have been read with
+    keep_sector = True
+    """
+    school_suburbs = SchoolNameIndex(schools) if match_names else get_school_suburbs(schools)
+    by_sector = [get_suburb_enrolment(get_yearly_enrolment(select_sector(enrolment, sector), year, year_level),
+                                      school_suburbs)
+                 for sector in sectors]
+    suburbs = all_suburbs(population)
+    return [(suburb, pop_value) + tuple(suburb_enrolment.get(suburb, 0) for suburb_enrolment in by_sector)
+            for suburb, pop_value in zip(suburbs, suburb_populations(population, suburbs, year_level,
+                                                                     year, delta))]
+
+
+# The public names, for star imports; the data types are created (and NumPy imported) by them.
+__all__ = ['MONTHS_NAMES', 'MONTHS', 'YEAR_NAMES', 'SCHOOL_YEARS', 'PRESCHOOL_AGES', 'KINDERGARTEN_AGES',
+           'PRIMARY_SCHOOL_AGES', 'JUNIOR_SCHOOL_AGES', 'SECONDARY_SCHOOL_AGES', 'AGE_GROUPS',
+           'CONVERSION_CACHE_SIZE', 'CONVERSION_CACHES', 'SCHOOL_NAME_ALIASES', 'CAMPUS_WORDS', 'SECTORS',
+           'DTYPE_FIELDS', 'dt_school', 'dt_census', 'dt_census_sector', 'LazyModule', 'is_array', 'numpy_dtype',
+           'get_school_data', 'format_date', 'clean_school_name', 'convert_level',
+           'cached_format_date', 'cached_clean_school_name', 'cached_convert_level',
+           'convert_census_record', 'parse_year', 'cached_parse_year', 'conversion_cache_info',
+           'clear_conversion_caches', 'convert_sector', 'convert_enrolment_row', 'convert_sector_row',
+           'census_row_filter', 'iter_enrolment_data', 'read_enrolment_data', 'smallest_dtype',
+           'EnrolmentStore', 'read_enrolment_store', 'get_suburb_schools', 'get_school_suburbs',
+           'school_name_key', 'SchoolNameIndex', 'PopulationCube', 'read_population_data',
+           'population_cube', 'read_population_cube', 'all_suburbs', 'school_codes', 'census_years',
+           'build_enrolment_index', 'index_enrolment_columns', 'index_enrolment_store', 'group_enrolment',
+           'update_enrolment_index', 'index_enrolment_file', 'yearly_enrolment_columns',
+           'get_yearly_enrolment', 'get_suburb_enrolment', 'suburb_enrolment_columns', 'select_sector',
+           'suburb_populations', 'enrolment_vs_population', 'enrolment_vs_population_batch',
+           'level_band', 'enrolment_vs_population_sweep', 'enrolment_vs_population_by_sector']
+
+# Opt-in profiling of every function above (see AI3_Profile).
+if os.environ.get('AI3_PROFILE', '') not in ('', '0'):
+    import AI3_Profile
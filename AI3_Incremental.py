@@ -0,0 +1,193 @@
+"""
+Incremental refresh of the enrolment index when census rounds are appended.
+
+An IncrementalEnrolment remembers how far into the census data file it
+has read (byte offset and row count), the size and mtime of the file at
+that time, a hash of the last line it consumed and a hash of the bytes
+consumed (see prefix_digest). refresh() returns at once if the size and
+mtime are unchanged; otherwise it parses only the rows appended since
+the last read and adds them to the per-(school, year, level) aggregates
+behind get_yearly_enrolment, in place. If the file was rewritten rather
+than appended to -- it is shorter than before, has the same size but a
+new mtime, or its last consumed line or consumed bytes changed -- the
+index is rebuilt from scratch. The index and read position can be saved
+to a JSON file and loaded again in a later run.
+
+The consumed bytes are hashed whole up to PREFIX_SAMPLES * SAMPLE_BYTES
+bytes (1 MiB); beyond that, PREFIX_SAMPLES blocks spread evenly over
+them are, so a refresh reads a bounded amount of the old data. An edit
+to a large file that falls between the blocks (and leaves the last
+consumed line alone) is then missed.
+
+Only complete lines are consumed: a final line without a newline (a
+half-written append) is left for the next refresh.
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import io
+import os
+import csv
+import json
+import hashlib
+import locale
+from collections.abc import Mapping
+
+from AI3_Functions import (convert_enrolment_row, update_enrolment_index,
+                           get_yearly_enrolment)
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+PREFIX_SAMPLES = 256        # blocks hashed from the bytes consumed (see prefix_digest)
+SAMPLE_BYTES = 4096
+
+
+###   ###   ----------------------------------------------------------------
+###  FILE DIGESTS
+def prefix_digest(fopen, end):
+    """
+    Returns the SHA-256 hex digest of the first end bytes of the binary
+    file fopen: of all of them when they fit in PREFIX_SAMPLES blocks of
+    SAMPLE_BYTES, otherwise of PREFIX_SAMPLES such blocks spread evenly
+    from the start to end
+    """
+    digest = hashlib.sha256()
+    if end <= PREFIX_SAMPLES * SAMPLE_BYTES:
+        fopen.seek(0)
+        digest.update(fopen.read(end))
+    else:
+        step = (end - SAMPLE_BYTES) / (PREFIX_SAMPLES - 1)
+        for i in range(PREFIX_SAMPLES):
+            fopen.seek(int(i * step))
+            digest.update(fopen.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+###   ###   ----------------------------------------------------------------
+###  INCREMENTAL ENROLMENT INDEX
+class IncrementalEnrolment(Mapping):
+    """
+    Enrolment index (see build_enrolment_index) of the census data file
+    fname, kept up to date by refresh(). It reads like its index attribute,
+    so either can be passed to get_yearly_enrolment,
+    enrolment_vs_population and enrolment_vs_population_batch like the
+    enrolment list; passed itself, it lets a ResultCache notice refreshes
+    through fingerprint().
+    """
+
+    def __init__(self, fname, encoding=None, refresh=True):
+        self.fname = fname
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.index = {}
+        self.rebuilds = 0         # times the file was found rewritten
+        self._reset()
+        if refresh:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Reads the complete rows appended to the file since the last refresh
+        and adds them to the index; returns the number of new rows. The
+        whole file is re-read if it was rewritten
+        """
+        stat = os.stat(self.fname)
+        if (stat.st_size, stat.st_mtime_ns) == (self.size, self.mtime_ns):
+            return 0
+
+        with open(self.fname, 'rb') as fopen:
+            # A shorter file, an in-place rewrite, a changed last line or changed consumed bytes mean a rewrite.
+            fopen.seek(self.tail_start)
+            window = fopen.read(self.offset - self.tail_start)
+            if (stat.st_size < self.offset or stat.st_size == self.size
+                    or hashlib.sha256(window).hexdigest() != self.tail_sha256
+                    or prefix_digest(fopen, self.offset) != self.prefix_sha256):
+                self._reset()
+                self.rebuilds += 1
+            fopen.seek(self.offset)
+            tail = fopen.read()
+
+            # Consumes the complete lines only, up to the last newline.
+            tail = tail[:tail.rfind(b'\n') + 1]
+            rows = csv.reader(io.StringIO(tail.decode(self.encoding)), delimiter=',')
+            if self.offset == 0:
+                next(rows, None) # Skips the column headers
+            new_rows = [row for row in rows if row]
+            update_enrolment_index(self.index, (convert_enrolment_row(row) for row in new_rows))
+
+            if tail:
+                last_line = tail.rfind(b'\n', 0, len(tail) - 1) + 1
+                self.tail_start = self.offset + last_line
+                self.tail_sha256 = hashlib.sha256(tail[last_line:]).hexdigest()
+                self.offset += len(tail)
+                self.prefix_sha256 = prefix_digest(fopen, self.offset)
+        self.size, self.mtime_ns = stat.st_size, stat.st_mtime_ns
+        self.rows += len(new_rows)
+        return len(new_rows)
+
+    def _reset(self):
+        """Forgets everything read, so the next read starts from scratch"""
+        self.index.clear()
+        self.offset = 0           # bytes of the file consumed so far (always after a newline)
+        self.rows = 0             # data rows consumed so far
+        self.size = None          # size and mtime of the file at the last refresh
+        self.mtime_ns = None
+        self.tail_start = 0       # offset of the last consumed line
+        self.tail_sha256 = EMPTY_SHA256
+        self.prefix_sha256 = EMPTY_SHA256   # prefix_digest of the bytes consumed
+
+    def __getitem__(self, school):
+        return self.index[school]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def fingerprint(self):
+        """
+        Fingerprint of the index (see AI3_Results.data_fingerprint): it
+        changes whenever rows are added or the index is rebuilt
+        """
+        return type(self).__name__, id(self), self.offset, self.prefix_sha256
+
+    def get_yearly_enrolment(self, year, levels=[]):
+        """get_yearly_enrolment over the index"""
+        return get_yearly_enrolment(self.index, year, levels)
+
+    def save(self, path):
+        """
+        Writes the read position (offset, rows, file size and mtime, hashes
+        of the last line and of the bytes consumed) and the index to path
+        as JSON
+        """
+        groups = {school: [[year, level, total, count]
+                           for (year, level), (total, count) in school_groups.items()]
+                  for school, school_groups in self.index.items()}
+        state = {'fname': os.path.abspath(self.fname), 'encoding': self.encoding,
+                 'offset': self.offset, 'rows': self.rows,
+                 'size': self.size, 'mtime_ns': self.mtime_ns,
+                 'tail_start': self.tail_start, 'tail_sha256': self.tail_sha256,
+                 'prefix_sha256': self.prefix_sha256, 'index': groups}
+        with open(path, 'w') as fopen:
+            json.dump(state, fopen)
+
+    @classmethod
+    def load(cls, path, refresh=True):
+        """
+        Returns the IncrementalEnrolment saved to path by save(), refreshed
+        with any rows appended since (unless refresh = False)
+        """
+        with open(path) as fopen:
+            state = json.load(fopen)
+        incremental = cls(state['fname'], state['encoding'], refresh=False)
+        for name in ('offset', 'rows', 'size', 'mtime_ns', 'tail_start', 'tail_sha256', 'prefix_sha256'):
+            setattr(incremental, name, state[name])
+        incremental.index = {school: {(year, level): [total, count]
+                                      for year, level, total, count in groups}
+                             for school, groups in state['index'].items()}
+        if refresh:
+            incremental.refresh()
+        return incremental
@@ -0,0 +1,124 @@
+"""
+Parallel ingestion of the school, census and population data files.
+
+The three files are loaded at the same time by a process pool, and the
+census file (the largest) is split into byte ranges that end on line
+boundaries, each range being parsed by its own worker with the same
+per-row conversion as read_enrolment_data. The chunks are merged in file
+order, so the output is identical to the serial loaders. Inputs smaller
+than PARALLEL_MIN_BYTES are read serially, in-process.
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import io
+import os
+import csv
+import locale
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from AI3_Functions import (dt_school, dt_census, get_school_data,
+                           read_enrolment_data, read_population_data,
+                           convert_enrolment_row)
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+PARALLEL_MIN_BYTES = 4 << 20    # below this total input size, process start-up costs more than it saves
+CHUNK_MIN_BYTES = 1 << 20       # the census file is not split into chunks smaller than this
+
+
+###   ###   ----------------------------------------------------------------
+###  BYTE-RANGE CHUNKS
+def chunk_ranges(fname, chunks, min_bytes=CHUNK_MIN_BYTES):
+    """
+    Splits the data rows of fname (the header line excluded) into at most
+    chunks byte ranges of roughly equal size, each starting at the
+    beginning of a line; returns a list of (start, end) offsets.
+    Fields must not contain embedded newlines (true of the census file)
+    """
+    size = os.path.getsize(fname)
+    with open(fname, 'rb') as fopen:
+        fopen.readline()                                # skips the header
+        start = fopen.tell()
+        chunks = max(1, min(chunks, (size - start) // max(min_bytes, 1)))
+        step = (size - start) // chunks
+        bounds = [start]
+        for k in range(1, chunks):
+            fopen.seek(max(start + k * step, bounds[-1]))
+            fopen.readline()                            # moves to the start of the next line
+            bounds.append(min(fopen.tell(), size))
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+def parse_enrolment_chunk(fname, start, end, columnar=False, dt=dt_census, encoding=None):
+    """
+    Parses the census rows in bytes [start, end) of fname into the
+    records read_enrolment_data would return for them (a list of 4-tuples,
+    or a structured array if columnar = True)
+    """
+    with open(fname, 'rb') as fopen:
+        fopen.seek(start)
+        text = fopen.read(end - start).decode(encoding or locale.getpreferredencoding(False))
+    records = (convert_enrolment_row(row) for row in csv.reader(io.StringIO(text)) if row)
+    if columnar:
+        return np.fromiter(records, dtype=dt)
+    return list(records)
+
+
+###   ###   ----------------------------------------------------------------
+###  PARALLEL LOADERS
+def read_enrolment_parallel(fname, workers=None, columnar=False, dt=dt_census,
+                            min_bytes=PARALLEL_MIN_BYTES, chunk_bytes=CHUNK_MIN_BYTES,
+                            executor=None):
+    """
+    Parallel read_enrolment_data: parses byte-range chunks (of at least
+    chunk_bytes) of fname in a process pool of workers processes (default:
+    one per CPU), or in executor if given, and merges them in order.
+    Files smaller than min_bytes are read serially
+    """
+    workers = workers or os.cpu_count() or 1
+    if executor is None and (workers <= 1 or os.path.getsize(fname) < min_bytes):
+        return read_enrolment_data(fname, dt=dt, columnar=columnar)
+
+    ranges = chunk_ranges(fname, workers, chunk_bytes)
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return read_enrolment_parallel(fname, workers, columnar, dt, min_bytes,
+                                           chunk_bytes, executor=pool)
+
+    parts = [executor.submit(parse_enrolment_chunk, fname, start, end, columnar, dt)
+             for start, end in ranges]
+    return merge_chunks([part.result() for part in parts], columnar, dt)
+
+def merge_chunks(parts, columnar=False, dt=dt_census):
+    """Concatenates parsed chunks in the order given"""
+    if columnar:
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dt)
+    return [record for part in parts for record in part]
+
+def load_parallel(school_file, enrol_file, pop_file, workers=None, ages_range=86,
+                  columnar=False, min_bytes=PARALLEL_MIN_BYTES, chunk_bytes=CHUNK_MIN_BYTES):
+    """
+    Loads the three data files at the same time and returns the 3-tuple
+    (school data, enrolment, population), identical to what
+    get_school_data, read_enrolment_data and read_population_data return
+    (their columnar forms if columnar = True). workers sets the size of the
+    process pool (default: one per CPU); when the files total less than
+    min_bytes, or workers is 1, they are read serially instead
+    """
+    workers = workers or os.cpu_count() or 1
+    total = sum(os.path.getsize(f) for f in (school_file, enrol_file, pop_file))
+    if workers <= 1 or total < min_bytes:
+        return (get_school_data(school_file, dt=dt_school, columnar=columnar),
+                read_enrolment_data(enrol_file, dt=dt_census, columnar=columnar),
+                read_population_data(pop_file, ages_range=ages_range, columnar=columnar))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # The small files are each one task, queued ahead of the census chunks.
+        school_data = pool.submit(get_school_data, school_file, dt_school, columnar)
+        population = pool.submit(read_population_data, pop_file, ages_range, columnar)
+        enrolment = read_enrolment_parallel(enrol_file, workers, columnar, dt_census,
+                                            min_bytes, chunk_bytes, executor=pool)
+        return school_data.result(), enrolment, population.result()
@@ -0,0 +1,250 @@
+"""
+Opt-in instrumentation of the functions in AI3_Functions.
+
+When enabled, the public pipeline functions of AI3_Functions (the
+readers, indexes and queries listed in PIPELINE) are replaced by a
+wrapper recording its wall time, number of calls, rows processed (the
+size of the returned collection, or the number of items yielded by a
+generator) and peak traced memory (via tracemalloc). Other parts of a
+run, such as plotting, can be measured with the stage context manager.
+A summary table is printed when the process exits, and a JSON report
+written if a path is given.
+
+Profiling is enabled by setting the environment variable AI3_PROFILE=1
+(AI3_PROFILE_JSON=path also writes the JSON report), by calling enable(),
+or with the --profile flag of AI3_Visualiser.py. When it is not enabled
+nothing is wrapped, so the functions run exactly as written.
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import os
+import sys
+import json
+import time
+import atexit
+import inspect
+import functools
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import AI3_Functions
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+PROFILE_ENV = 'AI3_PROFILE'
+PROFILE_JSON_ENV = 'AI3_PROFILE_JSON'
+PROFILE_MEMORY_ENV = 'AI3_PROFILE_MEMORY'    # set to 0 to time without tracemalloc (which slows allocation)
+PIPELINE = ['get_school_data', 'read_enrolment_data', 'iter_enrolment_data', 'read_enrolment_store',
+            'read_population_data', 'read_population_cube', 'population_cube',
+            'get_suburb_schools', 'get_school_suburbs', 'all_suburbs',
+            'build_enrolment_index', 'index_enrolment_columns', 'index_enrolment_store',
+            'update_enrolment_index', 'index_enrolment_file',
+            'get_yearly_enrolment', 'get_suburb_enrolment', 'suburb_enrolment_columns',
+            'select_sector', 'suburb_populations', 'enrolment_vs_population',
+            'enrolment_vs_population_batch', 'enrolment_vs_population_sweep',
+            'enrolment_vs_population_by_sector']
+
+# Module state
+_enabled = False
+_trace_memory = False
+_started_tracing = False    # True if enable started tracemalloc, so disable stops it
+_stats = {}        # name -> {'calls', 'seconds', 'rows', 'peak_bytes'}
+_peaks = []        # peak memory carried by every open (enclosing) measurement
+_patched = []      # (namespace, name, original) to restore on disable
+_report = {'json_path': None, 'summary': True}
+
+
+###   ###   ----------------------------------------------------------------
+###  MEASUREMENT
+def _enter():
+    """Starts a measurement; returns its (start time, start memory)"""
+    current = 0
+    if _trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], peak)   # the enclosing measurement keeps its peak so far
+        tracemalloc.reset_peak()
+        _peaks.append(0)
+    return time.perf_counter(), current
+
+def _exit(name, started, rows, calls=1):
+    """Ends a measurement started by _enter and records it under name"""
+    start, base = started
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if _trace_memory:
+        peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], peak)
+        peak -= base
+    entry = _stats.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rows': 0, 'peak_bytes': 0})
+    entry['calls'] += calls
+    entry['seconds'] += elapsed
+    entry['rows'] += rows
+    entry['peak_bytes'] = max(entry['peak_bytes'], peak)
+
+def _rows(result):
+    """
+    Number of rows in a returned value: its length for a collection, 1 for
+    a tuple (a single record) and 0 for scalars and strings
+    """
+    if isinstance(result, tuple):
+        return 1
+    if isinstance(result, (str, bytes)) or not hasattr(result, '__len__'):
+        return 0
+    return len(result)
+
+def instrument(function, name=None):
+    """
+    Returns a wrapper of function recording its calls under name (default:
+    the function name); generator functions are measured over every item
+    they yield
+    """
+    name = name or function.__name__
+
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            iterator = function(*args, **kwargs)
+            rows = 0
+            try:
+                while True:
+                    started = _enter()              # only the time spent producing items is counted
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        _exit(name, started, 0, calls=0)
+                    rows += len(item) if isinstance(item, list) else 1
+                    yield item
+            finally:
+                iterator.close()
+                _exit(name, _enter(), rows)         # one call, however many items were yielded
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = _enter()
+        rows = 0
+        try:
+            result = function(*args, **kwargs)
+            rows = _rows(result)
+            return result
+        finally:
+            _exit(name, started, rows)
+    return wrapper
+
+def stage(name, rows=0):
+    """
+    Context manager measuring the enclosed block as a stage called name
+    (a no-op unless profiling is enabled)
+    """
+    if not _enabled:
+        return nullcontext()
+    return _stage(name, rows)
+
+@contextmanager
+def _stage(name, rows):
+    started = _enter()
+    try:
+        yield
+    finally:
+        _exit(name, started, rows)
+
+
+###   ###   ----------------------------------------------------------------
+###  ENABLE / DISABLE
+def enable(namespaces=(), trace_memory=True, json_path=None, summary=True):
+    """
+    Wraps the PIPELINE functions of AI3_Functions, and rebinds the same functions
+    wherever they were imported by name: in the other AI3_ modules, in
+    __main__ and in each of the dictionaries namespaces. Memory is traced
+    if trace_memory = True. The summary is printed at exit if
+    summary = True, and the JSON report written to json_path if given
+    """
+    global _enabled, _trace_memory, _started_tracing
+    _report['json_path'] = json_path or _report['json_path']
+    _report['summary'] = summary
+    if _enabled:
+        return
+    _enabled = True
+
+    wrappers = {}
+    for name in PIPELINE:
+        function = getattr(AI3_Functions, name)
+        wrappers[id(function)] = instrument(function)
+    modules = [module for name, module in list(sys.modules.items())
+               if name.startswith('AI3_') or name == '__main__']
+    for namespace in [vars(module) for module in modules] + list(namespaces):
+        for name, value in list(namespace.items()):
+            if id(value) in wrappers and inspect.isfunction(value):
+                _patched.append((namespace, name, value))
+                namespace[name] = wrappers[id(value)]
+
+    _trace_memory = trace_memory
+    _started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if _started_tracing:
+        tracemalloc.start()
+    atexit.register(_at_exit)
+
+def disable():
+    """
+    Restores the original functions and stops recording (and tracing
+    memory, if enable started it)
+    """
+    global _enabled, _trace_memory, _started_tracing
+    for namespace, name, original in reversed(_patched):
+        namespace[name] = original
+    _patched.clear()
+    _enabled = False
+    _trace_memory = False
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+    atexit.unregister(_at_exit)
+
+def enabled():
+    """Returns True if profiling is enabled"""
+    return _enabled
+
+def reset():
+    """Forgets everything recorded so far"""
+    _stats.clear()
+
+
+###   ###   ----------------------------------------------------------------
+###  REPORTS
+def report():
+    """
+    Returns the recorded measurements as a dictionary keyed by function
+    (or stage) name, sorted by total time, slowest first
+    """
+    return dict(sorted(((name, dict(entry)) for name, entry in _stats.items()),
+                       key=lambda item: -item[1]['seconds']))
+
+def print_summary(file=sys.stderr):
+    """Prints the recorded measurements as a table"""
+    print(f'{"stage":<36} {"calls":>8} {"total ms":>11} {"rows":>10} {"peak MiB":>9}', file=file)
+    for name, entry in report().items():
+        print(f'{name:<36} {entry["calls"]:>8} {entry["seconds"] * 1000:>11.2f} '
+              f'{entry["rows"]:>10} {entry["peak_bytes"] / 2**20:>9.2f}', file=file)
+
+def write_json(path):
+    """Writes the recorded measurements to path as JSON"""
+    with open(path, 'w') as fopen:
+        json.dump(report(), fopen, indent=2)
+
+def _at_exit():
+    if _report['summary'] and _stats:
+        print_summary()
+    if _report['json_path']:
+        write_json(_report['json_path'])
+
+
+# Enabled for the whole process by the environment variable.
+if os.environ.get(PROFILE_ENV, '') not in ('', '0'):
+    enable(trace_memory=os.environ.get(PROFILE_MEMORY_ENV, '1') != '0',
+           json_path=os.environ.get(PROFILE_JSON_ENV))
@@ -0,0 +1,106 @@
+"""
+Command-line query of suburb population vs school enrolment, as numbers.
+
+Runs enrolment_vs_population for one year, age group and delta and
+writes the 3-tuples (suburb, population, enrolment) to stdout as CSV or
+JSON, for use by other programs. Only the list-based readers are used,
+so neither NumPy nor matplotlib is ever imported and the start-up time
+stays close to that of the interpreter (see the cold_start benchmark in
+AI3_Benchmark.py). Only the census rows of the year, levels (and sector)
+queried are converted.
+
+Usage: python3 AI3_Query.py YEAR [--ages junior|secondary|...] [--levels 0 1 ...]
+                           [--delta 5] [--sector Gov|Non-Gov] [--format csv|json]
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import sys
+import csv
+import argparse
+
+from AI3_Functions import (AGE_GROUPS, get_school_data, read_enrolment_data,
+                           read_population_data, enrolment_vs_population,
+                           SchoolNameIndex, SECTORS)
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+SCHOOL_DATA_FILE = 'ACT_School_Locations_2017_-_archived.csv'
+ENROL_DATA_FILE = 'Census_Data_for_all_ACT_Schools.csv'
+POP_DATA_FILE = 'ACT_Population_Projections_by_Suburb__2015_-_2020_.csv'
+COLUMNS = ['suburb', 'population', 'enrolment']
+
+
+###   ###   ----------------------------------------------------------------
+###  QUERY
+def query(year, year_level, delta=5, school_file=SCHOOL_DATA_FILE,
+          enrol_file=ENROL_DATA_FILE, pop_file=POP_DATA_FILE,
+          match_names=False, unmatched=None, sector=None):
+    """
+    Reads the three data files and returns the list of 3-tuples
+    (suburb, population, enrolment) of enrolment_vs_population; only the
+    census rows of year and year_level (and of sector, if given) are
+    read. With match_names = True the school names are matched by
+    canonical key, and the census names without a matching school are
+    written to the file unmatched (if given)
+    """
+    enrolment = read_enrolment_data(enrol_file, years=year, levels=year_level, sectors=sector)
+    school_data = get_school_data(school_file)
+    if match_names and unmatched is not None:
+        missing, _ = SchoolNameIndex(school_data).unmatched(record[1] for record in enrolment)
+        for name in missing:
+            print(f'unmatched school: {name}', file=unmatched)
+    return enrolment_vs_population(enrolment, school_data,
+                                   read_population_data(pop_file),
+                                   year_level, year, delta, match_names)
+
+def write_csv(rows, file=sys.stdout):
+    """Writes the 3-tuples as CSV, with a header row"""
+    writer = csv.writer(file, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    writer.writerows(rows)
+
+def write_json(rows, file=sys.stdout):
+    """Writes the 3-tuples as a JSON list of objects"""
+    import json
+    json.dump([dict(zip(COLUMNS, row)) for row in rows], file)
+    file.write('\n')
+
+
+###   ###   ----------------------------------------------------------------
+###  COMMAND LINE
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Writes suburb population vs school enrolment '
+                                                 'for a year as CSV or JSON')
+    parser.add_argument('year', type=int, help='year of census')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--ages', choices=sorted(AGE_GROUPS), default='junior',
+                       help='age group (default junior)')
+    group.add_argument('--levels', type=int, nargs='+', metavar='LEVEL',
+                       help='year levels, instead of an age group')
+    parser.add_argument('--delta', type=int, default=5,
+                        help='age minus year level (default 5)')
+    parser.add_argument('--sector', choices=SECTORS,
+                        help='count the enrolment of one school sector only')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    parser.add_argument('--match-names', action='store_true',
+                        help='match census and location school names by canonical key, '
+                             'listing the unmatched census names on stderr')
+    parser.add_argument('--school-file', default=SCHOOL_DATA_FILE)
+    parser.add_argument('--enrol-file', default=ENROL_DATA_FILE)
+    parser.add_argument('--pop-file', default=POP_DATA_FILE)
+    args = parser.parse_args(argv)
+
+    year_level = args.levels if args.levels else AGE_GROUPS[args.ages]
+    rows = query(args.year, year_level, args.delta,
+                 args.school_file, args.enrol_file, args.pop_file,
+                 args.match_names, sys.stderr, args.sector)
+    if args.format == 'json':
+        write_json(rows, sys.stdout)
+    else:
+        write_csv(rows, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Memoised results of enrolment_vs_population and get_yearly_enrolment.
+
+A ResultCache answers repeated queries from memory. Its keys are the
+normalised query parameters together with a fingerprint of the datasets
+passed in (and of any data files it is told to watch), and it is bounded
+by an LRU size and an optional time-to-live. A dataset with a
+fingerprint() method (such as IncrementalEnrolment, whose fingerprint
+changes with every refresh) is fingerprinted by it, any other by its
+identity and length, so a lookup costs no pass over the data. When the
+fingerprint of a dataset changes, or a watched file changes size or
+mtime, the entries computed from the old data are dropped. A dataset
+edited in place without a change of length must be passed to
+invalidate(); a cache can instead be given content_fingerprint, which
+hashes every dataset on every lookup (hits included).
+
+Hits, misses, evictions, expirations and invalidations are counted and
+returned by stats().
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import os
+import copy
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+from AI3_Functions import (get_yearly_enrolment, enrolment_vs_population,
+                           is_array, PopulationCube)
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+RESULT_CACHE_SIZE = 256
+
+
+###   ###   ----------------------------------------------------------------
+###  FINGERPRINTS
+def file_signature(fname):
+    """Returns the 3-tuple (absolute path, size, mtime in ns) of a data file"""
+    try:
+        stat = os.stat(fname)
+        return os.path.abspath(fname), stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return os.path.abspath(fname), None, None
+
+def data_fingerprint(data):
+    """
+    Returns the fingerprint of a dataset: an object with a fingerprint()
+    method is asked for its own, which must change whenever its contents
+    do; any other dataset is fingerprinted by identity and length (see
+    identity_fingerprint)
+    """
+    if hasattr(data, 'fingerprint'):
+        return data.fingerprint()
+    return identity_fingerprint(data)
+
+def content_fingerprint(data):
+    """
+    Returns the 2-tuple (type name, BLAKE2 digest of the contents) of a
+    dataset: the buffer of an array, the arrays and labels of a
+    PopulationCube, or the pickle of anything else. A dataset with a
+    fingerprint() method is asked for its own, and one that cannot be
+    pickled falls back to (type name, identity, length). It costs a pass
+    over the data, so it is only used by a ResultCache given it
+    """
+    if hasattr(data, 'fingerprint'):
+        return data.fingerprint()
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        if isinstance(data, PopulationCube):
+            parts = [data.counts, data.present, pickle.dumps((data.suburbs, data.years))]
+        else:
+            parts = [data] if is_array(data) else [pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)]
+        for part in parts:
+            if is_array(part):
+                import numpy as np
+                digest.update(f'{part.dtype.descr}{part.shape}'.encode())
+                part = np.ascontiguousarray(part).reshape(-1).view(np.uint8)
+            digest.update(part)
+    except (TypeError, pickle.PicklingError, AttributeError):
+        return identity_fingerprint(data)
+    return type(data).__name__, digest.hexdigest()
+
+def identity_fingerprint(data):
+    """
+    Returns the cheap fingerprint (type name, identity, length) of a
+    dataset: it changes when another object is passed or the dataset
+    grows or shrinks, not when it is edited in place
+    """
+    size = len(data) if hasattr(data, '__len__') else None
+    return type(data).__name__, id(data), size
+
+def normalise_levels(levels):
+    """
+    Returns year levels as a tuple of int; the order is kept, since it sets
+    the order in which enrolments are added up
+    """
+    return tuple(int(level) for level in levels)
+
+
+###   ###   ----------------------------------------------------------------
+###  RESULT CACHE
+class ResultCache:
+    """
+    LRU cache of query results, holding at most maxsize entries, each
+    valid for ttl seconds (None: until evicted or invalidated). The data
+    files in files are watched: a change to any of them empties the cache.
+    Datasets are told apart by fingerprint (default data_fingerprint).
+    Results are returned as shallow copies, so callers may modify them.
+    The cache may be shared by threads: its bookkeeping is locked, while
+    results are computed outside the lock
+    """
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, ttl=None, files=(), clock=time.monotonic,
+                 fingerprint=data_fingerprint):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.files = list(files)
+        self.clock = clock
+        self.fingerprint = fingerprint
+        self._entries = OrderedDict()      # key -> (result, expiry time, datasets)
+        self._fingerprints = {}            # id of a dataset -> its fingerprint last seen
+        self._file_signatures = [file_signature(fname) for fname in self.files]
+        self._stats = dict.fromkeys(['hits', 'misses', 'evictions', 'expirations', 'invalidations'], 0)
+        self._lock = threading.RLock()
+
+    ###  QUERIES
+    def get_yearly_enrolment(self, enrolment, year, levels=[]):
+        """Memoised get_yearly_enrolment"""
+        levels = normalise_levels(levels)
+        return self._lookup(('get_yearly_enrolment', int(year), levels),
+                            {'enrolment': enrolment},
+                            lambda: get_yearly_enrolment(enrolment, int(year), list(levels)))
+
+    def enrolment_vs_population(self, enrolment, schools, population, year_level, year, delta=5):
+        """Memoised enrolment_vs_population"""
+        year_level = normalise_levels(year_level)
+        return self._lookup(('enrolment_vs_population', int(year), year_level, int(delta)),
+                            {'enrolment': enrolment, 'schools': schools, 'population': population},
+                            lambda: enrolment_vs_population(enrolment, schools, population,
+                                                            list(year_level), int(year), int(delta)))
+
+    def _lookup(self, query, datasets, compute):
+        """
+        Returns the cached result of query over datasets (a dictionary keyed
+        by role), computing and storing it with compute() on a miss
+        """
+        with self._lock:
+            self._check_files()
+            fingerprints = tuple((role, self._check_dataset(data)) for role, data in datasets.items())
+            key = (query, fingerprints)
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, expires, _ = entry
+                if expires is None or self.clock() < expires:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return copy.copy(result)
+                del self._entries[key]
+                self._stats['expirations'] += 1
+            self._stats['misses'] += 1
+
+        result = compute()
+        if self.maxsize > 0:
+            with self._lock:
+                expires = None if self.ttl is None else self.clock() + self.ttl
+                # The entry keeps its datasets alive, so the ids in its key cannot be reused.
+                self._entries[key] = (result, expires, tuple(datasets.values()))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+        return copy.copy(result)
+
+    ###  INVALIDATION
+    def _check_dataset(self, data):
+        """
+        Returns the fingerprint of a dataset, first dropping the entries
+        computed from the same object when its fingerprint was different.
+        Other datasets in the same argument keep their entries, so queries
+        alternating between datasets do not invalidate each other
+        """
+        fingerprint = self.fingerprint(data)
+        previous = self._fingerprints.get(id(data))
+        if previous is not None and previous != fingerprint:
+            self._drop(lambda key, datasets: any(value == previous for _, value in key[1]))
+        self._fingerprints[id(data)] = fingerprint
+        if len(self._fingerprints) > 2 * max(self.maxsize, 1) + 8:
+            self._forget_datasets()
+        return fingerprint
+
+    def _drop(self, stale):
+        """Drops the entries for which stale(key, datasets) is True"""
+        keys = [key for key, (_, _, datasets) in self._entries.items() if stale(key, datasets)]
+        for key in keys:
+            del self._entries[key]
+        self._stats['invalidations'] += len(keys)
+
+    def _forget_datasets(self):
+        """Keeps the last seen fingerprints of the datasets of live entries only"""
+        live = {id(data) for _, _, datasets in self._entries.values() for data in datasets}
+        self._fingerprints = {key: value for key, value in self._fingerprints.items() if key in live}
+
+    def _check_files(self):
+        """Empties the cache if a watched file changed"""
+        signatures = [file_signature(fname) for fname in self.files]
+        if signatures != self._file_signatures:
+            self._file_signatures = signatures
+            self.invalidate()
+
+    def invalidate(self, data=None):
+        """
+        Drops the entries computed from the dataset data (e.g. after
+        editing it in place), or every entry if data is None
+        """
+        with self._lock:
+            if data is None:
+                self._stats['invalidations'] += len(self._entries)
+                self._entries.clear()
+                self._fingerprints.clear()
+                return
+            self._drop(lambda key, datasets: any(dataset is data for dataset in datasets))
+            self._fingerprints.pop(id(data), None)
+
+    ###  STATISTICS
+    def stats(self):
+        """
+        Returns a dictionary of the counts of hits, misses, evictions (LRU),
+        expirations (TTL) and invalidations, with hit_rate, currsize,
+        maxsize and ttl
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            currsize = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        return dict(stats, hit_rate=stats['hits'] / lookups if lookups else 0.0,
+                    currsize=currsize, maxsize=self.maxsize, ttl=self.ttl)
+
+    def __len__(self):
+        return len(self._entries)
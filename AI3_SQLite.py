@@ -0,0 +1,231 @@
+"""
+SQLite storage backend for the school, census and population data.
+
+The three CSV files are imported, in batches, into a local SQLite file
+with typed columns and indexes -- enrolment on (school, year, level),
+population on (suburb, year, age) -- and get_suburb_schools,
+get_yearly_enrolment and enrolment_vs_population run as indexed SQL
+aggregates against it. Only the query results are held in memory, so
+extracts larger than memory can be queried, and a later run reuses the
+database file instead of re-parsing the CSVs (open_database re-imports
+only when a source file changed).
+
+The functions take an sqlite3 connection in place of the datasets and
+return what their AI3_Functions namesakes return.
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import csv
+import sqlite3
+
+from AI3_Functions import (iter_enrolment_data, cached_parse_year,
+                           SchoolNameIndex, get_suburb_enrolment)
+from AI3_Results import file_signature
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+SCHEMA_VERSION = 1
+IMPORT_BATCH_SIZE = 10000
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    kind TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS schools (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL, address TEXT NOT NULL, suburb TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS schools_suburb ON schools (suburb);
+CREATE INDEX IF NOT EXISTS schools_name ON schools (name);
+CREATE TABLE IF NOT EXISTS census_schools (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS enrolment (
+    census_date TEXT NOT NULL, year INTEGER NOT NULL,
+    school_id INTEGER NOT NULL REFERENCES census_schools (id),
+    level INTEGER NOT NULL, students REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS enrolment_school_year_level ON enrolment (school_id, year, level, students);
+CREATE INDEX IF NOT EXISTS enrolment_year_level ON enrolment (year, level, school_id, students);
+CREATE TABLE IF NOT EXISTS suburbs (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS population (
+    suburb TEXT NOT NULL, year INTEGER NOT NULL, age INTEGER NOT NULL,
+    female INTEGER NOT NULL, male INTEGER NOT NULL,
+    PRIMARY KEY (suburb, year, age)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS population_year_age ON population (year, age, suburb, female, male);
+"""
+TABLES = ['schools', 'census_schools', 'enrolment', 'suburbs', 'population']
+
+
+###   ###   ----------------------------------------------------------------
+###  DATABASE
+def connect(path):
+    """Opens (creating if needed) the database file path and returns the connection"""
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+def _batches(rows, size=IMPORT_BATCH_SIZE):
+    """Yields lists of at most size rows"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def import_csv(db, school_file, enrol_file, pop_file, ages_range=86):
+    """
+    Replaces the contents of the database with the three data files,
+    streamed in batches in one transaction
+    """
+    with db:
+        for table in TABLES:
+            db.execute(f'DELETE FROM {table}')
+
+        with open(school_file) as fopen:
+            rows = csv.reader(fopen)
+            next(rows)                                  # skip the header
+            for batch in _batches(row[:3] for row in rows):
+                db.executemany('INSERT INTO schools (name, address, suburb) VALUES (?, ?, ?)', batch)
+
+        # Census school names are coded in order of first appearance.
+        school_ids = {}
+        for batch in iter_enrolment_data(enrol_file, IMPORT_BATCH_SIZE):
+            rows = []
+            for date, name, level, students in batch:
+                school_id = school_ids.get(name)
+                if school_id is None:
+                    school_id = school_ids[name] = len(school_ids) + 1
+                    db.execute('INSERT INTO census_schools (id, name) VALUES (?, ?)', (school_id, name))
+                rows.append((date, int(date.split('-')[0]), school_id, level, students))
+            db.executemany('INSERT INTO enrolment VALUES (?, ?, ?, ?, ?)', rows)
+
+        # One row per suburb, year and age: 86 female counts, then 86 male counts, per line.
+        with open(pop_file) as fopen:
+            rows = csv.reader(fopen)
+            next(rows)                                  # skip the column headers
+            def population_rows():
+                for row in rows:
+                    suburb, year = row[1].strip(), cached_parse_year(row[0])
+                    db.execute('INSERT OR IGNORE INTO suburbs (name) VALUES (?)', (suburb,))
+                    for age in range(ages_range):
+                        yield suburb, year, age, int(row[2 + age]), int(row[2 + ages_range + age])
+            for batch in _batches(population_rows()):
+                db.executemany('INSERT OR REPLACE INTO population VALUES (?, ?, ?, ?, ?)', batch)
+
+        for kind, fname in (('school', school_file), ('enrolment', enrol_file), ('population', pop_file)):
+            db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)', (kind,) + file_signature(fname))
+    db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    db.execute('ANALYZE')
+
+def open_database(path, school_file, enrol_file, pop_file, ages_range=86, rebuild=False):
+    """
+    Returns a connection to the database file path, importing the data
+    files first if the database is new (or of another schema version), a
+    file changed since it was imported, or rebuild = True
+    """
+    db = connect(path)
+    imported = {kind: (fname, size, mtime) for kind, fname, size, mtime
+                in db.execute('SELECT kind, path, size, mtime_ns FROM sources')}
+    current = {'school': file_signature(school_file), 'enrolment': file_signature(enrol_file),
+               'population': file_signature(pop_file)}
+    version, = db.execute('PRAGMA user_version').fetchone()
+    if rebuild or imported != current or version != SCHEMA_VERSION:
+        import_csv(db, school_file, enrol_file, pop_file, ages_range)
+    return db
+
+
+###   ###   ----------------------------------------------------------------
+###  QUERIES
+def get_suburb_schools(db, suburb):
+    """get_suburb_schools: the (name, address, suburb) 3-tuples of the schools in suburb"""
+    return db.execute('SELECT name, address, suburb FROM schools WHERE suburb = ? ORDER BY id',
+                      (suburb,)).fetchall()
+
+def all_suburbs(db):
+    """The suburbs of the population data, in the order they first appear"""
+    return [name for name, in db.execute('SELECT name FROM suburbs ORDER BY id')]
+
+def _level_table(levels):
+    """
+    A common table expression listing the levels, one row per listed level
+    (so a repeated level is counted again, as get_yearly_enrolment does)
+    """
+    return f"levels (level) AS (VALUES {', '.join(['(?)'] * len(levels))})"
+
+def get_yearly_enrolment(db, year, levels=[]):
+    """
+    get_yearly_enrolment: a dictionary keyed by every census school (in
+    the order they first appear) of the enrolment in year totalled over
+    levels, the mean over the census dates being taken for each level
+    """
+    levels = [int(level) for level in levels]
+    output = {name: 0 for name, in db.execute('SELECT name FROM census_schools ORDER BY id')}
+    if not levels:
+        return output
+    names = dict(db.execute('SELECT id, name FROM census_schools'))
+    means = db.execute(f"""
+        WITH {_level_table(levels)}
+        SELECT school_id, level, SUM(students) / COUNT(*) FROM enrolment
+        WHERE year = ? AND level IN (SELECT level FROM levels)
+        GROUP BY school_id, level""", levels + [year])
+    groups = {}
+    for school_id, level, mean in means:
+        groups.setdefault(school_id, {})[level] = mean
+    # The means are added in the order the levels are listed, as get_yearly_enrolment adds them.
+    for school_id, school_means in groups.items():
+        name = names[school_id]
+        for level in levels:
+            if level in school_means:
+                output[name] += school_means[level]
+    return output
+
+def suburb_enrolment(db, year, levels=[]):
+    """
+    Returns a dictionary keyed by suburb of the yearly enrolment of its
+    schools (a school counting once per record of the school data),
+    joined on the exact school name
+    """
+    levels = [int(level) for level in levels]
+    if not levels:
+        return {}
+    return dict(db.execute(f"""
+        WITH {_level_table(levels)},
+        means AS (SELECT school_id, level, SUM(students) / COUNT(*) AS mean FROM enrolment
+                  WHERE year = ? AND level IN (SELECT level FROM levels)
+                  GROUP BY school_id, level),
+        totals AS (SELECT means.school_id, SUM(means.mean) AS total
+                   FROM means JOIN levels ON levels.level = means.level
+                   GROUP BY means.school_id)
+        SELECT schools.suburb, SUM(totals.total) FROM totals
+        JOIN census_schools ON census_schools.id = totals.school_id
+        JOIN schools ON schools.name = census_schools.name
+        GROUP BY schools.suburb""", levels + [year]))
+
+def suburb_populations(db, year, ages):
+    """Returns a dictionary keyed by suburb of the population of the given ages in year"""
+    ages = sorted(set(int(age) for age in ages))
+    if not ages:
+        return {}
+    return dict(db.execute(f"""
+        SELECT suburb, SUM(female + male) FROM population
+        WHERE year = ? AND age IN ({', '.join(['?'] * len(ages))})
+        GROUP BY suburb""", [year] + ages))
+
+def enrolment_vs_population(db, year_level, year, delta=5, match_names=False):
+    """
+    enrolment_vs_population: a list of 3-tuples (suburb, population,
+    enrolment), one per suburb of the population data in the order they
+    first appear; the population is summed over the ages a for which
+    a - delta is in year_level. With match_names = True the school names
+    are matched by canonical key (see SchoolNameIndex), in Python
+    """
+    if match_names:
+        school_data = db.execute('SELECT name, address, suburb FROM schools ORDER BY id').fetchall()
+        enrolment = get_suburb_enrolment(get_yearly_enrolment(db, year, year_level),
+                                         SchoolNameIndex(school_data))
+    else:
+        enrolment = suburb_enrolment(db, year, year_level)
+    populations = suburb_populations(db, year, [level + delta for level in year_level])
+    return [(suburb, populations.get(suburb, 0), enrolment.get(suburb, 0))
+            for suburb in all_suburbs(db)]
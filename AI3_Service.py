@@ -0,0 +1,288 @@
+"""
+Long-running local query service over the school, census and population data.
+
+The three data files are read and indexed once -- the enrolment index
+(see build_enrolment_index), the population cube and the school
+suburbs -- and kept in memory. Queries are then answered as JSON over a
+small asyncio HTTP/1.1 server (keep-alive, GET only for queries), bound
+to localhost or to a Unix socket; only the standard library is used,
+so the service runs entirely offline.
+
+Endpoints:
+    GET  /enrolment_vs_population?year=2019&ages=junior&delta=5
+    GET  /enrolment_vs_population?year=2019&levels=7,8,9
+    GET  /yearly_enrolment?year=2019&levels=0,1,2
+    GET  /status
+    POST /reload[?force=1]      re-reads the files that changed on disk
+
+Queries run in worker threads, so a slow query does not hold up the
+other connections. A reload parses the files in a worker thread and
+swaps the new indexes in at once, so queries are served from the old
+data until it completes.
+Results are memoised (see AI3_Results) until the data is reloaded.
+
+Usage: python3 AI3_Service.py [--host 127.0.0.1] [--port 8003] [--unix PATH]
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import sys
+import json
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+
+from AI3_Functions import AGE_GROUPS, get_school_data, index_enrolment_file, read_population_cube
+from AI3_Query import SCHOOL_DATA_FILE, ENROL_DATA_FILE, POP_DATA_FILE
+from AI3_Results import ResultCache, RESULT_CACHE_SIZE, file_signature
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8003
+MAX_HEADER_LINES = 100
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class QueryError(ValueError):
+    """A query with missing or malformed parameters (answered with 400)"""
+
+
+###   ###   ----------------------------------------------------------------
+###  IN-MEMORY DATA
+class QueryService:
+    """
+    The indexed datasets of the three data files, with the queries the
+    service answers. data is the 3-tuple (school data, enrolment index,
+    population cube); it is replaced as a whole on reload, so a query
+    always sees one consistent version. Results are memoised in a
+    ResultCache of cache_size entries, each valid for cache_ttl seconds
+    """
+
+    def __init__(self, school_file=SCHOOL_DATA_FILE, enrol_file=ENROL_DATA_FILE,
+                 pop_file=POP_DATA_FILE, ages_range=86,
+                 cache_size=RESULT_CACHE_SIZE, cache_ttl=None):
+        self.files = {'school': school_file, 'enrolment': enrol_file, 'population': pop_file}
+        self.ages_range = ages_range
+        self.results = ResultCache(cache_size, cache_ttl)
+        self.data = None
+        self.signatures = {}
+        self.loads = 0
+        self._reloading = None
+        self.load()
+
+    def load(self):
+        """Reads and indexes the three data files (blocking)"""
+        signatures = {kind: file_signature(fname) for kind, fname in self.files.items()}
+        school_data = get_school_data(self.files['school'])
+        if school_data is None:
+            raise ValueError(f'{self.files["school"]}: school data could not be read')
+        index = index_enrolment_file(self.files['enrolment'])
+        cube = read_population_cube(self.files['population'], self.ages_range)
+        self.data = (school_data, index, cube)
+        self.signatures = signatures
+        self.loads += 1
+
+    def changed(self):
+        """Returns the kinds of data file whose size or mtime changed since the last load"""
+        return [kind for kind, fname in self.files.items()
+                if file_signature(fname) != self.signatures.get(kind)]
+
+    async def reload(self, force=False):
+        """
+        Reloads the data if a file changed (or force = True), parsing in a
+        worker thread; concurrent calls share one reload. Returns a
+        dictionary describing what was done
+        """
+        changed = self.changed()
+        if not (changed or force):
+            return {'reloaded': False, 'changed': [], 'loads': self.loads}
+        if self._reloading is None:
+            self._reloading = asyncio.get_running_loop().run_in_executor(None, self.load)
+        try:
+            await asyncio.shield(self._reloading)
+        finally:
+            self._reloading = None
+        return {'reloaded': True, 'changed': changed, 'loads': self.loads}
+
+    def status(self):
+        """Returns the files, their signatures and the size of the indexes"""
+        school_data, index, cube = self.data
+        return {'files': self.files, 'loads': self.loads,
+                'schools': len(school_data), 'indexed_schools': len(index),
+                'suburbs': len(cube.suburbs), 'years': cube.years,
+                'result_cache': self.results.stats()}
+
+    ###  QUERIES
+    def enrolment_vs_population(self, params):
+        """enrolment_vs_population for the query parameters, as a list of objects"""
+        school_data, index, cube = self.data
+        rows = self.results.enrolment_vs_population(index, school_data, cube, year_levels(params),
+                                                    int_param(params, 'year'), int_param(params, 'delta', 5))
+        return [{'suburb': suburb, 'population': population, 'enrolment': enrolment}
+                for suburb, population, enrolment in rows]
+
+    def yearly_enrolment(self, params):
+        """get_yearly_enrolment for the query parameters, as an object keyed by school"""
+        return self.results.get_yearly_enrolment(self.data[1], int_param(params, 'year'), year_levels(params))
+
+
+###   ###   ----------------------------------------------------------------
+###  QUERY PARAMETERS
+def int_param(params, name, default=None):
+    """Returns the int query parameter name (parsed by parse_qs)"""
+    if name not in params:
+        if default is None:
+            raise QueryError(f'missing parameter {name}')
+        return default
+    try:
+        return int(params[name][-1])
+    except ValueError:
+        raise QueryError(f'parameter {name} must be an integer') from None
+
+def year_levels(params):
+    """
+    Returns the year levels of a query: levels=a,b,c, or the age group
+    ages=NAME (default junior, see AI3_Functions.AGE_GROUPS)
+    """
+    if 'levels' in params:
+        try:
+            return [int(level) for value in params['levels'] for level in value.split(',') if level]
+        except ValueError:
+            raise QueryError('levels must be comma-separated integers') from None
+    ages = params.get('ages', ['junior'])[-1]
+    if ages not in AGE_GROUPS:
+        raise QueryError(f'ages must be one of {", ".join(sorted(AGE_GROUPS))}')
+    return AGE_GROUPS[ages]
+
+
+###   ###   ----------------------------------------------------------------
+###  HTTP
+async def dispatch(service, method, target):
+    """
+    Answers one request; returns the 2-tuple (HTTP status, JSON-serialisable
+    payload)
+    """
+    url = urlsplit(target)
+    params = parse_qs(url.query)
+    queries = {'/enrolment_vs_population': service.enrolment_vs_population,
+               '/yearly_enrolment': service.yearly_enrolment,
+               '/status': lambda params: service.status()}
+    try:
+        if url.path in queries:
+            if method not in ('GET', 'HEAD'):
+                return 405, {'error': f'{url.path} only accepts GET'}
+            # Queries run in the default executor, keeping the event loop free for other connections.
+            return 200, await asyncio.get_running_loop().run_in_executor(None, queries[url.path], params)
+        if url.path == '/reload':
+            if method != 'POST':
+                return 405, {'error': '/reload only accepts POST'}
+            force = params.get('force', ['0'])[-1] not in ('', '0')
+            return 200, await service.reload(force)
+        return 404, {'error': f'no such endpoint {url.path}'}
+    except QueryError as error:
+        return 400, {'error': str(error)}
+    except Exception as error:
+        print(f'{error}: request {method} {target} failed', file=sys.stderr)
+        return 500, {'error': str(error)}
+
+def content_length(headers):
+    """Returns the Content-Length of a request (0 if absent), or None if it is malformed"""
+    value = headers.get('content-length', '')
+    if not value:
+        return 0
+    try:
+        length = int(value)
+    except ValueError:
+        return None
+    return length if length >= 0 else None
+
+async def handle_connection(service, reader, writer):
+    """Serves the requests of one (keep-alive) connection"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            headers = {}
+            for _ in range(MAX_HEADER_LINES):
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = content_length(headers)
+            if length:
+                await reader.readexactly(length)         # request bodies are not used
+
+            try:
+                method, target, version = request_line.decode('latin-1').split()
+            except ValueError:
+                method, version = 'GET', 'HTTP/1.0'
+                status, payload = 400, {'error': 'malformed request line'}
+            else:
+                if length is None:
+                    # The body cannot be skipped, so the connection is closed after the reply.
+                    version = 'HTTP/1.0'
+                    status, payload = 400, {'error': 'malformed Content-Length header'}
+                else:
+                    status, payload = await dispatch(service, method, target)
+            keep_alive = (version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close')
+
+            body = json.dumps(payload).encode()
+            writer.write((f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                          f'Content-Type: application/json\r\n'
+                          f'Content-Length: {len(body)}\r\n'
+                          f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n').encode())
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def start_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix=None):
+    """Starts serving on host:port, or on the Unix socket unix; returns the asyncio server"""
+    handler = lambda reader, writer: handle_connection(service, reader, writer)
+    if unix is not None:
+        return await asyncio.start_unix_server(handler, path=unix)
+    return await asyncio.start_server(handler, host, port)
+
+
+###   ###   ----------------------------------------------------------------
+###  COMMAND LINE
+async def serve(service, host, port, unix):
+    server = await start_server(service, host, port, unix)
+    where = unix or ', '.join(f'{s.getsockname()[0]}:{s.getsockname()[1]}' for s in server.sockets)
+    print(f'Serving on {where}', file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serves enrolment and population queries as JSON')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead')
+    parser.add_argument('--school-file', default=SCHOOL_DATA_FILE)
+    parser.add_argument('--enrol-file', default=ENROL_DATA_FILE)
+    parser.add_argument('--pop-file', default=POP_DATA_FILE)
+    parser.add_argument('--cache-size', type=int, default=RESULT_CACHE_SIZE,
+                        help='results remembered (0 disables the result cache)')
+    parser.add_argument('--cache-ttl', type=float, help='seconds a result is remembered for')
+    args = parser.parse_args(argv)
+
+    service = QueryService(args.school_file, args.enrol_file, args.pop_file,
+                           cache_size=args.cache_size, cache_ttl=args.cache_ttl)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+Shared-memory handles of the parsed datasets, for multi-process workers.
+
+SharedDatasets.publish copies the school data, the enrolment and the
+population data, in their columnar forms (structured arrays and the
+arrays of a PopulationCube, see AI3_Functions), into
+multiprocessing.shared_memory blocks. Its descriptor -- the block names,
+dtypes and shapes, with the suburb and year labels of the cube -- is a
+small picklable dictionary, so it is all a worker needs to be sent.
+SharedDatasets.attach(descriptor) maps the same blocks in another
+process and returns read-only NumPy views on them, without copying or
+unpickling the data; the views are passed to the query functions
+(get_yearly_enrolment, enrolment_vs_population, ...) as they are.
+
+Lifecycle: the publishing process owns the blocks and frees them with
+unlink() (also done on leaving its with block, or when it is garbage
+collected); every process, owner or not, releases its mapping with
+close() once it drops its views. init_worker attaches a pool worker
+once and closes its mapping when the worker exits.
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import os
+import sys
+import uuid
+import atexit
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+from AI3_Functions import (dt_school, dt_census, is_array, population_cube,
+                           PopulationCube, enrolment_vs_population)
+
+
+###   ###   ----------------------------------------------------------------
+###  SHARED MEMORY BLOCKS
+def _create_block(array):
+    """Creates a shared memory block holding a copy of array; returns the block"""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))   # a block cannot be empty
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block
+
+def _open_block(name):
+    """Maps an existing shared memory block (not tracked for removal by this process, where supported)"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+def _view(block, dtype, shape):
+    """Returns a read-only array of dtype and shape over block"""
+    view = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    view.flags.writeable = False
+    return view
+
+def _unlink_blocks(blocks):
+    """Frees the blocks (for the owner); blocks already freed are skipped"""
+    for block in blocks:
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+###   ###   ----------------------------------------------------------------
+###  SHARED DATASETS
+class SharedDatasets:
+    """
+    The school data (dt_school array), enrolment (dt_census array) and
+    population (PopulationCube) held in shared memory, as read-only
+    views; a dataset that was not published is None. descriptor is the
+    picklable dictionary passed to attach in other processes. owner is
+    True in the publishing process, which must unlink the blocks
+    """
+
+    def __init__(self, descriptor, blocks, owner=False):
+        self.descriptor = descriptor
+        self.owner = owner
+        self._blocks = blocks                       # array key -> SharedMemory
+        self._finalizer = weakref.finalize(self, _unlink_blocks, list(blocks.values())) if owner else None
+
+        views = {key: _view(blocks[key], dtype, shape)
+                 for key, (_, dtype, shape) in descriptor['arrays'].items()}
+        self.school_data = views.get('school_data')
+        self.enrolment = views.get('enrolment')
+        self.population = None
+        if 'population_counts' in views:
+            labels = descriptor['population']
+            self.population = PopulationCube(labels['suburbs'], labels['years'],
+                                             views['population_counts'], views['population_present'])
+
+    @classmethod
+    def publish(cls, school_data=None, enrolment=None, population=None):
+        """
+        Copies the datasets into new shared memory blocks and returns the
+        owning SharedDatasets. Lists are converted to their columnar forms
+        first: school data to a dt_school array, enrolment records to a
+        dt_census array and population data to a PopulationCube
+        """
+        arrays, labels = {}, None
+        if school_data is not None:
+            arrays['school_data'] = school_data if is_array(school_data) else np.array(school_data, dtype=dt_school)
+        if enrolment is not None:
+            arrays['enrolment'] = enrolment if is_array(enrolment) else np.fromiter(iter(enrolment), dtype=dt_census)
+        if population is not None:
+            cube = population_cube(population)
+            arrays['population_counts'] = cube.counts
+            arrays['population_present'] = cube.present
+            labels = {'suburbs': list(cube.suburbs), 'years': list(cube.years)}
+
+        blocks = {}
+        try:
+            for key, array in arrays.items():
+                blocks[key] = _create_block(np.ascontiguousarray(array))
+        except BaseException:
+            _unlink_blocks(blocks.values())
+            for block in blocks.values():
+                block.close()
+            raise
+        descriptor = {'token': uuid.uuid4().hex,
+                      'arrays': {key: (blocks[key].name, array.dtype, array.shape)
+                                 for key, array in arrays.items()},
+                      'population': labels}
+        return cls(descriptor, blocks, owner=True)
+
+    @classmethod
+    def attach(cls, descriptor):
+        """
+        Maps the blocks of descriptor (returned by publish) in this process
+        and returns the SharedDatasets viewing them; raises
+        FileNotFoundError if they were unlinked
+        """
+        blocks = {}
+        try:
+            for key, (name, _, _) in descriptor['arrays'].items():
+                blocks[key] = _open_block(name)
+        except BaseException:
+            for block in blocks.values():
+                block.close()
+            raise
+        return cls(descriptor, blocks)
+
+    ###  LIFECYCLE
+    @property
+    def nbytes(self):
+        """Bytes of shared memory mapped"""
+        return sum(block.size for block in self._blocks.values())
+
+    def close(self):
+        """
+        Drops the views and releases this process's mapping of the blocks
+        (the data stays available to other processes). Arrays taken from
+        the views must be released first, or BufferError is raised
+        """
+        self.school_data = self.enrolment = self.population = None
+        for block in self._blocks.values():
+            block.close()
+
+    def unlink(self):
+        """Closes the mapping and frees the blocks (owner only); other processes lose access"""
+        if not self.owner:
+            raise ValueError('only the publishing process may unlink the shared datasets')
+        self.close()
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.owner:
+            self.unlink()
+        else:
+            self.close()
+
+
+###   ###   ----------------------------------------------------------------
+###  POOL WORKERS
+_worker_datasets = None
+
+def init_worker(descriptor):
+    """
+    Initializer of a pool worker: attaches it to the shared datasets of
+    descriptor once, for all its tasks, and closes them at exit
+    """
+    global _worker_datasets
+    _worker_datasets = SharedDatasets.attach(descriptor)
+    atexit.register(_worker_datasets.close)
+
+def worker_datasets():
+    """The SharedDatasets the worker was attached to by init_worker"""
+    if _worker_datasets is None:
+        raise RuntimeError('the worker is not attached (start the pool with init_worker)')
+    return _worker_datasets
+
+def _enrolment_vs_population_job(job):
+    year, year_level, delta, match_names = job
+    datasets = worker_datasets()
+    return enrolment_vs_population(datasets.enrolment, datasets.school_data, datasets.population,
+                                   list(year_level), year, delta, match_names)
+
+def enrolment_vs_population_shared(shared, year_levels, years, delta=5, match_names=False, workers=None):
+    """
+    Parallel enrolment_vs_population_batch over published datasets (a
+    SharedDatasets with school data, enrolment and population): every
+    (year, year_level) is answered by a pool worker of workers processes
+    (default: one per CPU) reading the shared views, so only the query
+    parameters and results cross process boundaries. Returns the
+    dictionary keyed by (year, tuple(year_level))
+    """
+    jobs = [(year, tuple(year_level), delta, match_names) for year_level in year_levels for year in years]
+    workers = min(workers or os.cpu_count() or 1, len(jobs)) or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(shared.descriptor,)) as executor:
+        results = executor.map(_enrolment_vs_population_job, jobs)
+        return {(year, year_level): rows for (year, year_level, _, _), rows in zip(jobs, results)}
@@ -0,0 +1,322 @@
+"""
+Spatial index over school coordinates.
+
+The 'Location 1' column of the school location data file, "(lat, lon)",
+is parsed into float arrays, and the schools are indexed in a k-d tree
+over their positions on the unit sphere, so that great-circle distances
+are exact. The index answers "schools within R km of a point" and
+"k nearest schools", singly or for many query points at once (the
+batched queries walk the tree once for all the points, testing every
+node and leaf against the points that reach it with array operations),
+and supports catchment-style enrolment totals that do not depend on
+suburb names.
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import sys
+import csv
+import heapq
+import numpy as np
+
+from AI3_Functions import clean_school_name, school_name_key
+
+
+###   ###   ----------------------------------------------------------------
+# Constants
+EARTH_RADIUS_KM = 6371.0088
+LEAF_SIZE = 16
+
+# Numpy Data Types
+dt_location = np.dtype([
+                ('name', '<U100'),
+                ('suburb', '<U30'),
+                ('lat', '<f8'),
+                ('lon', '<f8'),
+                ])
+
+
+###   ###   ----------------------------------------------------------------
+###  SCHOOL COORDINATES
+def parse_location(s):
+    """
+    Converts a location formatted as '(lat, lon)' into a 2-tuple of
+    float; an empty or malformed location gives (nan, nan)
+    For testing:
+    parse_location('(-35.344681, 149.103287)') should be (-35.344681, 149.103287)
+    parse_location('') should be (nan, nan)
+    """
+    try:
+        lat, lon = s.strip().strip('()').split(',')
+        return float(lat), float(lon)
+    except ValueError:
+        return float('nan'), float('nan')
+
+def get_school_locations(fname, dt=dt_location):
+    """
+    Reads the school location data file fname and returns a 1-dim
+    structured array with dtype=dt: school name, suburb, latitude and
+    longitude (nan where the file has no location)
+    """
+    try:
+        output = []
+        with open(fname) as fopen:
+            csv_reader = csv.reader(fopen)
+            next(csv_reader)                        # skip the header
+            for row in csv_reader:
+                output.append((row[0], row[2]) + parse_location(row[5] if len(row) > 5 else ''))
+        return np.array(output, dtype=dt)
+    except IOError as ioe:
+        print(f'{ioe}: File not found or unreadable', file=sys.stderr)
+    except Exception as ie:
+        print(f'{ie}: Data file is ill-formatted', file=sys.stderr)
+
+def to_unit_vectors(lat, lon):
+    """Converts latitudes and longitudes (degrees) to points on the unit sphere"""
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+def chord_to_km(chord):
+    """Converts chord lengths on the unit sphere to great-circle distances in km"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+def km_to_chord(km):
+    """Converts great-circle distances in km to chord lengths on the unit sphere"""
+    return 2 * np.sin(np.minimum(np.asarray(km, dtype=float) / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+###   ###   ----------------------------------------------------------------
+###  K-D TREE
+class SchoolIndex:
+    """
+    k-d tree over school positions. Queries return school positions
+    (indices into names, lat and lon) with great-circle distances in km,
+    nearest first
+    """
+
+    def __init__(self, names, lat, lon, leaf_size=LEAF_SIZE):
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        known = ~(np.isnan(lat) | np.isnan(lon))           # schools without a location are left out
+        self.names = np.asarray(names)[known]
+        self.lat, self.lon = lat[known], lon[known]
+        self.points = to_unit_vectors(self.lat, self.lon).reshape(-1, 3)
+        self.leaf_size = max(1, leaf_size)
+
+        # Nodes are stored in parallel lists; leaves cover order[start:end].
+        self.order = np.arange(len(self.points))
+        self.start, self.end, self.left, self.right = [], [], [], []
+        self.lower, self.upper = [], []
+        if len(self.points):
+            self._build(0, len(self.points))
+        self.lower, self.upper = np.array(self.lower), np.array(self.upper)
+
+    @classmethod
+    def from_locations(cls, locations, leaf_size=LEAF_SIZE):
+        """Builds the index from the array returned by get_school_locations"""
+        return cls(locations['name'], locations['lat'], locations['lon'], leaf_size)
+
+    def _build(self, start, end):
+        """Builds the subtree over order[start:end] and returns its node number"""
+        node = len(self.start)
+        points = self.points[self.order[start:end]]
+        self.start.append(start)
+        self.end.append(end)
+        self.lower.append(points.min(axis=0))
+        self.upper.append(points.max(axis=0))
+        self.left.append(-1)
+        self.right.append(-1)
+        if end - start > self.leaf_size:
+            # Splits at the median of the widest dimension.
+            axis = int(np.argmax(self.upper[node] - self.lower[node]))
+            middle = (end - start) // 2
+            part = np.argpartition(points[:, axis], middle)
+            self.order[start:end] = self.order[start:end][part]
+            self.left[node] = self._build(start, start + middle)
+            self.right[node] = self._build(start + middle, end)
+        return node
+
+    def _box_distance(self, node, point):
+        """Smallest chord length from point to the bounding box of node"""
+        gap = np.maximum(self.lower[node] - point, 0) + np.maximum(point - self.upper[node], 0)
+        return float(np.sqrt(gap @ gap))
+
+    def _box_distances(self, node, points):
+        """Smallest chord lengths from each of points (shaped (n, 3)) to the bounding box of node"""
+        gap = np.maximum(self.lower[node] - points, 0) + np.maximum(points - self.upper[node], 0)
+        return np.sqrt(np.einsum('ij,ij->i', gap, gap))
+
+    def _leaf_chords(self, node, points):
+        """Returns (members of leaf node, chord lengths shaped (len(points), members))"""
+        members = self.order[self.start[node]:self.end[node]]
+        return members, np.linalg.norm(points[:, None, :] - self.points[members][None, :, :], axis=2)
+
+    def within(self, lat, lon, radius_km):
+        """
+        Returns (positions, distances in km) of the schools within
+        radius_km of the point (lat, lon), nearest first
+        """
+        if not len(self.points):
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        point = to_unit_vectors(lat, lon)
+        radius = float(km_to_chord(radius_km))
+        found, chords = [], []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self._box_distance(node, point) > radius:
+                continue
+            if self.left[node] < 0:
+                members = self.order[self.start[node]:self.end[node]]
+                chord = np.linalg.norm(self.points[members] - point, axis=1)
+                keep = chord <= radius
+                found.append(members[keep])
+                chords.append(chord[keep])
+            else:
+                stack.extend((self.left[node], self.right[node]))
+        found = np.concatenate(found) if found else np.empty(0, dtype=np.intp)
+        chords = np.concatenate(chords) if chords else np.empty(0)
+        order = np.argsort(chords, kind='stable')
+        return found[order], chord_to_km(chords[order])
+
+    def nearest(self, lat, lon, k=1):
+        """
+        Returns (positions, distances in km) of the k schools nearest to the
+        point (lat, lon), nearest first
+        """
+        k = min(k, len(self.points))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        point = to_unit_vectors(lat, lon)
+        best = []                                   # max-heap of (-chord, position)
+        queue = [(0.0, 0)]                          # min-heap of (box distance, node)
+        while queue:
+            distance, node = heapq.heappop(queue)
+            if len(best) == k and distance > -best[0][0]:
+                break
+            if self.left[node] < 0:
+                members = self.order[self.start[node]:self.end[node]]
+                chord = np.linalg.norm(self.points[members] - point, axis=1)
+                for c, m in zip(chord.tolist(), members.tolist()):
+                    if len(best) < k:
+                        heapq.heappush(best, (-c, m))
+                    elif c < -best[0][0]:
+                        heapq.heapreplace(best, (-c, m))
+            else:
+                for child in (self.left[node], self.right[node]):
+                    heapq.heappush(queue, (self._box_distance(child, point), child))
+        best.sort(key=lambda item: (-item[0], item[1]))
+        positions = np.array([m for _, m in best], dtype=np.intp)
+        return positions, chord_to_km(np.array([-c for c, _ in best]))
+
+    def within_pairs(self, lats, lons, radius_km):
+        """
+        All the (query point, school) pairs within radius_km (one value or
+        one per point) of each other, found in one walk of the tree:
+        returns the 3-tuple of arrays (query numbers, positions, distances
+        in km), ordered by query point and then nearest first
+        """
+        points = to_unit_vectors(lats, lons).reshape(-1, 3)
+        radii = km_to_chord(np.broadcast_to(np.asarray(radius_km, dtype=float), (len(points),)))
+        found_queries, found, chords = [], [], []
+        stack = [(0, np.arange(len(points)))] if len(self.points) else []
+        while stack:
+            node, queries = stack.pop()
+            queries = queries[self._box_distances(node, points[queries]) <= radii[queries]]
+            if not len(queries):
+                continue
+            if self.left[node] < 0:
+                members, chord = self._leaf_chords(node, points[queries])
+                rows, cols = np.nonzero(chord <= radii[queries, None])
+                found_queries.append(queries[rows])
+                found.append(members[cols])
+                chords.append(chord[rows, cols])
+            else:
+                stack.extend(((self.left[node], queries), (self.right[node], queries)))
+        if not found:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+        found_queries, found, chords = np.concatenate(found_queries), np.concatenate(found), np.concatenate(chords)
+        order = np.lexsort((chords, found_queries))
+        return found_queries[order], found[order], chord_to_km(chords[order])
+
+    def within_many(self, lats, lons, radius_km):
+        """
+        Batched within: returns a list, one entry per query point, of
+        (positions, distances in km); radius_km may be one value or one
+        per point
+        """
+        if not np.size(lats):
+            return []
+        queries, positions, km = self.within_pairs(lats, lons, radius_km)
+        bounds = np.searchsorted(queries, np.arange(1, np.size(lats)))
+        return list(zip(np.split(positions, bounds), np.split(km, bounds)))
+
+    def nearest_many(self, lats, lons, k=1):
+        """
+        Batched nearest: returns (positions, distances in km) as 2-dim
+        arrays shaped (number of points, k). The points walk the tree
+        together, each leaving a subtree once its bounding box is farther
+        than the point's k-th nearest school so far
+        """
+        points = to_unit_vectors(lats, lons).reshape(-1, 3)
+        k = max(min(k, len(self.points)), 0)
+        best = np.full((len(points), k), np.inf)           # chords of the k nearest so far, sorted
+        positions = np.full((len(points), k), -1, dtype=np.intp)
+        stack = [(0, np.arange(len(points)))] if k else []
+        while stack:
+            node, queries = stack.pop()
+            queries = queries[self._box_distances(node, points[queries]) < best[queries, -1]]
+            if not len(queries):
+                continue
+            if self.left[node] < 0:
+                members, chord = self._leaf_chords(node, points[queries])
+                chords = np.concatenate([best[queries], chord], axis=1)
+                candidates = np.concatenate([positions[queries],
+                                             np.broadcast_to(members, chord.shape)], axis=1)
+                order = np.lexsort((candidates, chords), axis=1)[:, :k]
+                best[queries] = np.take_along_axis(chords, order, axis=1)
+                positions[queries] = np.take_along_axis(candidates, order, axis=1)
+            else:
+                stack.extend(((self.right[node], queries), (self.left[node], queries)))
+        return positions, chord_to_km(best)
+
+
+###   ###   ----------------------------------------------------------------
+###  CATCHMENT ENROLMENT
+def match_enrolment(names, enrolment):
+    """
+    Returns a float array, aligned with names (school names as the
+    location file spells them), of their enrolment in a dictionary keyed
+    by census school name (returned by get_yearly_enrolment). A name is
+    cleaned as the census names are (clean_school_name) and looked up
+    exactly, then by its canonical key (school_name_key); 0 where no
+    census school matches. A census school matched by several locations
+    (the campuses of a college, or one listing per level) has its
+    enrolment divided equally between them, so the array sums to the
+    matched enrolment
+    """
+    census_names = {}
+    for name in enrolment:
+        census_names.setdefault(school_name_key(name), []).append(name)
+
+    # The census schools of every location, then the number of locations of every census school.
+    matches = []
+    locations = {}
+    for name in names:
+        name = clean_school_name(name)
+        match = [name] if name in enrolment else census_names.get(school_name_key(name), [])
+        matches.append(match)
+        for census_name in match:
+            locations[census_name] = locations.get(census_name, 0) + 1
+    return np.array([sum(enrolment[census_name] / locations[census_name] for census_name in match)
+                     for match in matches], dtype=float)
+
+def catchment_enrolment(index, enrolment, lats, lons, radius_km):
+    """
+    Takes a SchoolIndex, a dictionary of yearly enrolment (returned by
+    get_yearly_enrolment) and query points, and returns an array with the
+    total enrolment of the schools within radius_km of every point; the
+    school names are matched as in match_enrolment
+    """
+    values = match_enrolment(index.names.tolist(), enrolment)
+    queries, positions, _ = index.within_pairs(lats, lons, radius_km)
+    return np.bincount(queries, weights=values[positions], minlength=np.size(lats))
@@ -47,6 +47,18 @@ def test_convert_level(test_input, expected):
 def test_convert_census_record(test_input, expected):
     assert convert_census_record(test_input) == expected
     
+def test_conversion_caches():
+    clear_conversion_caches()
+    for _ in range(3):
+        assert cached_clean_school_name('Canberra College, The') == 'Canberra College'
+        assert cached_convert_level('Older & Mature') == 13
+    info = conversion_cache_info()
+    assert info['cached_clean_school_name']['hits'] == 2
+    assert info['cached_clean_school_name']['misses'] == 1
+    clear_conversion_caches()
+    assert conversion_cache_info()['cached_convert_level']['currsize'] == 0
+
+
 @pytest.mark.parametrize('test_input,expected',
                       [('06/30/2015 12:00:00 AM', 2015),
                        ('06/30/2020 11:59:59 PM', 2020)])
@@ -56,7 +68,24 @@ def test_parse_year(test_input, expected):
 
 def test_read_enrolment_data():
     """docstring for test_read_enrolment_data"""
-    pass
+    fname = 'Census_Data_for_all_ACT_Schools.csv'
+    enrolment = read_enrolment_data(fname)
+    assert enrolment[0] == ('2009-02-01', 'Ainslie School', 5, 47)
+    data = read_enrolment_data(fname, dt=dt_census, columnar=True)
+    assert data.dtype == dt_census
+    assert len(data) == len(enrolment)
+    assert data[0]['date'] == np.datetime64('2009-02-01')
+    assert data[0]['name'] == 'Ainslie School'
+    assert data['enrolment'].sum() == sum(e[3] for e in enrolment)
+
+
+def test_iter_enrolment_data():
+    fname = 'Census_Data_for_all_ACT_Schools.csv'
+    enrolment = read_enrolment_data(fname)
+    batches = list(iter_enrolment_data(fname, batch_size=1000))
+    assert [len(b) for b in batches[:-1]] == [1000] * (len(batches) - 1)
+    assert [r for b in batches for r in b] == enrolment
+    assert index_enrolment_file(fname, batch_size=1000) == build_enrolment_index(enrolment)
 
 
 def test_get_yearly_enrolment():
@@ -74,6 +103,24 @@ def test_get_yearly_enrolment():
     assert res['Aranda Primary School'] == 57.0
     assert res['Yarralumla Primary School'] == 31.0
     assert res['Mount Stromlo High School'] == 0
+    assert get_yearly_enrolment(np.asarray(schools, dtype=dt_census), 2011, [2,3]) == res
+
+
+def test_build_enrolment_index():
+    schools = [
+        ('2011-02-01', 'Amaroo School',  6, 116),
+        ('2011-08-01', 'Amaroo School',  6, 120),
+        ('2011-02-01', 'Aranda Primary School',  3,  57),
+        ('2012-02-01', 'Amaroo School',  6, 130)
+    ]
+    index = build_enrolment_index(schools)
+    assert list(index) == ['Amaroo School', 'Aranda Primary School']
+    assert index['Amaroo School'][(2011, 6)] == [236, 2]
+    assert index['Amaroo School'][(2012, 6)] == [130, 1]
+    res = get_yearly_enrolment(index, 2011, [3, 6])
+    assert res == get_yearly_enrolment(schools, 2011, [3, 6])
+    assert res['Amaroo School'] == 118.0
+    assert res['Aranda Primary School'] == 57.0
 
 
 def test_get_suburb_schools():
@@ -95,6 +142,8 @@ def test_get_suburb_schools():
     assert len(res) == len(expected)
     for r,e in zip(res,expected):
         assert r == e
+    res = get_suburb_schools(np.asarray(schools, dtype=dt_school), 'Garran')
+    assert res.tolist() == expected
 
 
 def test_all_suburbs():
@@ -108,10 +157,560 @@ def test_all_suburbs():
 
 def test_read_population_data():
     """docstring for test_read_population_data"""
-    pass
+    fname = 'ACT_Population_Projections_by_Suburb__2015_-_2020_.csv'
+    population = read_population_data(fname)
+    assert population[('Aranda', 2015)][0] == ('12', '12')
+    assert len(population[('Aranda', 2015)]) == 86
+    cube = read_population_data(fname, columnar=True)
+    assert cube.counts.dtype == np.int32
+    assert cube.counts.shape == (110, 6, 86, 2)
+    assert set(cube) == set(population)
+    assert cube[('Aranda', 2015)][-1] == (40, 22)
+    ages = cube.band_ages(JUNIOR_SCHOOL_AGES)
+    assert cube.band_total('Aranda', 2015, ages) == sum(
+        int(f) + int(m) for f, m in population[('Aranda', 2015)][9:17])
     
 
 def test_enrolment_vs_population():
     """docstring for test_enrolment_vs_population"""
-    pass
+    enrolment = [
+        ('2015-02-01', 'Garran Primary', 1, 40),
+        ('2015-08-01', 'Garran Primary', 1, 44),
+        ('2015-02-01', 'Garran Preschool', 0, 20),
+        ('2015-02-01', 'Lyneham Primary', 1, 30),
+        ('2016-02-01', 'Lyneham Primary', 1, 35)
+    ]
+    schools = [
+        ('Garran Preschool', 'Robson Street', 'Garran'),
+        ('Garran Primary', 'Gilmore Crescent', 'Garran'),
+        ('Lyneham Primary', 'Hall Street', 'Lyneham')
+    ]
+    population = {
+        ('Garran', 2015): [('1', '2')] * 8,
+        ('Lyneham', 2015): [('3', '4')] * 8,
+        ('Lyneham', 2016): [('5', '6')] * 8
+    }
+    res = enrolment_vs_population(enrolment, schools, population, [0, 1], 2015)
+    assert sorted(res) == [('Garran', 6, 62.0), ('Lyneham', 14, 30.0)]
+    cube = PopulationCube(['Garran', 'Lyneham'], [2015, 2016],
+                          np.array([[[[1, 2]] * 8, [[0, 0]] * 8],
+                                    [[[3, 4]] * 8, [[5, 6]] * 8]], dtype=np.int32),
+                          np.array([[True, False], [True, True]]))
+    res = enrolment_vs_population(enrolment, schools, cube, [0, 1], 2015)
+    assert sorted(res) == [('Garran', 6, 62.0), ('Lyneham', 14, 30.0)]
+    res = enrolment_vs_population(np.asarray(enrolment, dtype=dt_census),
+                                  np.asarray(schools, dtype=dt_school),
+                                  population, [0, 1], 2015)
+    assert sorted(res) == [('Garran', 6, 62.0), ('Lyneham', 14, 30.0)]
+
+
+def test_load_enrolment_data_cache(tmp_path):
+    from AI3_Cache import load_enrolment_data
+    fname = tmp_path / 'census.csv'
+    fname.write_text('Census,School Name,Category,Year Level,Students\n'
+                     '01 February 2019,Amaroo School,Gov,Year 10,196\n')
+    first = load_enrolment_data(str(fname))
+    cached = load_enrolment_data(str(fname))
+    assert isinstance(cached, np.memmap)
+    assert cached.tolist() == first.tolist()
+    # appending a row makes the cache stale
+    with open(fname, 'a') as fopen:
+        fopen.write('01 August 2019,Amaroo School,Gov,Year 10,200\n')
+    assert len(load_enrolment_data(str(fname))) == 2
+    assert not isinstance(load_enrolment_data(str(fname), rebuild=True), np.memmap)
+
+
+def test_enrolment_vs_population_batch():
+    enrolment = read_enrolment_data('Census_Data_for_all_ACT_Schools.csv')
+    schools = get_school_data('ACT_School_Locations_2017_-_archived.csv')
+    population = read_population_data('ACT_Population_Projections_by_Suburb__2015_-_2020_.csv')
+    groups = [JUNIOR_SCHOOL_AGES, SECONDARY_SCHOOL_AGES]
+    res = enrolment_vs_population_batch(enrolment, schools, population, groups, [2015, 2019])
+    assert len(res) == 4
+    for year in [2015, 2019]:
+        for group in groups:
+            expected = enrolment_vs_population(enrolment, schools, population, group, year)
+            assert sorted(res[(year, tuple(group))]) == sorted(expected)
+
+
+def test_read_enrolment_parallel():
+    from AI3_Parallel import chunk_ranges, read_enrolment_parallel
+    fname = 'Census_Data_for_all_ACT_Schools.csv'
+    ranges = chunk_ranges(fname, 4, min_bytes=1000)
+    assert len(ranges) == 4
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    res = read_enrolment_parallel(fname, workers=2, min_bytes=0, chunk_bytes=1000)
+    assert res == read_enrolment_data(fname)
+
+
+def test_generate_dataset(tmp_path):
+    from AI3_Benchmark import generate_dataset, compare
+    school_file, census_file, pop_file = generate_dataset(
+        str(tmp_path), schools=8, suburbs=3, dates=4, years=2)
+    schools = get_school_data(school_file)
+    enrolment = read_enrolment_data(census_file)
+    population = read_population_data(pop_file)
+    assert len(schools) == 8
+    assert len({e[0] for e in enrolment}) == 4
+    assert len(population) == 3 * 2
+    assert all(len(ages) == 86 for ages in population.values())
+    report = {'sizes': {'small': {'results': {'f': {'seconds': 2.0}, 'g': {'seconds': 1.0}}}}}
+    baseline = {'sizes': {'small': {'results': {'f': {'seconds': 1.0}, 'g': {'seconds': 1.0}}}}}
+    assert compare(report, baseline, tolerance=0.25) == [('small', 'f', 1.0, 2.0)]
+
+
+def test_profile():
+    import tracemalloc
+    import AI3_Profile
+    import AI3_Functions
+    AI3_Profile.reset()
+    AI3_Profile.enable(summary=False)
+    try:
+        assert tracemalloc.is_tracing()
+        assert not hasattr(AI3_Functions.is_array, '__wrapped__')
+        assert not hasattr(AI3_Functions.convert_level, '__wrapped__')
+        AI3_Functions.read_enrolment_data('Census_Data_for_all_ACT_Schools.csv')
+        with AI3_Profile.stage('plot'):
+            pass
+        report = AI3_Profile.report()
+    finally:
+        AI3_Profile.disable()
+        AI3_Profile.reset()
+    assert report['read_enrolment_data']['calls'] == 1
+    assert report['read_enrolment_data']['rows'] == 17131
+    assert report['iter_enrolment_data']['rows'] == 17131
+    assert report['read_enrolment_data']['peak_bytes'] > 0
+    assert report['plot']['calls'] == 1
+    assert not AI3_Profile.enabled()
+    assert not tracemalloc.is_tracing()
+    assert AI3_Functions.read_enrolment_data.__module__ == 'AI3_Functions'
+    assert not hasattr(AI3_Functions.read_enrolment_data, '__wrapped__')
+
+
+def test_incremental_enrolment(tmp_path):
+    from AI3_Incremental import IncrementalEnrolment
+    fname = tmp_path / 'census.csv'
+    fname.write_text('Census,School Name,Category,Year Level,Students\n'
+                     '01 February 2019,Amaroo School,Gov,Year 10,196\n')
+    incremental = IncrementalEnrolment(str(fname))
+    assert incremental.rows == 1
+    with open(fname, 'a') as fopen:
+        fopen.write('01 August 2019,Amaroo School,Gov,Year 10,200\n')
+    assert incremental.refresh() == 1
+    assert incremental.get_yearly_enrolment(2019, [10]) == {'Amaroo School': 198.0}
+    assert incremental.refresh() == 0
+    incremental.save(str(tmp_path / 'state.json'))
+    # a rewritten file is read again from scratch
+    fname.write_text('Census,School Name,Category,Year Level,Students\n'
+                     '01 February 2019,Amaroo School,Gov,Year 10,100\n')
+    assert incremental.refresh() == 1
+    assert incremental.rebuilds == 1
+    assert incremental.get_yearly_enrolment(2019, [10]) == {'Amaroo School': 100.0}
+    assert IncrementalEnrolment.load(str(tmp_path / 'state.json')).index == incremental.index
+    # a half-written row is left until its newline arrives
+    with open(fname, 'a') as fopen:
+        fopen.write('01 August 2019,Amaroo School,Gov,Year 10,1')
+    assert incremental.refresh() == 0 and incremental.rows == 1
+    with open(fname, 'a') as fopen:
+        fopen.write('04\n')
+    assert incremental.refresh() == 1
+    assert incremental.get_yearly_enrolment(2019, [10]) == {'Amaroo School': 102.0}
+    # a change to the last consumed line is a rewrite
+    fname.write_bytes(fname.read_bytes().replace(b',104\n', b',106\n') + b'01 August 2019,Amaroo School,Gov,Year 11,5\n')
+    assert incremental.refresh() == 3 and incremental.rebuilds == 2
+    # so is an edit to an earlier row, even with rows appended after it
+    fname.write_bytes(fname.read_bytes().replace(b',100\n', b',120\n') + b'01 August 2019,Amaroo School,Gov,Year 11,7\n')
+    assert incremental.refresh() == 4 and incremental.rebuilds == 3
+    assert incremental.get_yearly_enrolment(2019, [10]) == {'Amaroo School': 113.0}
+
+
+def test_school_index():
+    from AI3_Spatial import parse_location, SchoolIndex, catchment_enrolment
+    assert parse_location('(-35.344681, 149.103287)') == (-35.344681, 149.103287)
+    assert all(np.isnan(parse_location('')))
+    rng = np.random.default_rng(0)
+    lat, lon = -35.3 + rng.uniform(-0.2, 0.2, 300), 149.1 + rng.uniform(-0.2, 0.2, 300)
+    lat[:10] = np.nan               # schools without a location are left out
+    index = SchoolIndex([f'School {i}' for i in range(300)], lat, lon, leaf_size=8)
+    assert len(index.names) == 290
+    # compared with the haversine distance to every school
+    qlat, qlon = -35.31, 149.12
+    phi, qphi = np.radians(index.lat), np.radians(qlat)
+    a = (np.sin((phi - qphi) / 2) ** 2
+         + np.cos(phi) * np.cos(qphi) * np.sin(np.radians(index.lon - qlon) / 2) ** 2)
+    distances = 2 * 6371.0088 * np.arcsin(np.sqrt(a))
+    positions, km = index.within(qlat, qlon, 5.0)
+    assert set(positions.tolist()) == set(np.nonzero(distances <= 5.0)[0].tolist())
+    assert np.all(np.diff(km) >= 0)
+    positions, km = index.nearest(qlat, qlon, 4)
+    assert np.allclose(km, np.sort(distances)[:4])
+    batch, _ = index.nearest_many([qlat, qlat], [qlon, qlon], 4)
+    assert batch.shape == (2, 4) and batch[1].tolist() == positions.tolist()
+    enrolment = {name: 1.0 for name in index.names.tolist()}
+    assert catchment_enrolment(index, enrolment, [qlat], [qlon], 5.0).tolist() == [np.sum(distances <= 5.0)]
+    within = index.within_many([qlat, -35.2], [qlon, 149.0], [5.0, 3.0])
+    assert within[0][0].tolist() == index.within(qlat, qlon, 5.0)[0].tolist()
+    assert within[1][0].tolist() == index.within(-35.2, 149.0, 3.0)[0].tolist()
+    # location names are matched to census names as the enrolment join matches them
+    schools = SchoolIndex(['The Woden School', 'Aranda Primary School', 'Nowhere High'],
+                          [-35.34, -35.26, -35.30], [149.09, 149.08, 149.10])
+    census = {'Woden School': 100.0, 'Aranda Primary': 50.0}
+    assert catchment_enrolment(schools, census, [-35.30, 0.0], [149.09, 0.0], 20.0).tolist() == [150.0, 0.0]
+    # a two-campus college is counted once, its enrolment divided between the campuses
+    campuses = SchoolIndex(['St Mary MacKillop College - Wanniassa Campus',
+                            'St Mary MacKillop College - Isabella Campus', 'Aranda Primary School'],
+                           [-35.40, -35.43, -35.26], [149.09, 149.09, 149.08])
+    census = {'St Mary MacKillop College': 242.0, 'Aranda Primary': 50.0}
+    assert catchment_enrolment(campuses, census, [-35.41, -35.40], [149.09, 149.09], [20.0, 0.5]).tolist() == [292.0, 121.0]
+
+
+def test_enrolment_store():
+    enrolment = [convert_enrolment_row(row) for row in [
+        ['01 February 2019', 'Amaroo School', 'Gov', 'Year 10', '196'],
+        ['01 February 2019', 'Canberra College, The', 'Gov', 'Year 11', '300'],
+        ['01 August 2019', 'Amaroo School', 'Gov', 'Year 10', '200']]]
+    store = EnrolmentStore.from_records(enrolment)
+    assert store.dates == ['2019-02-01', '2019-08-01']
+    assert store.schools == ['Amaroo School', 'Canberra College']
+    assert list(store) == enrolment and store[1] == enrolment[1] and len(store) == 3
+    assert store.school_codes.dtype == np.int8 and store.students.dtype == np.float32
+    assert build_enrolment_index(store) == build_enrolment_index(enrolment)
+    assert get_yearly_enrolment(store, 2019, [10, 11]) == {'Amaroo School': 198.0, 'Canberra College': 300.0}
+    store.attach_suburbs([('Amaroo School', 'Katherine Avenue', 'Amaroo')])
+    assert store.suburbs == ['Amaroo'] and store.school_suburbs() == {'Amaroo School': ['Amaroo']}
+
+
+def test_render_years(tmp_path):
+    from AI3_Visualiser import render_years
+    tables = {(year, tuple(ages)): [('Aranda', 100 + year % 10, 80.0), ('Belconnen', 300, 350.0)]
+              for year in (2018, 2019) for ages in (JUNIOR_SCHOOL_AGES, SECONDARY_SCHOOL_AGES)}
+    paths = render_years(tables, [2018, 2019], str(tmp_path / 'figures'), 'svg', workers=2)
+    assert [p.split('/')[-1] for p in paths] == ['population_vs_enrolment_2018.svg',
+                                                 'population_vs_enrolment_2019.svg']
+    assert all((tmp_path / 'figures' / p.split('/')[-1]).stat().st_size > 0 for p in paths)
+
+
+def test_query_cli(tmp_path):
+    import sys, json, subprocess
+    from AI3_Benchmark import generate_dataset
+    school_file, census_file, pop_file = generate_dataset(str(tmp_path), schools=10, suburbs=5,
+                                                          dates=4, years=2)
+    argv = ['2015', '--format', 'json', '--school-file', school_file,
+            '--enrol-file', census_file, '--pop-file', pop_file]
+    # a fresh interpreter, so the modules imported by the query can be listed
+    code = ('import sys, AI3_Query; AI3_Query.main(sys.argv[1:]); '
+            'print(sorted({m.split(".")[0] for m in sys.modules if "." in m}), file=sys.stderr)')
+    result = subprocess.run([sys.executable, '-c', code] + argv, capture_output=True, text=True, check=True)
+    assert 'numpy' not in result.stderr and 'matplotlib' not in result.stderr
+    rows = json.loads(result.stdout)
+    expected = enrolment_vs_population(read_enrolment_data(census_file), get_school_data(school_file),
+                                       read_population_data(pop_file), JUNIOR_SCHOOL_AGES, 2015)
+    # suburbs come from a set, so their order depends on the process
+    assert sorted(tuple(row.values()) for row in rows) == sorted(expected)
+
+
+def test_query_service(tmp_path):
+    import json, asyncio
+    from AI3_Service import QueryService, start_server
+    from AI3_Benchmark import generate_dataset
+    files = generate_dataset(str(tmp_path), schools=10, suburbs=5, dates=4, years=2)
+    service = QueryService(*files)
+    expected = enrolment_vs_population(read_enrolment_data(files[1]), get_school_data(files[0]),
+                                       read_population_data(files[2]), SECONDARY_SCHOOL_AGES, 2015)
+
+    async def client():
+        server = await start_server(service, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        replies = []
+        # two requests over one keep-alive connection
+        for request in ('GET /enrolment_vs_population?year=2015&ages=secondary HTTP/1.1',
+                        'POST /reload?force=1 HTTP/1.1',
+                        'GET /status HTTP/1.1\r\nContent-Length: ten'):
+            writer.write(f'{request}\r\nHost: localhost\r\n\r\n'.encode())
+            status = (await reader.readline()).split()[1]
+            length = 0
+            while (line := await reader.readline()).strip():
+                if line.lower().startswith(b'content-length'):
+                    length = int(line.split(b':')[1])
+            replies.append((status, json.loads(await reader.readexactly(length))))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return replies
+
+    (status, rows), (_, reload), (bad_status, error) = asyncio.run(client())
+    assert status == b'200' and bad_status == b'400' and 'Content-Length' in error['error']
+    assert sorted((r['suburb'], r['population'], r['enrolment']) for r in rows) == sorted(expected)
+    assert reload['reloaded'] and service.loads == 2
+
+
+def test_query_service_concurrency(tmp_path):
+    import time, asyncio
+    from AI3_Service import QueryService, dispatch
+    from AI3_Benchmark import generate_dataset
+    service = QueryService(*generate_dataset(str(tmp_path), schools=10, suburbs=5, dates=4, years=2))
+    service.yearly_enrolment = lambda params: time.sleep(0.5) or {}               # a slow, blocking query
+    finished = []
+
+    async def request(target):
+        status, _ = await dispatch(service, 'GET', target)
+        finished.append(target)
+        return status
+
+    async def requests():
+        slow = asyncio.create_task(request('/yearly_enrolment?year=2015'))
+        await asyncio.sleep(0.05)
+        return await request('/status'), await slow
+
+    # the slow query runs in a worker thread, so /status is answered first
+    assert asyncio.run(requests()) == (200, 200)
+    assert finished == ['/status', '/yearly_enrolment?year=2015']
+
+
+def test_result_cache(tmp_path):
+    from AI3_Results import ResultCache
+    enrolment = [('2019-02-01', 'Amaroo School', 10, 196.0), ('2019-08-01', 'Amaroo School', 10, 200.0),
+                 ('2019-02-01', 'Canberra College', 11, 300.0)]
+    now = [0.0]
+    fname = tmp_path / 'census.csv'
+    fname.write_text('x')
+    cache = ResultCache(maxsize=2, ttl=10, files=[str(fname)], clock=lambda: now[0])
+    expected = get_yearly_enrolment(enrolment, 2019, [10, 11])
+    assert cache.get_yearly_enrolment(enrolment, 2019, [10, 11]) == expected
+    assert cache.get_yearly_enrolment(enrolment, 2019, (10, 11)) == expected     # same normalised key
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    cache.get_yearly_enrolment(enrolment, 2019, [10])
+    cache.get_yearly_enrolment(enrolment, 2019, [11])                            # evicts [10, 11]
+    assert cache.stats()['evictions'] == 1 and len(cache) == 2
+    now[0] = 20.0
+    cache.get_yearly_enrolment(enrolment, 2019, [11])                            # expired
+    assert cache.stats()['expirations'] == 1
+    # a grown dataset and a changed file each drop the old entries; a copy is another dataset
+    enrolment.append(('2019-02-01', 'Amaroo School', 11, 4.0))
+    assert cache.get_yearly_enrolment(enrolment, 2019, [11]) == {'Amaroo School': 4.0, 'Canberra College': 300.0}
+    assert cache.stats()['invalidations'] == 2
+    copied = list(enrolment)
+    cache.get_yearly_enrolment(copied, 2019, [11])
+    # alternating two datasets in the same argument keeps both entries
+    cache.get_yearly_enrolment(enrolment, 2019, [11])
+    cache.get_yearly_enrolment(copied, 2019, [11])
+    assert cache.stats()['hits'] == 3 and cache.stats()['invalidations'] == 2
+    fname.write_text('changed')
+    cache.get_yearly_enrolment(enrolment, 2019, [11])
+    stats = cache.stats()
+    assert stats['hits'] == 3 and stats['misses'] == 7 and stats['invalidations'] == 4
+
+
+def test_result_cache_in_place(tmp_path):
+    from AI3_Results import ResultCache, content_fingerprint
+    from AI3_Incremental import IncrementalEnrolment
+    index = build_enrolment_index([('2019-02-01', 'Amaroo School', 10, 196.0)])
+    cache, hashing = ResultCache(), ResultCache(fingerprint=content_fingerprint)
+    assert cache.get_yearly_enrolment(index, 2019, [10]) == {'Amaroo School': 196.0}
+    assert hashing.get_yearly_enrolment(index, 2019, [10]) == {'Amaroo School': 196.0}
+    index['Amaroo School'][(2019, 10)][0] += 4.0                                  # same length, new contents
+    # an edit in place is invalidated explicitly, or found by hashing the contents
+    cache.invalidate(index)
+    assert cache.get_yearly_enrolment(index, 2019, [10]) == {'Amaroo School': 200.0}
+    assert cache.stats()['misses'] == 2 and cache.stats()['hits'] == 0
+    assert hashing.get_yearly_enrolment(index, 2019, [10]) == {'Amaroo School': 200.0}
+    assert hashing.stats()['misses'] == 2
+    # an incremental index is fingerprinted by its read position
+    fname = tmp_path / 'census.csv'
+    fname.write_text('Census,School Name,Category,Year Level,Students\n'
+                     '01 February 2019,Amaroo School,Gov,Year 10,196\n')
+    incremental = IncrementalEnrolment(str(fname))
+    assert cache.get_yearly_enrolment(incremental, 2019, [10]) == {'Amaroo School': 196.0}
+    with open(fname, 'a') as fopen:
+        fopen.write('01 August 2019,Amaroo School,Gov,Year 10,200\n')
+    incremental.refresh()
+    assert cache.get_yearly_enrolment(incremental, 2019, [10]) == {'Amaroo School': 198.0}
+
+
+def test_enrolment_matrix():
+    from AI3_Trends import build_enrolment_matrix
+    enrolment = [('2018-02-01', 'Amaroo School', 0, 10.0), ('2018-02-01', 'Amaroo School', 0, 20.0),
+                 ('2018-08-01', 'Amaroo School', 0, 30.0), ('2019-02-01', 'Amaroo School', 0, 40.0),
+                 ('2018-02-01', 'Canberra College', 11, 300.0), ('2019-02-01', 'Canberra College', 11, 240.0)]
+    matrix = build_enrolment_matrix(enrolment)
+    assert matrix.sums.shape == (2, 3, 14) and matrix.years.tolist() == [2018, 2019]
+    for year in (2018, 2019):
+        assert matrix.get_yearly_enrolment(year, [0, 11]) == get_yearly_enrolment(enrolment, year, [0, 11])
+    assert matrix.growth([0, 11])[:, 1].tolist() == [1.0, -0.2]
+    assert matrix.top_movers(2019, k=1, levels=[0, 11]) == [('Canberra College', -60.0)]
+    assert matrix.top_movers(2019, k=1, levels=[0, 11], relative=True) == [('Amaroo School', 1.0)]
+    rolling = matrix.rolling_mean(2, [0])
+    assert np.isnan(rolling[0, 0]) and rolling[0, 1:].tolist() == [22.5, 35.0]
+
+
+@pytest.mark.parametrize('test_input,expected',
+                      [('Aranda Primary School', 'aranda primary'),
+                       ('Woden School (The)', 'woden school'),
+                       ("St Anthony's Parish Primary", 'st anthonys parish primary'),
+                       ('St Mary MacKillop College - Wanniassa Campus', 'st mary mackillop college'),
+                       ('University of Canberra - Senior Secondary College', 'university of canberra senior secondary college')])
+def test_school_name_key(test_input, expected):
+    assert school_name_key(test_input) == expected
+
+
+def test_school_name_index():
+    schools = [('Aranda Primary', 'Banambila Street', 'Aranda'),
+               ('Woden School (The)', 'Launceston Street', 'Phillip'),
+               ('Burgmann Anglican School - Ford Campus', 'Gungahlin Drive', 'Forde'),
+               ('Burgmann Anglican School - Valley Campus', 'Gungahlin Drive', 'Nicholls')]
+    index = SchoolNameIndex(schools)
+    assert index['Aranda Primary School'] == ['Aranda'] and index.get('Woden School') == ['Phillip']
+    # the campuses of one census name are in two suburbs: ambiguous, not copied to both
+    assert 'Burgmann Anglican School' not in index and index.ambiguous['burgmann anglican school'] == ['Forde', 'Nicholls']
+    assert index['Burgmann Anglican School - Ford Campus'] == ['Forde']
+    assert index.unmatched(['Aranda Primary School', 'Stromlo High School', 'Burgmann Anglican School']) == (
+        ['Burgmann Anglican School', 'Stromlo High School'],
+        ['Burgmann Anglican School - Ford Campus', 'Burgmann Anglican School - Valley Campus', 'Woden School (The)'])
+    enrolment = [('2019-02-01', 'Aranda Primary School', 3, 50.0)]
+    population = {('Aranda', 2019): [(0, 0)] * 8 + [(10, 12)] + [(0, 0)] * 77}
+    assert enrolment_vs_population(enrolment, schools, population, [3], 2019) == [('Aranda', 22, 0)]
+    assert enrolment_vs_population(enrolment, schools, population, [3], 2019,
+                                   match_names=True) == [('Aranda', 22, 50.0)]
+
+
+def test_school_name_index_totals():
+    # every matched census school is counted in exactly one suburb, once
+    school_data = get_school_data('ACT_School_Locations_2017_-_archived.csv')
+    index = SchoolNameIndex(school_data)
+    enrolment = read_enrolment_data('Census_Data_for_all_ACT_Schools.csv')
+    for levels in (SECONDARY_SCHOOL_AGES, list(range(13))):
+        yearly = get_yearly_enrolment(enrolment, 2019, levels)
+        suburb_enrolment = get_suburb_enrolment(yearly, index)
+        matched = sum(value for name, value in yearly.items() if name in index)
+        assert sum(suburb_enrolment.values()) == pytest.approx(matched)
+    assert yearly['St Mary MacKillop College'] > 0 and 'St Mary MacKillop College' not in index
+
+
+def test_sqlite_backend(tmp_path):
+    import os
+    from AI3_SQLite import open_database, get_yearly_enrolment as sql_yearly_enrolment
+    from AI3_SQLite import enrolment_vs_population as sql_enrolment_vs_population
+    from AI3_SQLite import get_suburb_schools as sql_suburb_schools
+    from AI3_Benchmark import generate_dataset
+    files = generate_dataset(str(tmp_path), schools=10, suburbs=5, dates=4, years=2)
+    db_file = str(tmp_path / 'ai3.db')
+    db = open_database(db_file, *files)
+    enrolment, school_data, population = (read_enrolment_data(files[1]), get_school_data(files[0]),
+                                          read_population_data(files[2]))
+    for levels in ([0, 1, 2], [7, 8, 9, 7]):
+        assert sql_yearly_enrolment(db, 2015, levels) == get_yearly_enrolment(enrolment, 2015, levels)
+        assert sorted(sql_enrolment_vs_population(db, levels, 2015)) == sorted(
+            enrolment_vs_population(enrolment, school_data, population, levels, 2015))
+    suburb = school_data[0][2]
+    assert sql_suburb_schools(db, suburb) == get_suburb_schools(school_data, suburb)
+    db.close()
+    # an unchanged database is reopened without re-importing the files
+    mtime = os.stat(db_file).st_mtime_ns
+    open_database(db_file, *files).close()
+    assert os.stat(db_file).st_mtime_ns == mtime
+
+
+def test_year_browser():
+    from AI3_Visualiser import import_pyplot, scatter_frame, YearBrowser
+    plt, cm = import_pyplot('Agg')
+    population = {('Aranda', year): [(year - 2000, 10)] * 86 for year in (2018, 2019)}
+    population[('Bruce', 2019)] = [(5, 5)] * 86
+    enrolment = [('2018-02-01', 'Aranda Primary', 3, 50.0), ('2019-02-01', 'Aranda Primary', 3, 80.0),
+                 ('2019-02-01', 'Bruce High', 8, 30.0)]
+    schools = [('Aranda Primary', 'Banambila Street', 'Aranda'), ('Bruce High', 'Lawson Street', 'Bruce')]
+    tables = enrolment_vs_population_batch(enrolment, schools, population,
+                                           list(AGE_GROUPS.values()), [2018, 2019])
+    browser = YearBrowser(plt, cm, tables, [2018, 2019], AGE_GROUPS, year=2018, age_group='junior')
+    browser.fig.canvas.draw()
+    assert browser.background is not None
+    blitted = []
+    browser.fig.canvas.blit = blitted.append
+    browser.slider.set_val(2019)
+    # only the scatter axes and the slider are blitted, not the whole figure
+    assert len(blitted) == 2 and blitted[0] == browser.ax.bbox
+    assert blitted[1].contains(*browser.slider.ax.bbox.p0) and blitted[1].width < browser.fig.bbox.width
+    # the same artist now holds the 2019 scatter
+    assert browser.year == 2019 and len(browser.ax.collections) == 1
+    offsets, colours, sizes = scatter_frame(tables[(2019, tuple(JUNIOR_SCHOOL_AGES))])
+    assert browser.scatter.get_offsets().tolist() == offsets.tolist()
+    assert sorted(offsets.tolist()) == [[80.0, 30.0], [232.0, 0.0]]
+    assert browser.scatter.get_sizes().tolist() == sizes.tolist()
+    browser.set_age_group('secondary')
+    assert browser.ax.get_xlim() == (-200, 174 + 300) and browser.label.get_text() == '2019'
+    plt.close(browser.fig)
+
+
+def test_census_row_filter():
+    keep = census_row_filter(years=range(2018, 2020), sectors='Non Gov', levels=[11, 12])
+    assert keep(['20 February 2019', 'Canberra Grammar School', 'Non-Gov', 'Year 11', '200'])
+    assert not keep(['20 February 2019', 'Canberra College, The', 'Gov', 'Year 11', '300'])
+    assert not keep(['21 February 2017', 'Canberra Grammar School', 'Non Gov', 'Year 11', '190'])
+    assert not keep(['20 February 2019', 'Canberra Grammar School', 'Non Gov', 'Year 7', '150'])
+    keep = census_row_filter(years='2019', levels='11')
+    assert keep(['20 February 2019', 'Canberra College, The', 'Gov', 'Year 11', '300'])
+    assert not keep(['20 February 2019', 'Canberra College, The', 'Gov', 'Year 1', '300'])
+    assert not keep(['21 February 2011', 'Canberra College, The', 'Gov', 'Year 11', '300'])
+    assert census_row_filter() is None
+
+
+def test_enrolment_by_sector(tmp_path):
+    fname = tmp_path / 'census.csv'
+    fname.write_text('Census,School Name,Category,Year Level,Students\n'
+                     '20 February 2019,Aranda Primary,Gov,Year 3,50\n'
+                     '20 February 2019,St Vincents Primary,Non Gov,Year 3,30\n'
+                     '21 February 2018,Aranda Primary,Gov,Year 3,40\n'
+                     '20 February 2019,Aranda Primary,Gov,Year 4,20\n')
+    enrolment = read_enrolment_data(str(fname), years=[2019], levels=[3], keep_sector=True)
+    assert enrolment == [('2019-02-20', 'Aranda Primary', 3, 50.0, 'Gov'),
+                         ('2019-02-20', 'St Vincents Primary', 3, 30.0, 'Non-Gov')]
+    assert read_enrolment_data(str(fname), sectors='Gov', keep_sector=True, columnar=True)['sector'].tolist() == ['Gov'] * 3
+    schools = [('Aranda Primary', 'Banambila Street', 'Aranda'), ('St Vincents Primary', 'Bindel Street', 'Aranda')]
+    population = {('Aranda', 2019): [(0, 0)] * 8 + [(10, 12)] + [(0, 0)] * 77}
+    assert enrolment_vs_population_by_sector(enrolment, schools, population, [3], 2019) == [('Aranda', 22, 50.0, 30.0)]
+    assert enrolment_vs_population_by_sector(enrolment, schools, population_cube(population), [3], 2019) == [('Aranda', 22, 50.0, 30.0)]
+    assert enrolment_vs_population(enrolment, schools, population, [3], 2019, sector='Non-Gov') == [('Aranda', 22, 30.0)]
+    with pytest.raises(ValueError):
+        select_sector(read_enrolment_data(str(fname)), 'Gov')
+
+
+def test_shared_datasets(tmp_path):
+    import pickle
+    from AI3_Shared import SharedDatasets, enrolment_vs_population_shared
+    from AI3_Benchmark import generate_dataset
+    files = generate_dataset(str(tmp_path), schools=10, suburbs=5, dates=4, years=2)
+    school_data, enrolment, population = (get_school_data(files[0]), read_enrolment_data(files[1]),
+                                          read_population_data(files[2]))
+    with SharedDatasets.publish(school_data, enrolment, population) as shared:
+        descriptor = pickle.loads(pickle.dumps(shared.descriptor))
+        attached = SharedDatasets.attach(descriptor)
+        assert not attached.enrolment.flags.writeable and not attached.enrolment.flags.owndata
+        assert attached.enrolment.tolist() == shared.enrolment.tolist()
+        expected = enrolment_vs_population(enrolment, school_data, population, JUNIOR_SCHOOL_AGES, 2015)
+        assert sorted(enrolment_vs_population(attached.enrolment, attached.school_data, attached.population,
+                                              JUNIOR_SCHOOL_AGES, 2015)) == sorted(expected)
+        attached.close()
+        rows = enrolment_vs_population_shared(shared, [JUNIOR_SCHOOL_AGES], [2015], workers=2)
+        assert sorted(rows[(2015, tuple(JUNIOR_SCHOOL_AGES))]) == sorted(expected)
+    # leaving the with block freed the blocks
+    with pytest.raises(FileNotFoundError):
+        SharedDatasets.attach(descriptor)
+
 
+def test_enrolment_vs_population_sweep():
+    enrolment = [('2019-02-01', 'Aranda Primary', 3, 50.0), ('2019-02-01', 'Aranda Primary', 4, 40.0),
+                 ('2019-08-01', 'Aranda Primary', 4, 44.0), ('2019-02-01', 'Bruce High', 8, 30.0)]
+    schools = [('Aranda Primary', 'Banambila Street', 'Aranda'), ('Bruce High', 'Lawson Street', 'Bruce')]
+    population = {('Aranda', 2019): [(age, 2 * age) for age in range(86)],
+                  ('Bruce', 2019): [(1, 1)] * 86}
+    cube = population_cube(population)
+    assert cube.age_range_totals(8, 10)[cube.suburb_index['Aranda']].tolist() == [3 * (8 + 9 + 10)]
+    assert cube.age_range_totals(84, 90, sex=1)[cube.suburb_index['Bruce']].tolist() == [2]
+    assert level_band(SECONDARY_SCHOOL_AGES) == (12, 17)
+    with pytest.raises(ValueError):
+        level_band([1, 3])
+    sweep = enrolment_vs_population_sweep(enrolment, schools, population, [(3, 4), (7, 12)], [4, 5, 6], [2019])
+    assert len(sweep) == 6
+    for (year, delta, (first, last)), rows in sweep.items():
+        assert sorted(rows) == sorted(enrolment_vs_population(enrolment, schools, population,
+                                                              list(range(first, last + 1)), year, delta))
@@ -0,0 +1,189 @@
+"""
+Per-school enrolment time series as a dense NumPy matrix.
+
+build_enrolment_matrix turns enrolment data (the list returned by
+read_enrolment_data, its columnar form, or an EnrolmentStore) into an
+EnrolmentMatrix: arrays shaped (school, census date, year level) with the
+axes labelled by schools, dates and levels. Trend queries are then
+computed for all schools at once: yearly means (as get_yearly_enrolment
+averages the census dates of a year), year-on-year growth, rolling means
+across census rounds and the top-k movers.
+
+Preschool and Kindergarten both map to level 0, so a cell can hold more
+than one record; as in get_yearly_enrolment, every record counts once
+towards a mean.
+"""
+
+###   ###   ----------------------------------------------------------------
+# Import statements
+import numpy as np
+
+from AI3_Functions import YEAR_NAMES, EnrolmentStore, is_array
+
+
+###   ###   ----------------------------------------------------------------
+###  MATRIX
+class EnrolmentMatrix:
+    """
+    Enrolment held in two arrays shaped (school, date, level): sums, the
+    total of the records in a cell, and counts, their number. schools are
+    in the order they first appear, dates (numpy.datetime64) are sorted
+    and levels run from 0 to 13
+    """
+
+    def __init__(self, schools, dates, sums, counts):
+        self.schools = list(schools)
+        self.dates = dates
+        self.levels = np.arange(sums.shape[2])
+        self.sums = sums
+        self.counts = counts
+        # Dates are sorted, so each year is a contiguous run along the date axis.
+        date_years = self.dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        self.years, self.year_starts = np.unique(date_years, return_index=True)
+
+    @property
+    def values(self):
+        """Mean enrolment of every (school, date, level) cell, nan where empty"""
+        return np.divide(self.sums, self.counts, out=np.full(self.sums.shape, np.nan),
+                         where=self.counts > 0)
+
+    def _levels(self, levels):
+        """The requested levels in order, without those outside the matrix"""
+        if levels is None:
+            return self.levels.tolist()
+        return [level for level in levels if 0 <= level < len(self.levels)]
+
+    ###  YEARLY MEANS
+    def yearly_means(self):
+        """
+        Returns an array shaped (school, year, level), aligned with years, of
+        the mean enrolment over the census dates of every year (nan where a
+        school has no records)
+        """
+        if len(self.years) == 0:
+            return np.full((len(self.schools), 0, len(self.levels)), np.nan)
+        sums = np.add.reduceat(self.sums, self.year_starts, axis=1)
+        counts = np.add.reduceat(self.counts, self.year_starts, axis=1)
+        return np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+
+    def yearly_totals(self, levels=None):
+        """
+        Returns an array shaped (school, year) of the yearly means totalled
+        over levels (default: all), as get_yearly_enrolment totals them
+        for every year at once
+        """
+        means = np.nan_to_num(self.yearly_means())
+        totals = np.zeros((len(self.schools), len(self.years)))
+        for level in self._levels(levels):                  # added in the order given, like get_yearly_enrolment
+            totals += means[:, :, level]
+        return totals
+
+    def get_yearly_enrolment(self, year, levels=[]):
+        """get_yearly_enrolment for one year, from the matrix"""
+        j = np.searchsorted(self.years, year)
+        if j == len(self.years) or self.years[j] != year:
+            return dict.fromkeys(self.schools, 0)
+        return dict(zip(self.schools, self.yearly_totals(levels)[:, j].tolist()))
+
+    ###  TRENDS
+    def growth(self, levels=None, periods=1):
+        """
+        Returns an array shaped (school, year) of the growth rate of the
+        yearly totals over periods years, (t[y] - t[y - periods]) / t[y - periods];
+        nan for the first periods years and where the earlier total is 0
+        """
+        totals = self.yearly_totals(levels)
+        growth = np.full(totals.shape, np.nan)
+        if 0 < periods < totals.shape[1]:
+            before, after = totals[:, :-periods], totals[:, periods:]
+            np.divide(after - before, before, out=growth[:, periods:], where=before != 0)
+        return growth
+
+    def date_totals(self, levels=None):
+        """
+        Returns an array shaped (school, date) of the cell means totalled
+        over levels (default: all), nan where a school has no records on a date
+        """
+        levels = self._levels(levels)
+        values = self.values[:, :, levels]
+        totals = np.nansum(values, axis=2)
+        totals[np.all(np.isnan(values), axis=2)] = np.nan
+        return totals
+
+    def rolling_mean(self, window, levels=None):
+        """
+        Returns an array shaped (school, date) of the mean of date_totals
+        over the last window census rounds (rounds without records are
+        skipped); nan until a full window of rounds has passed
+        """
+        if window < 1:
+            raise ValueError(f'window must be at least 1, not {window}')
+        totals = self.date_totals(levels)
+        present = ~np.isnan(totals)
+        sums = np.cumsum(np.where(present, totals, 0), axis=1)
+        counts = np.cumsum(present, axis=1)
+        sums[:, window:] = sums[:, window:] - sums[:, :-window]
+        counts[:, window:] = counts[:, window:] - counts[:, :-window]
+        means = np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+        means[:, :window - 1] = np.nan
+        return means
+
+    def top_movers(self, year, k=10, levels=None, periods=1, relative=False):
+        """
+        Returns a list of 2-tuples (school, change) of the k schools whose
+        yearly totals changed the most (in absolute value) from
+        year - periods to year; the change is a growth rate if
+        relative = True, or a difference in enrolment otherwise
+        """
+        j = np.searchsorted(self.years, year)
+        if j == len(self.years) or self.years[j] != year or j < periods:
+            return []
+        if relative:
+            change = self.growth(levels, periods)[:, j]
+        else:
+            totals = self.yearly_totals(levels)
+            change = totals[:, j] - totals[:, j - periods]
+        valid = np.flatnonzero(~np.isnan(change))
+        k = min(k, len(valid))
+        if k == 0:
+            return []
+        top = valid[np.argpartition(-np.abs(change[valid]), k - 1)[:k]]
+        top = top[np.argsort(-np.abs(change[top]), kind='stable')]
+        return [(self.schools[i], float(change[i])) for i in top]
+
+
+###   ###   ----------------------------------------------------------------
+###  BUILDER
+def build_enrolment_matrix(enrolment, levels=len(YEAR_NAMES)):
+    """
+    Builds the EnrolmentMatrix of enrolment data: the list of 4-tuples
+    returned by read_enrolment_data, a structured array (columnar = True)
+    or an EnrolmentStore. Records with a level outside range(levels) are
+    left out
+    """
+    if is_array(enrolment):
+        date, name, level, students = enrolment.dtype.names[:4]
+        dates = enrolment[date]
+        if dates.dtype.kind == 'M':
+            dates = dates.astype('datetime64[D]').astype(str)
+        enrolment = zip(dates.tolist(), enrolment[name].tolist(),
+                        enrolment[level].tolist(), enrolment[students].tolist())
+    if not isinstance(enrolment, EnrolmentStore):
+        enrolment = EnrolmentStore.from_records(enrolment)
+
+    # Sorts the date table and recodes the records to the sorted dates.
+    dates = np.array(enrolment.dates, dtype='datetime64[D]')
+    order = np.argsort(dates, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    # One bincount per array over the flattened (school, date, level) cells.
+    shape = (len(enrolment.schools), len(dates), levels)
+    keep = (enrolment.levels >= 0) & (enrolment.levels < levels)
+    cells = np.ravel_multi_index((enrolment.school_codes[keep].astype(np.int64),
+                                  rank[enrolment.date_codes[keep]],
+                                  enrolment.levels[keep].astype(np.int64)), shape)
+    size = int(np.prod(shape))
+    sums = np.bincount(cells, weights=enrolment.students[keep], minlength=size).reshape(shape)
+    counts = np.bincount(cells, minlength=size).reshape(shape)
+    return EnrolmentMatrix(enrolment.schools, dates[order], sums, counts)
@@ -1,93 +1,332 @@
+import os
+import sys
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from AI3_Functions import *
+from AI3_Cache import load_datasets
+import AI3_Profile
 
-if __name__ == '__main__':
-    
-    the_year = 2019
-    try:
-        the_year = int(sys.argv[1])
-    except Exception as e:
-        print(f'The usage: python3 {sys.argv[0]} year', end=' ')
-        print(f'(no year provided, using the default value {the_year})')
-    
+FIGURE_AGE_GROUPS = [JUNIOR_SCHOOL_AGES, SECONDARY_SCHOOL_AGES]   # the two panels of the figure
+FIGURE_FORMATS = ['png', 'svg']
+
+
+def import_pyplot(backend=None):
+    """
+    Imports matplotlib.pyplot, with the given backend (e.g. 'Agg' for
+    rendering to files without a display), and sets the plot style;
+    returns (pyplot, colour map)
+    """
+    import matplotlib
+    if backend is not None:
+        matplotlib.use(backend)
     import matplotlib.pyplot as plt
-    cm = plt.cm.get_cmap('jet')
     # import seaborn as sns
     # sns.set()
-    plt.style.use('seaborn')
-    school_data_file = "ACT_School_Locations_2017_-_archived.csv" 
-    enrol_data_file  = "Census_Data_for_all_ACT_Schools.csv"
-    pop_data_file    = "ACT_Population_Projections_by_Suburb__2015_-_2020_.csv" 
-    school_data = get_school_data(school_data_file, dt=dt_school)
-    enrolment   = read_enrolment_data(enrol_data_file, dt=dt_census)
-    population  = read_population_data(pop_data_file, ages_range=86)
-    
-    age_group = JUNIOR_SCHOOL_AGES
-    school_age_data = enrolment_vs_population(
-                           enrolment,
-                           school_data,
-                           population, 
-                           year_level=JUNIOR_SCHOOL_AGES,
-                           year=the_year
-                           )
+    try:
+        plt.style.use('seaborn')
+    except OSError:
+        plt.style.use('seaborn-v0_8') # the seaborn style was renamed in matplotlib 3.6
+    return plt, plt.get_cmap('jet')
+
+def scatter_data(school_age_data):
+    """
+    Returns the lists (populations, enrolments, colours, sizes) scattered
+    for the 3-tuples returned by enrolment_vs_population
+    """
     # retain only those suburbs where someone lives and goes to school
     school_age_data  = [e for e in school_age_data if e[1:] != (0,0)]
     pop_numbers  = [e[1] for e in school_age_data]
     enr_numbers  = [e[2] for e in school_age_data]
     diffs        = [(e[1] - e[2]) for e in school_age_data]
     mind, maxd = (min(diffs), max(diffs)) if diffs else (1,0)
+    spread = (maxd - mind) or 1 # a single suburb (or equal differences) has no spread
     colours = [d//10 for d in diffs] # break into subgroups of one colour
-    sizes = [abs(d)*500/(maxd - mind) for d in diffs] # set point sizes
+    sizes = [abs(d)*500/spread for d in diffs] # set point sizes
+    return pop_numbers, enr_numbers, colours, sizes
 
-    # plotting
+def plot_age_group(fig, ax, cm, school_age_data, the_year, age_group):
+    """
+    Scatters population vs enrolment (the 3-tuples returned by
+    enrolment_vs_population) for one age group on ax
+    """
+    pop_numbers, enr_numbers, colours, sizes = scatter_data(school_age_data)
+    g = ax.scatter(pop_numbers, enr_numbers, c=colours, s=sizes,
+                                            alpha=.7, cmap=cm)
+    ages = '-'.join([str(y) for y in [min(age_group), max(age_group)]])
+    title = f'Population vs Enrolment in {the_year} for {ages} years olds'
+    ax.set_title(title, fontsize=12)
+    max_p = max(pop_numbers) if pop_numbers else 100
+    max_e = max(enr_numbers) if enr_numbers else 100
+    ax.set_xlim(-200, max_p + 300) # add h-space to avoid clipping
+    ax.set_ylim(-200, max_e + 300) # add v-space to avoid clipping
+    ax.set_ylabel('Suburb School Enrolment')
+    fig.colorbar(g, ax=ax)
+
+def draw_figure(plt, cm, school_age_tables, the_year):
+    """
+    Draws the figure for the_year from the tables returned by
+    enrolment_vs_population_batch: junior school ages on top, secondary
+    school ages below; returns the figure
+    """
     fig = plt.figure(figsize=(6,6))
     ax1 = fig.add_subplot(211)
     ax2 = fig.add_subplot(212)
     fig.subplots_adjust(hspace=0)
     fig.tight_layout()
-    
+
     # for junior school ages
-    g1 = ax1.scatter(pop_numbers, enr_numbers, c=colours, s=sizes, 
-                                            alpha=.7, cmap=cm)
-    ages = '-'.join([str(y) for y in [min(age_group), max(age_group)]])
-    title = f'Population vs Enrolment in {the_year} for {ages} years olds'
-    ax1.set_title(title, fontsize=12)
-    max_p = max(pop_numbers) if pop_numbers else 100
-    max_e = max(enr_numbers) if enr_numbers else 100
-    ax1.set_xlim(-200, max_p + 300) # add h-space to avoid clipping
-    ax1.set_ylim(-200, max_e + 300) # add v-space to avoid clipping
+    plot_age_group(fig, ax1, cm, school_age_tables[(the_year, tuple(JUNIOR_SCHOOL_AGES))],
+                   the_year, JUNIOR_SCHOOL_AGES)
     # ax1.set_xticks([])
-    ax1.set_ylabel('Suburb School Enrolment')
-    fig.colorbar(g1, ax=ax1)
-    
+
     # for secondary school ages
-    age_group = SECONDARY_SCHOOL_AGES
-    school_age_data = enrolment_vs_population(
+    plot_age_group(fig, ax2, cm, school_age_tables[(the_year, tuple(SECONDARY_SCHOOL_AGES))],
+                   the_year, SECONDARY_SCHOOL_AGES)
+    ax2.set_xlabel('Suburb Population for School Ages (in thousands)', fontsize=10)
+    return fig
+
+###   ###   ----------------------------------------------------------------
+###  HEADLESS BATCH RENDERING
+def render_year(job):
+    """
+    Renders one figure to a file without a display; job is the 3-tuple
+    (year, tables of that year, path). Returns the path
+    """
+    the_year, school_age_tables, path = job
+    plt, cm = import_pyplot('Agg')
+    fig = draw_figure(plt, cm, school_age_tables, the_year)
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+def render_years(school_age_tables, years, output_dir, fmt='png', workers=None):
+    """
+    Writes one figure per year to output_dir (as population_vs_enrolment_YEAR.fmt),
+    from the tables returned by enrolment_vs_population_batch, spreading the
+    rendering over a pool of worker processes (all CPUs by default).
+    The data is never re-parsed: every worker only receives the tables of
+    its year. Returns the list of paths written
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(year, {key: table for key, table in school_age_tables.items() if key[0] == year},
+             os.path.join(output_dir, f'population_vs_enrolment_{year}.{fmt}'))
+            for year in years]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return [render_year(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(render_year, jobs))
+
+
+###   ###   ----------------------------------------------------------------
+###  INTERACTIVE YEAR SLIDER
+def scatter_frame(school_age_data):
+    """
+    Returns the arrays (offsets, colours, sizes) that plot_age_group
+    scatters for school_age_data, ready to be set on an existing artist
+    """
+    pop_numbers, enr_numbers, colours, sizes = scatter_data(school_age_data)
+    return (np.column_stack([pop_numbers, enr_numbers]).astype(float),
+            np.asarray(colours, dtype=float), np.asarray(sizes, dtype=float))
+
+class YearBrowser:
+    """
+    Interactive figure of population vs enrolment, with a year slider and
+    an age-group selector (age_groups maps names to year levels). The
+    scatter data of every (year, age group) is computed up front from the
+    tables returned by enrolment_vs_population_batch. Moving the slider
+    only sets the offsets, sizes and colours of the existing scatter
+    artist and blits it over the saved background; the axes and colour
+    range of an age group span all its years, so they stay put. Selecting
+    another age group rescales them and redraws the whole figure
+    """
+
+    def __init__(self, plt, cm, school_age_tables, years, age_groups, year=None, age_group=None):
+        from matplotlib.widgets import Slider, RadioButtons
+        self.years = sorted(years)
+        self.age_groups = dict(age_groups)
+        self.frames = {(the_year, name): scatter_frame(school_age_tables[(the_year, tuple(levels))])
+                       for name, levels in self.age_groups.items() for the_year in self.years}
+
+        # Axis limits and colour range of every age group, over all years.
+        self.limits = {}
+        for name in self.age_groups:
+            frames = [self.frames[(the_year, name)] for the_year in self.years]
+            offsets = np.concatenate([frame[0] for frame in frames])
+            colours = np.concatenate([frame[1] for frame in frames])
+            max_p, max_e = offsets.max(axis=0) if len(offsets) else (100, 100)
+            clim = (colours.min(), colours.max()) if len(colours) else (0, 1)
+            self.limits[name] = ((-200, max_p + 300), (-200, max_e + 300), clim)
+
+        self.year = year if year in self.years else self.years[-1]
+        self.age_group = age_group if age_group in self.age_groups else next(iter(self.age_groups))
+        self.background = None
+
+        self.fig = plt.figure(figsize=(7, 6))
+        self.ax = self.fig.add_axes([0.12, 0.3, 0.66, 0.62])
+        offsets, colours, sizes = self.frames[(self.year, self.age_group)]
+        self.scatter = self.ax.scatter(offsets[:, 0], offsets[:, 1], c=colours, s=sizes,
+                                       alpha=.7, cmap=cm, animated=True)
+        self.label = self.ax.text(0.02, 0.96, '', transform=self.ax.transAxes,
+                                  va='top', fontsize=12, animated=True)
+        self.fig.colorbar(self.scatter, cax=self.fig.add_axes([0.82, 0.3, 0.03, 0.62]))
+        self.ax.set_xlabel('Suburb Population for School Ages', fontsize=10)
+        self.ax.set_ylabel('Suburb School Enrolment')
+
+        # The slider is drawn by the blit too (drawon = False stops its own full redraws).
+        slider_ax = self.fig.add_axes([0.12, 0.15, 0.66, 0.04], animated=True)
+        self.slider = Slider(slider_ax, 'Year', self.years[0], max(self.years[-1], self.years[0] + 1),
+                             valinit=self.year, valstep=self.years, valfmt='%d')
+        self.slider.drawon = False
+        self.slider.on_changed(lambda value: self.set_year(int(round(value))))
+        radio_ax = self.fig.add_axes([0.82, 0.02, 0.16, 0.2])
+        names = list(self.age_groups)
+        self.radio = RadioButtons(radio_ax, names, active=names.index(self.age_group))
+        self.radio.on_clicked(self.set_age_group)
+
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        self._rescale()
+        self._update_artists()
+
+    def _on_draw(self, event):
+        """Saves the background (everything but the animated artists) after a full draw"""
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _slider_bbox(self):
+        """The display box of the slider axes with its label and value text (drawn outside the axes)"""
+        from matplotlib.transforms import Bbox
+        return Bbox.union([self.slider.ax.bbox, self.slider.label.get_window_extent(),
+                           self.slider.valtext.get_window_extent()])
+
+    def _draw_animated(self):
+        for artist in (self.scatter, self.label, self.slider.ax):
+            self.fig.draw_artist(artist)
+
+    def _rescale(self):
+        xlim, ylim, clim = self.limits[self.age_group]
+        levels = self.age_groups[self.age_group]
+        self.ax.set_xlim(*xlim)
+        self.ax.set_ylim(*ylim)
+        self.scatter.set_clim(*clim)
+        self.ax.set_title(f'Population vs Enrolment for {min(levels)}-{max(levels)} years olds', fontsize=12)
+
+    def _update_artists(self):
+        offsets, colours, sizes = self.frames[(self.year, self.age_group)]
+        self.scatter.set_offsets(offsets)
+        self.scatter.set_sizes(sizes)
+        self.scatter.set_array(colours)
+        self.label.set_text(str(self.year))
+
+    def set_year(self, year):
+        """Shows year (one of years), blitting the updated artists"""
+        if year not in self.years or year == self.year:
+            return
+        self.year = year
+        self._update_artists()
+        if self.background is None:                 # nothing drawn yet
+            self.fig.canvas.draw_idle()
+            return
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        self._draw_animated()
+        canvas.blit(self.ax.bbox)                   # only the regions the animated artists cover
+        canvas.blit(self._slider_bbox())
+        canvas.flush_events()
+
+    def set_age_group(self, name):
+        """Shows the age group name, rescaling the axes and colour bar (a full redraw)"""
+        if name not in self.age_groups or name == self.age_group:
+            return
+        self.age_group = name
+        self._rescale()
+        self._update_artists()
+        self.fig.canvas.draw_idle()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Plots suburb population vs school enrolment')
+    parser.add_argument('year', nargs='?', help='year of census (default 2019)')
+    parser.add_argument('--rebuild-cache', action='store_true',
+                        help='re-parse the data files and rewrite the on-disk cache')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse the data files without using the on-disk cache')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time, calls, rows and memory of every stage at exit')
+    parser.add_argument('--profile-json', metavar='FILE',
+                        help='with --profile, also write the measurements to FILE as JSON')
+    parser.add_argument('--match-names', action='store_true',
+                        help='match census and location school names by canonical key')
+    parser.add_argument('--output-dir', metavar='DIR',
+                        help='render without a display, writing one figure per year to DIR')
+    parser.add_argument('--years', nargs=2, type=int, metavar=('FIRST', 'LAST'),
+                        help='with --output-dir, render every year from FIRST to LAST')
+    parser.add_argument('--format', choices=FIGURE_FORMATS, default='png',
+                        help='with --output-dir, the file format of the figures')
+    parser.add_argument('--workers', type=int,
+                        help='with --output-dir, the number of rendering processes (default: all CPUs)')
+    parser.add_argument('--interactive', action='store_true',
+                        help='browse every year of population data with a year slider and age-group selector')
+    args = parser.parse_args()
+    if args.profile:
+        AI3_Profile.enable(json_path=args.profile_json)
+
+    the_year = 2019
+    try:
+        the_year = int(args.year)
+    except Exception as e:
+        if not args.years:
+            print(f'The usage: python3 {sys.argv[0]} year', end=' ')
+            print(f'(no year provided, using the default value {the_year})')
+    years = list(range(args.years[0], args.years[1] + 1)) if args.years else [the_year]
+
+    school_data_file = "ACT_School_Locations_2017_-_archived.csv"
+    enrol_data_file  = "Census_Data_for_all_ACT_Schools.csv"
+    pop_data_file    = "ACT_Population_Projections_by_Suburb__2015_-_2020_.csv"
+    with AI3_Profile.stage('load data'):
+        if args.no_cache:
+            school_data = get_school_data(school_data_file, dt=dt_school)
+            enrolment   = read_enrolment_data(enrol_data_file, dt=dt_census)
+            population  = read_population_data(pop_data_file, ages_range=86)
+        else:
+            school_data, enrolment, population = load_datasets(
+                               school_data_file, enrol_data_file, pop_data_file,
+                               ages_range=86, rebuild=args.rebuild_cache)
+
+    # the interactive figure precomputes every year of population data and every age group
+    age_groups = FIGURE_AGE_GROUPS
+    if args.interactive:
+        years = sorted(population_cube(population).years)
+        age_groups = list(AGE_GROUPS.values())
+
+    # every year and age group is computed from a single pass over the data
+    school_age_tables = enrolment_vs_population_batch(
                            enrolment,
                            school_data,
-                           population, 
-                           year_level=SECONDARY_SCHOOL_AGES,
-                           year=the_year
+                           population,
+                           year_levels=age_groups,
+                           years=years,
+                           match_names=args.match_names
                            )
-    # retain only those suburbs where someone lives and goes to school
-    school_age_data  = [e for e in school_age_data if e[1:] != (0,0)]
-    pop_numbers  = [e[1] for e in school_age_data]
-    enr_numbers  = [e[2] for e in school_age_data]
-    diffs        = [(e[1] - e[2]) for e in school_age_data]
-    mind, maxd = (min(diffs), max(diffs)) if diffs else (1,0)
-    colours = [d//10 for d in diffs] # break into subgroups of one colour
-    sizes = [abs(d)*500/(maxd - mind) for d in diffs] # set point sizes
-    g2 = ax2.scatter(pop_numbers, enr_numbers, 
-                c=colours, s=sizes, alpha=.7, cmap=cm)
-    ages = '-'.join([str(y) for y in [min(age_group), max(age_group)]])
-    title = f'Population vs Enrolment in {the_year} for {ages} years olds'
-    ax2.set_title(title, fontsize=12)
-    max_p = max(pop_numbers) if pop_numbers else 100
-    max_e = max(enr_numbers) if enr_numbers else 100
-    ax2.set_xlim(-200, max_p + 300) # add h-space to avoid clipping
-    ax2.set_ylim(-200, max_e + 300) # add v-space to avoid clipping
-    ax2.set_ylabel('Suburb School Enrolment')
-    ax2.set_xlabel('Suburb Population for School Ages (in thousands)', fontsize=10)
-    fig.colorbar(g2, ax=ax2)
-        
-    plt.show()
 
+    if args.output_dir:
+        with AI3_Profile.stage('render'):
+            for path in render_years(school_age_tables, years, args.output_dir,
+                                     args.format, args.workers):
+                print(path)
+        sys.exit(0)
+
+    with AI3_Profile.stage('import matplotlib'):
+        plt, cm = import_pyplot()
+
+    with AI3_Profile.stage('plot'):
+        # plotting
+        if args.interactive:
+            browser = YearBrowser(plt, cm, school_age_tables, years, AGE_GROUPS,
+                                  year=the_year, age_group='junior')
+        else:
+            draw_figure(plt, cm, school_age_tables, the_year)
+
+    plt.show()